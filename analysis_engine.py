@@ -0,0 +1,97 @@
+# analysis_engine.py
+"""
+Regras das "Análises Específicas" calculadas em uma única passada.
+
+A partir do índice por cidade (city_index), faz um join das contagens de
+Empresas nas linhas de PCLs e das contagens de PCLs nas linhas de Empresas,
+e deriva as quatro regras de uma vez. O resultado é só de posições de linha
+(np.ndarray) e contagens por linha, pequeno o bastante para ficar em cache
+por snapshot; trocar de regra na tela vira um .iloc.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from city_index import city_counts
+
+# Identificadores das regras
+PCLS_SEM_EMPRESAS = 'pcls_sem_empresas'
+PCLS_EMPRESAS_INATIVAS = 'pcls_empresas_inativas'
+EMPRESAS_SEM_PCL = 'empresas_sem_pcl'
+EMPRESAS_PCLS_INATIVOS = 'empresas_pcls_inativos'
+
+# Resultado de uma regra: base ('labs' ou 'empresas'), posições das linhas (iloc)
+# e, para as regras de cidades inativas, a contagem de inativos da cidade por linha
+AnalysisResult = namedtuple('AnalysisResult', ['dataset', 'positions', 'inactive_counts'])
+
+
+def _empty(dataset):
+    return AnalysisResult(dataset, np.empty(0, dtype=np.int64), None)
+
+
+def run_analyses(index, df_empresas, df_labs) -> dict:
+    """
+    Calcula as quatro regras de uma vez.
+
+    - PCLS_SEM_EMPRESAS: PCLs em cidades sem nenhuma empresa credenciada
+    - PCLS_EMPRESAS_INATIVAS: PCLs em cidades com empresas, todas inativas
+    - EMPRESAS_SEM_PCL: empresas em cidades sem nenhum PCL credenciado
+    - EMPRESAS_PCLS_INATIVOS: empresas em cidades com PCLs, todos inativos
+
+    Returns:
+        {regra: AnalysisResult}
+    """
+    results = {}
+
+    if df_labs is None or df_labs.empty or df_empresas is None or df_empresas.empty:
+        for regra, dataset in ((PCLS_SEM_EMPRESAS, 'labs'), (PCLS_EMPRESAS_INATIVAS, 'labs'),
+                               (EMPRESAS_SEM_PCL, 'empresas'), (EMPRESAS_PCLS_INATIVOS, 'empresas')):
+            results[regra] = _empty(dataset)
+        return results
+
+    # Empresas na cidade de cada PCL
+    emp = city_counts(index, df_labs, ['empresas', 'empresas_ativas', 'empresas_inativas']).to_numpy()
+    total, ativas, inativas = emp[:, 0], emp[:, 1], emp[:, 2]
+    results[PCLS_SEM_EMPRESAS] = AnalysisResult('labs', np.flatnonzero(total == 0), None)
+    if 'status' in df_empresas.columns:
+        pos = np.flatnonzero((total > 0) & (ativas == 0))
+        results[PCLS_EMPRESAS_INATIVAS] = AnalysisResult('labs', pos, inativas[pos])
+    else:
+        results[PCLS_EMPRESAS_INATIVAS] = _empty('labs')
+
+    # PCLs na cidade de cada empresa
+    pcl = city_counts(index, df_empresas, ['pcls', 'pcls_ativos', 'pcls_inativos']).to_numpy()
+    total, ativos, inativos = pcl[:, 0], pcl[:, 1], pcl[:, 2]
+    results[EMPRESAS_SEM_PCL] = AnalysisResult('empresas', np.flatnonzero(total == 0), None)
+    if 'status' in df_labs.columns:
+        pos = np.flatnonzero((total > 0) & (ativos == 0))
+        results[EMPRESAS_PCLS_INATIVOS] = AnalysisResult('empresas', pos, inativos[pos])
+    else:
+        results[EMPRESAS_PCLS_INATIVOS] = _empty('empresas')
+
+    return results
+
+
+# Regras por distância (spatial_index.nearest_pcls)
+EMPRESAS_SEM_PCL_RAIO = 'empresas_sem_pcl_raio'
+EMPRESAS_PCLS_INATIVOS_RAIO = 'empresas_pcls_inativos_raio'
+
+
+def run_radius_analyses(proximidade) -> dict:
+    """
+    Versão por raio das regras 3 e 4, a partir das contagens de PCLs no raio
+    de cada empresa. Empresas sem coordenada (contagem -1) ficam fora das duas.
+
+    - EMPRESAS_SEM_PCL_RAIO: nenhum PCL a até N km
+    - EMPRESAS_PCLS_INATIVOS_RAIO: PCLs a até N km, todos inativos
+
+    Returns:
+        {regra: AnalysisResult}
+    """
+    no_raio = proximidade['pcls_no_raio'].to_numpy()
+    ativos_no_raio = proximidade['pcls_ativos_no_raio'].to_numpy()
+    pos = np.flatnonzero((no_raio > 0) & (ativos_no_raio == 0))
+    return {
+        EMPRESAS_SEM_PCL_RAIO: AnalysisResult('empresas', np.flatnonzero(no_raio == 0), None),
+        EMPRESAS_PCLS_INATIVOS_RAIO: AnalysisResult('empresas', pos, no_raio[pos]),
+    }
@@ -6,9 +6,26 @@ from datetime import datetime, timedelta
 import os
 from pathlib import Path
 import glob
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from collections import namedtuple
 import numpy as np
 from sp_connector import get_sp_connector
+from snapshot_cache import PARQUET_DISPONIVEL, snapshot_key, read_with_snapshot
+from data_processing import process_empresas, process_labs, optimize_dtypes, memory_mb
+from city_index import CITY_KEY, add_city_key, build_city_index, city_counts
+import analysis_engine
+from spatial_index import CENTROIDS_PATH, RAIO_PADRAO_KM, load_centroids, nearest_pcls
+import history_store
+import chart_builder
+from dataset_registry import Dataset, resolve
+from uf_cube import build_uf_cube, cube_by_uf, cube_status_by_uf, cube_totals, mean_of
+from listing_query import PAGE_SIZES, listing_order, page_bounds
+from search_index import build_search_index, search
+from filter_engine import (FILTER_COLUMNS, apply_selection, build_filter_index, build_hierarchy, column_values,
+                           hierarchy_children, merge_hierarchies, select_rows)
+from export_service import FORMATOS, ZIP_MIME, available_formats, export_bytes, zip_bytes
 
 # ============================================
 # CONFIGURAÇÃO DA PÁGINA
@@ -412,36 +429,56 @@ def create_section_header(icon, title, subtitle=""):
 # ============================================
 
 def create_bar_chart(df, x_col, y_col, title, max_items=12, color='#22C55E'):
-    """Cria gráfico de barras horizontal moderno"""
-    df_chart = df.copy()
-    df_chart = df_chart.sort_values(y_col, ascending=False).head(max_items)
-    df_chart = df_chart.sort_values(y_col, ascending=True)
-    
-    # Limpar valores NaN/None
-    df_chart[y_col] = df_chart[y_col].fillna(0)
-    df_chart[y_col] = df_chart[y_col].replace([np.inf, -np.inf], 0)
-    
+    """Cria gráfico de barras horizontal moderno (df já agregado)"""
+    return chart_builder.bar_figure(df[x_col], df[y_col], title, color=color, max_items=max_items, value_name=y_col)
+
+def create_grouped_bar_chart(df, x_col, title, colors=None, max_items=10):
+    """Cria gráfico de barras agrupadas (Ativos vs Inativos por x_col)"""
+    return chart_builder.grouped_bar_figure(chart_builder.status_counts(df, x_col), title, colors, max_items)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_figure(chart_id, filtros, snapshot_id, _montar):
+    """JSON da figura de _montar(), em cache por (gráfico, filtros, snapshot)"""
+    return chart_builder.figure_json(_montar())
+
+def show_chart(chart_id, snapshot_id, montar, filtros=()):
+    """
+    Exibe um gráfico Plotly montado só quando não está em cache.
+    montar: função sem argumentos que devolve a figura; filtros: estado dos filtros que afetam os dados.
+    """
+    figura = chart_builder.figure_from_json(cached_figure(chart_id, filtros, snapshot_id, montar))
+    st.plotly_chart(figura, use_container_width=True)
+
+def create_line_chart(df, x_col, series, title, color_col=None, kind='line'):
+    """
+    Cria gráfico temporal (linhas ou barras).
+
+    Args:
+        df: DataFrame já agregado
+        x_col: Coluna do eixo x (mês)
+        series: {coluna: (nome, cor)}; com color_col, uma única coluna de valores
+        color_col: Coluna que separa as séries (ex.: 'uf'); cores da paleta padrão
+        kind: 'line' ou 'bar'
+    """
     fig = go.Figure()
     
-    valores_x = [float(x) if pd.notna(x) and np.isfinite(x) else 0.0 for x in df_chart[y_col]]
-    valores_y = [str(y) if pd.notna(y) else "" for y in df_chart[x_col]]
-    
-    fig.add_trace(go.Bar(
-        x=valores_x,
-        y=valores_y,
-        orientation='h',
-        marker=dict(
-            color=color,
-            line=dict(width=0)
-        ),
-        text=[format_number(x) for x in valores_x],
-        textposition='outside',
-        textfont=dict(size=11, color='#3F3F46', family='Inter'),
-        hovertemplate=f'<b>%{{y}}</b><br>{y_col}: %{{x:,.0f}}<extra></extra>'
-    ))
-    
-    num_items = len(df_chart)
-    height = max(350, num_items * 32 + 80)
+    def add_trace(x, y, name, color):
+        y = [float(v) if pd.notna(v) and np.isfinite(v) else None for v in y]
+        if kind == 'bar':
+            fig.add_trace(go.Bar(x=list(x), y=y, name=name, marker=dict(color=color),
+                                 hovertemplate=f'<b>{name}</b><br>%{{x}}: %{{y:,.0f}}<extra></extra>'))
+        else:
+            fig.add_trace(go.Scatter(x=list(x), y=y, name=name, mode='lines+markers',
+                                     line=dict(color=color, width=2), marker=dict(size=6),
+                                     hovertemplate=f'<b>{name}</b><br>%{{x}}: %{{y:,.0f}}<extra></extra>'))
+    
+    if color_col is not None:
+        coluna = next(iter(series))
+        for valor, grupo in df.groupby(color_col, observed=True, sort=True):
+            add_trace(grupo[x_col], grupo[coluna], str(valor), None)
+    else:
+        for coluna, (nome, cor) in series.items():
+            add_trace(df[x_col], df[coluna], nome, cor)
     
     fig.update_layout(
         title=dict(
@@ -453,113 +490,23 @@ def create_bar_chart(df, x_col, y_col, title, max_items=12, color='#22C55E'):
         ),
         xaxis=dict(
             title="",
-            showgrid=True,
-            gridcolor='#F4F4F5',
+            type='category',
+            showgrid=False,
             showline=False,
-            zeroline=False,
             tickfont=dict(size=11, color='#71717A', family='Inter')
         ),
         yaxis=dict(
-            title="",
-            showline=False,
-            tickfont=dict(size=12, color='#3F3F46', family='Inter')
-        ),
-        plot_bgcolor='#FFFFFF',
-        paper_bgcolor='#FFFFFF',
-        height=height,
-        margin=dict(l=10, r=60, t=50, b=20),
-        showlegend=False,
-        font=dict(family='Inter')
-    )
-    
-    return fig
-
-def create_grouped_bar_chart(df, x_col, title, colors=None, max_items=10):
-    """Cria gráfico de barras agrupadas"""
-    if colors is None:
-        colors = {'Ativo': '#22C55E', 'Inativo': '#EF4444'}
-    
-    try:
-        df_chart = df.groupby([x_col, 'status']).size().reset_index(name='Quantidade')
-        df_pivot = df_chart.pivot(index=x_col, columns='status', values='Quantidade').fillna(0)
-        
-        # Garantir que valores sejam numéricos válidos
-        for col in df_pivot.columns:
-            df_pivot[col] = pd.to_numeric(df_pivot[col], errors='coerce').fillna(0)
-        
-        if 'Ativo' in df_pivot.columns and 'Inativo' in df_pivot.columns:
-            df_pivot['Total'] = df_pivot['Ativo'] + df_pivot['Inativo']
-        elif 'Ativo' in df_pivot.columns:
-            df_pivot['Total'] = df_pivot['Ativo']
-        else:
-            df_pivot['Total'] = 0
-        
-        df_pivot = df_pivot.sort_values('Total', ascending=False).head(max_items)
-        df_pivot = df_pivot.drop('Total', axis=1)
-        df_pivot = df_pivot.sort_values(df_pivot.columns[0] if len(df_pivot.columns) > 0 else df_pivot.index)
-    except Exception as e:
-        st.error(f"Erro ao processar dados para gráfico: {str(e)}")
-        return go.Figure()
-    
-    fig = go.Figure()
-    
-    if 'Ativo' in df_pivot.columns:
-        valores_ativos = [float(x) if pd.notna(x) and np.isfinite(x) else 0.0 for x in df_pivot['Ativo']]
-        fig.add_trace(go.Bar(
-            name='Ativos',
-            x=valores_ativos,
-            y=df_pivot.index,
-            orientation='h',
-            marker=dict(color=colors.get('Ativo', '#22C55E')),
-            text=[format_number(int(x)) for x in valores_ativos],
-            textposition='outside',
-            textfont=dict(size=10, color='#3F3F46', family='Inter'),
-            hovertemplate='<b>%{y}</b><br>Ativos: %{x:,.0f}<extra></extra>'
-        ))
-    
-    if 'Inativo' in df_pivot.columns:
-        valores_inativos = [float(x) if pd.notna(x) and np.isfinite(x) else 0.0 for x in df_pivot['Inativo']]
-        fig.add_trace(go.Bar(
-            name='Inativos',
-            x=valores_inativos,
-            y=df_pivot.index,
-            orientation='h',
-            marker=dict(color=colors.get('Inativo', '#EF4444')),
-            text=[format_number(int(x)) for x in valores_inativos],
-            textposition='outside',
-            textfont=dict(size=10, color='#3F3F46', family='Inter'),
-            hovertemplate='<b>%{y}</b><br>Inativos: %{x:,.0f}<extra></extra>'
-        ))
-    
-    num_items = len(df_pivot)
-    height = max(400, num_items * 40 + 100)
-    
-    fig.update_layout(
-        title=dict(
-            text=title,
-            font=dict(size=15, color='#18181B', family='Inter'),
-            x=0.5,
-            xanchor='center',
-            y=0.97
-        ),
-        xaxis=dict(
             title="",
             showgrid=True,
             gridcolor='#F4F4F5',
-            showline=False,
             zeroline=False,
             tickfont=dict(size=11, color='#71717A', family='Inter')
         ),
-        yaxis=dict(
-            title="",
-            showline=False,
-            tickfont=dict(size=12, color='#3F3F46', family='Inter')
-        ),
-        barmode='group',
+        barmode='relative',
         plot_bgcolor='#FFFFFF',
         paper_bgcolor='#FFFFFF',
-        height=height,
-        margin=dict(l=10, r=70, t=50, b=20),
+        height=400,
+        margin=dict(l=10, r=20, t=50, b=20),
         legend=dict(
             orientation="h",
             yanchor="bottom",
@@ -569,9 +516,7 @@ def create_grouped_bar_chart(df, x_col, title, colors=None, max_items=10):
             font=dict(size=12, color='#3F3F46', family='Inter'),
             bgcolor='rgba(255,255,255,0)'
         ),
-        font=dict(family='Inter'),
-        bargap=0.3,
-        bargroupgap=0.1
+        font=dict(family='Inter')
     )
     
     return fig
@@ -657,35 +602,20 @@ def get_latest_file_from_sp(sp_connector, folder_path: str):
         Tuple (caminho_completo, nome_arquivo, data_modificacao) ou (None, None, None) se não encontrar
     """
     try:
-        # Listar arquivos na pasta
-        files = sp_connector.list_files(folder_path)
-        
-        # Debug: verificar o que foi retornado
-        if not files:
-            return None, None, None
-        
-        # Filtrar apenas arquivos .xlsx
-        # Verificar se o item tem a propriedade "file" (indica que é arquivo, não pasta)
-        excel_files = []
-        for f in files:
-            # Verificar se é arquivo: tem propriedade "file" (mesmo que vazia) e NÃO tem "folder"
-            is_file = "file" in f and "folder" not in f
-            name = f.get("name", "")
-            # Verificar se termina com .xlsx (case insensitive)
-            if is_file and name.lower().endswith(".xlsx"):
-                excel_files.append(f)
-        
-        if not excel_files:
+        # Arquivo .xlsx mais recente: listagem paginada ordenada por data (para no primeiro)
+        # ou, se configurado, delta query incremental (custo proporcional às mudanças)
+        latest = sp_connector.latest_file(folder_path, ".xlsx")
+        if latest is None:
             return None, None, None
         
-        # Encontrar o arquivo mais recente pela data de modificação
-        latest = max(excel_files, key=lambda x: x.get("lastModifiedDateTime", ""))
-        
         # Construir caminho completo
         file_path = f"{folder_path}/{latest['name']}"
         file_name = latest['name']
         last_modified = latest.get("lastModifiedDateTime", "")
         
+        # Reaproveitar os metadados da listagem (id, eTag, tamanho) em stat()/download()
+        sp_connector.remember_stat(file_path, latest)
+        
         return file_path, file_name, last_modified
         
     except FileNotFoundError:
@@ -700,13 +630,15 @@ def get_latest_file_from_sp(sp_connector, folder_path: str):
 
 @st.cache_data
 def load_data():
-    """Carrega o arquivo Excel mais recente de cada pasta do SharePoint/OneDrive ou localmente"""
-    empresas_data = None
-    labs_data = None
-    empresas_file = None
-    labs_file = None
-    errors = []
-    
+    """
+    Carrega o arquivo Excel mais recente de cada pasta do SharePoint/OneDrive ou localmente.
+
+    Empresas e Labs são independentes: cada um é listado, baixado e lido em uma thread
+    própria (compartilhando a sessão HTTP do SPConnector). Só listagem e download
+    (I/O) se sobrepõem: o parse do Excel (openpyxl, Python puro) segura o GIL, então
+    numa carga a frio os dois parses praticamente se somam. Os tempos de cada etapa ficam em
+    file_info['timings'], com o parse somado das duas bases em timings['parse'].
+    """
     def read_excel_safe(file_path):
         """Tenta ler Excel com tratamento de erro de permissão"""
         try:
@@ -727,7 +659,7 @@ def load_data():
             # Re-raise outros erros sem modificar
             raise e
     
-    # Tentar conectar ao SharePoint/OneDrive
+    # Tentar conectar ao SharePoint/OneDrive (na thread principal: usa st.secrets/st.session_state)
     sp_connector = None
     try:
         sp_connector = get_sp_connector()
@@ -735,96 +667,106 @@ def load_data():
         # Erro ao criar conexão - usar fallback local
         pass
     
-    # Se conectado ao SharePoint, buscar arquivos lá
-    if sp_connector is not None:
-        try:
-            # Buscar arquivo mais recente de Empresas
-            empresas_path_sp, empresas_name, empresas_date = get_latest_file_from_sp(
-                sp_connector, 
-                "Data Analysis/Acumulado de Coletas - Empresas"
-            )
-            
-            if empresas_path_sp:
-                try:
-                    empresas_data = sp_connector.read_excel(empresas_path_sp, engine='openpyxl')
-                    # Criar objeto simples para manter compatibilidade com file_info
-                    empresas_file = type('FileInfo', (), {'name': empresas_name})()
-                except Exception as e:
-                    errors.append(f"Erro ao carregar {empresas_name} do SharePoint: {e}")
-                    # Tentar fallback local
-                    empresas_path_sp = None
-            else:
-                # Tentar listar arquivos para debug
-                try:
-                    debug_files = sp_connector.list_files("Data Analysis/Acumulado de Coletas - Empresas")
-                    if debug_files:
-                        file_names = [f.get('name', 'N/A') for f in debug_files]
-                        errors.append(f"⚠️ Nenhum arquivo Excel encontrado em 'Data Analysis/Acumulado de Coletas - Empresas' no SharePoint. Arquivos encontrados: {', '.join(file_names[:5])}")
-                    else:
-                        errors.append("⚠️ Pasta 'Data Analysis/Acumulado de Coletas - Empresas' não encontrada ou vazia no SharePoint")
-                except Exception as debug_e:
-                    errors.append(f"⚠️ Erro ao acessar pasta 'Data Analysis/Acumulado de Coletas - Empresas' no SharePoint: {debug_e}")
-            
-            # Buscar arquivo mais recente de Labs
-            labs_path_sp, labs_name, labs_date = get_latest_file_from_sp(
-                sp_connector,
-                "Data Analysis/Acumulado de Coletas - Labs"
-            )
-            
-            if labs_path_sp:
-                try:
-                    labs_data = sp_connector.read_excel(labs_path_sp, engine='openpyxl')
-                    # Criar objeto simples para manter compatibilidade com file_info
-                    labs_file = type('FileInfo', (), {'name': labs_name})()
-                except Exception as e:
-                    errors.append(f"Erro ao carregar {labs_name} do SharePoint: {e}")
-                    # Tentar fallback local
-                    labs_path_sp = None
-            else:
-                # Tentar listar arquivos para debug
-                try:
-                    debug_files = sp_connector.list_files("Data Analysis/Acumulado de Coletas - Labs")
-                    if debug_files:
-                        file_names = [f.get('name', 'N/A') for f in debug_files]
-                        errors.append(f"⚠️ Nenhum arquivo Excel encontrado em 'Data Analysis/Acumulado de Coletas - Labs' no SharePoint. Arquivos encontrados: {', '.join(file_names[:5])}")
-                    else:
-                        errors.append("⚠️ Pasta 'Data Analysis/Acumulado de Coletas - Labs' não encontrada ou vazia no SharePoint")
-                except Exception as debug_e:
-                    errors.append(f"⚠️ Erro ao acessar pasta 'Data Analysis/Acumulado de Coletas - Labs' no SharePoint: {debug_e}")
+    def load_dataset(dataset, label):
+        """
+        Carrega um dataset ("empresas" ou "labs"): SharePoint primeiro, fallback local.
+        Executa em thread própria; não chama funções do Streamlit.
+        """
+        sp_folder = f"Data Analysis/Acumulado de Coletas - {label}"
+        result = {'data': None, 'file': None, 'key': None, 'hit': False, 'errors': [], 'timings': {}}
+        errors = result['errors']
+        timings = result['timings']
+        inicio = time.perf_counter()
+        
+        # Se conectado ao SharePoint, buscar arquivo lá
+        if sp_connector is not None:
+            try:
+                t0 = time.perf_counter()
+                path_sp, name_sp, date_sp = get_latest_file_from_sp(sp_connector, sp_folder)
+                timings['listagem'] = time.perf_counter() - t0
                 
-        except Exception as e:
-            errors.append(f"Erro ao acessar SharePoint: {e}")
-            # Continuar com fallback local
-    
-    # Fallback: buscar arquivos localmente se não encontrados no SharePoint
-    if empresas_data is None:
-        empresas_path = Path("Acumulado de Coletas - Empresas")
-        if empresas_path.exists():
-            excel_files = list(empresas_path.glob("*.xlsx"))
-            if excel_files:
-                empresas_file = max(excel_files, key=lambda f: f.stat().st_mtime)
-                try:
-                    empresas_data = read_excel_safe(empresas_file)
-                except PermissionError as e:
-                    errors.append(f"⚠️ **ERRO DE PERMISSÃO:** O arquivo '{empresas_file.name}' está aberto em outro programa (provavelmente Excel). Por favor, **feche o arquivo** e recarregue esta página (F5).")
-                except Exception as e:
-                    errors.append(f"Erro ao carregar {empresas_file.name}: {e}")
-    
-    if labs_data is None:
-        labs_path = Path("Acumulado de Coletas - Labs")
-        if labs_path.exists():
-            excel_files = list(labs_path.glob("*.xlsx"))
-            if excel_files:
-                labs_file = max(excel_files, key=lambda f: f.stat().st_mtime)
-                try:
-                    labs_data = read_excel_safe(labs_file)
-                except PermissionError as e:
-                    errors.append(f"⚠️ **ERRO DE PERMISSÃO:** O arquivo '{labs_file.name}' está aberto em outro programa (provavelmente Excel). Por favor, **feche o arquivo** e recarregue esta página (F5).")
-                except Exception as e:
-                    errors.append(f"Erro ao carregar {labs_file.name}: {e}")
-    
-    df_empresas = empresas_data if empresas_data is not None else pd.DataFrame()
-    df_labs = labs_data if labs_data is not None else pd.DataFrame()
+                if path_sp:
+                    def load_from_sp():
+                        t0 = time.perf_counter()
+                        content = sp_connector.download(path_sp)
+                        timings['download'] = time.perf_counter() - t0
+                        t0 = time.perf_counter()
+                        df = pd.read_excel(BytesIO(content), engine='openpyxl')
+                        timings['parse'] = time.perf_counter() - t0
+                        return df
+                    
+                    try:
+                        # Snapshot Parquet chaveado por nome + tamanho + lastModifiedDateTime (evita download e parse)
+                        # stat() reaproveita os metadados da listagem: nenhuma requisição extra
+                        size_sp = sp_connector.stat(path_sp).get('size')
+                        key = snapshot_key(path_sp, size_sp, date_sp)
+                        t0 = time.perf_counter()
+                        result['data'], result['hit'] = read_with_snapshot(dataset, key, load_from_sp)
+                        timings['leitura'] = time.perf_counter() - t0
+                        result['key'] = key
+                        # Criar objeto simples para manter compatibilidade com file_info
+                        result['file'] = type('FileInfo', (), {'name': name_sp})()
+                    except Exception as e:
+                        errors.append(f"Erro ao carregar {name_sp} do SharePoint: {e}")
+                else:
+                    # Tentar listar arquivos para debug
+                    try:
+                        debug_files = sp_connector.list_files(sp_folder)
+                        if debug_files:
+                            file_names = [f.get('name', 'N/A') for f in debug_files]
+                            errors.append(f"⚠️ Nenhum arquivo Excel encontrado em '{sp_folder}' no SharePoint. Arquivos encontrados: {', '.join(file_names[:5])}")
+                        else:
+                            errors.append(f"⚠️ Pasta '{sp_folder}' não encontrada ou vazia no SharePoint")
+                    except Exception as debug_e:
+                        errors.append(f"⚠️ Erro ao acessar pasta '{sp_folder}' no SharePoint: {debug_e}")
+            except Exception as e:
+                errors.append(f"Erro ao acessar SharePoint: {e}")
+                # Continuar com fallback local
+        
+        # Fallback: buscar arquivo localmente se não encontrado no SharePoint
+        if result['data'] is None:
+            local_path = Path(f"Acumulado de Coletas - {label}")
+            if local_path.exists():
+                excel_files = list(local_path.glob("*.xlsx"))
+                if excel_files:
+                    local_file = max(excel_files, key=lambda f: f.stat().st_mtime)
+                    result['file'] = local_file
+                    try:
+                        stat = local_file.stat()
+                        key = snapshot_key(local_file.name, stat.st_size, stat.st_mtime_ns)
+                        t0 = time.perf_counter()
+                        def load_local():
+                            t0 = time.perf_counter()
+                            df = read_excel_safe(local_file)
+                            timings['parse'] = time.perf_counter() - t0
+                            return df
+                        
+                        result['data'], result['hit'] = read_with_snapshot(dataset, key, load_local)
+                        timings['leitura'] = time.perf_counter() - t0
+                        result['key'] = key
+                    except PermissionError as e:
+                        errors.append(f"⚠️ **ERRO DE PERMISSÃO:** O arquivo '{local_file.name}' está aberto em outro programa (provavelmente Excel). Por favor, **feche o arquivo** e recarregue esta página (F5).")
+                    except Exception as e:
+                        errors.append(f"Erro ao carregar {local_file.name}: {e}")
+        
+        timings['total'] = time.perf_counter() - inicio
+        return result
+    
+    # Empresas e Labs em paralelo
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="load_data") as pool:
+        future_empresas = pool.submit(load_dataset, "empresas", "Empresas")
+        future_labs = pool.submit(load_dataset, "labs", "Labs")
+        empresas = future_empresas.result()
+        labs = future_labs.result()
+    tempo_total = time.perf_counter() - inicio
+    
+    errors = empresas['errors'] + labs['errors']
+    empresas_file = empresas['file']
+    labs_file = labs['file']
+    
+    df_empresas = empresas['data'] if empresas['data'] is not None else pd.DataFrame()
+    df_labs = labs['data'] if labs['data'] is not None else pd.DataFrame()
     
     # Determinar origem dos arquivos (SharePoint ou Local)
     # Verificar se veio do SharePoint (objeto criado dinamicamente, não Path)
@@ -850,223 +792,464 @@ def load_data():
         'labs_file': str(labs_file.name) if labs_file and hasattr(labs_file, 'name') else None,
         'empresas_source': empresas_source,
         'labs_source': labs_source,
+        # Identificador do snapshot carregado (muda quando um arquivo mais novo é encontrado)
+        'snapshot_id': f"{empresas['key'] if empresas['data'] is not None else '-'}:{labs['key'] if labs['data'] is not None else '-'}",
+        'snapshot_keys': {'empresas': empresas['key'], 'labs': labs['key']},
+        'empresas_snapshot_hit': empresas['hit'],
+        'labs_snapshot_hit': labs['hit'],
+        # Tempos por etapa (segundos): listagem, download, parse, leitura, total
+        'timings': {
+            'empresas': empresas['timings'],
+            'labs': labs['timings'],
+            'total': tempo_total,
+            # Parse do Excel somado das duas bases (quase não se sobrepõe: segura o GIL)
+            'parse': empresas['timings'].get('parse', 0) + labs['timings'].get('parse', 0),
+        },
     }
     
     return df_empresas, df_labs, errors, file_info
 
-def normalize_column_names(df):
-    """Normaliza nomes de colunas baseado nas colunas reais dos arquivos Excel"""
-    df = df.copy()
-    df.columns = df.columns.str.strip().str.lower()
-    
-    # Mapeamento baseado nas colunas reais dos arquivos Excel
-    # Inclui versões com e sem acentos para compatibilidade de encoding
-    column_mapping = {
-        # Identificação - Empresas
-        'cnpj da empresa': 'cnpj',
-        'cnpj': 'cnpj',
-        'nome da empresa': 'razao_social',
-        'razao social': 'razao_social',
-        'razão social': 'razao_social',
-        'nome fantasia': 'nome_fantasia',
-        # Datas
-        'data de credenciamento': 'data_credenciamento',
-        'data credenciamento': 'data_credenciamento',
-        'data da última coleta': 'data_ultima_coleta',
-        'data da ultima coleta': 'data_ultima_coleta',
-        'data última coleta': 'data_ultima_coleta',
-        'última coleta (voucher)': 'ultima_coleta_voucher',
-        'ultima coleta (voucher)': 'ultima_coleta_voucher',
-        'última coleta (não-voucher)': 'ultima_coleta_nao_voucher',
-        'ultima coleta (nao-voucher)': 'ultima_coleta_nao_voucher',
-        # Dias sem coleta
-        'dias sem coleta': 'dias_sem_coleta',
-        'dias sem coleta (voucher)': 'dias_sem_coleta_voucher',
-        'dias sem coleta (não-voucher)': 'dias_sem_coleta_nao_voucher',
-        'dias sem coleta (nao-voucher)': 'dias_sem_coleta_nao_voucher',
-        # Localização
-        'cidade': 'cidade',
-        'estado': 'uf',
-        'uf': 'uf',
-        'representante': 'representante',
-        # Vouchers/Coletas - Empresas
-        'acumulado coletas voucher': 'acumulado_vouchers',
-        'acumulado coletas não-voucher': 'acumulado_coletas_nao_voucher',
-        'acumulado coletas nao-voucher': 'acumulado_coletas_nao_voucher',
-        'total coletas voucher 2024': 'vouchers_2024',
-        'total coletas voucher 2025': 'vouchers_2025',
-        'total coletas não-voucher 2024': 'coletas_nao_voucher_2024',
-        'total coletas nao-voucher 2024': 'coletas_nao_voucher_2024',
-        'total coletas não-voucher 2025': 'coletas_nao_voucher_2025',
-        'total coletas nao-voucher 2025': 'coletas_nao_voucher_2025',
-        # Coletas - PCLs
-        'acumulado de coletas': 'acumulado_coletas',
-        'total de coletas 2024': 'coletas_2024',
-        'total de coletas 2025': 'coletas_2025',
-    }
-    
-    # Aplicar mapeamento direto
-    for old_name, new_name in column_mapping.items():
-        if old_name in df.columns:
-            df.rename(columns={old_name: new_name}, inplace=True)
-    
-    # Fallback: procurar por colunas que contenham termos-chave (para lidar com encoding)
-    for col in list(df.columns):  # Usar list() para evitar modificar durante iteração
-        col_lower = col.lower()
-        # Mapeamentos específicos por substring (lidar com diferentes encodings)
-        if 'razao_social' not in df.columns and ('raz' in col_lower and 'social' in col_lower):
-            df.rename(columns={col: 'razao_social'}, inplace=True)
-        elif 'nome_fantasia' not in df.columns and 'nome fantasia' in col_lower:
-            df.rename(columns={col: 'nome_fantasia'}, inplace=True)
-        elif 'data_ultima_coleta' not in df.columns and 'ltima coleta' in col_lower and 'voucher' not in col_lower:
-            df.rename(columns={col: 'data_ultima_coleta'}, inplace=True)
-        elif 'ultima_coleta_voucher' not in df.columns and 'ltima coleta' in col_lower and 'voucher' in col_lower and 'n' not in col_lower.split('voucher')[0][-5:]:
-            df.rename(columns={col: 'ultima_coleta_voucher'}, inplace=True)
-        elif 'ultima_coleta_nao_voucher' not in df.columns and 'ltima coleta' in col_lower and 'voucher' in col_lower and ('n' in col_lower.split('voucher')[0][-5:] or 'nao' in col_lower or 'não' in col_lower):
-            df.rename(columns={col: 'ultima_coleta_nao_voucher'}, inplace=True)
-        elif 'dias_sem_coleta_voucher' not in df.columns and 'dias sem coleta' in col_lower and 'voucher' in col_lower and 'n' not in col_lower.split('voucher')[0][-5:]:
-            df.rename(columns={col: 'dias_sem_coleta_voucher'}, inplace=True)
-        elif 'dias_sem_coleta_nao_voucher' not in df.columns and 'dias sem coleta' in col_lower and 'voucher' in col_lower and ('n' in col_lower.split('voucher')[0][-5:] or 'nao' in col_lower or 'não' in col_lower):
-            df.rename(columns={col: 'dias_sem_coleta_nao_voucher'}, inplace=True)
-    
-    return df
+# Processamento de cada base bruta
+PROCESSADORES = {"empresas": process_empresas, "labs": process_labs}
 
-def process_empresas(df_empresas):
+# ============================================
+# LISTA DE EXCEÇÕES - CNPJs a serem excluídos das análises
+# ============================================
+# CNPJs da própria empresa que não devem ser contabilizados
+CNPJS_EXCLUIDOS = [
+    '07.339.867/0001-15',  # CAEP - CENTRO AVANÇADO DE ESTUDOS E PESQUISA LTDA (nosso CNPJ)
+]
+
+# Base processada: DataFrame, memória (MB antes, MB depois) e PCLs excluídos (CNPJS_EXCLUIDOS)
+BaseProcessada = namedtuple('BaseProcessada', ['df', 'memoria', 'excluidos'])
+
+def exclude_cnpjs(dataset, df):
+    """Remove os CNPJS_EXCLUIDOS dos PCLs; devolve (df, quantidade removida)"""
+    if dataset != "labs" or df.empty or 'cnpj' not in df.columns:
+        return df, 0
+    df_restante = df[~df['cnpj'].isin(CNPJS_EXCLUIDOS)]
+    return df_restante, len(df) - len(df_restante)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_dataset(dataset, _df_raw, snapshot_key):
     """
-    Processa dados de empresas.
-    
-    CRITÉRIO DE ATIVIDADE:
-    Uma empresa é considerada ATIVA se:
-    - Última Coleta (Voucher) <= 365 dias OU
-    - Última Coleta (Não-Voucher) <= 365 dias OU
-    - Dias Sem Coleta (Voucher) <= 365 OU
-    - Dias Sem Coleta (Não-Voucher) <= 365
-    
-    MÉTRICAS CALCULADAS:
-    - acumulado_coletas_total: Voucher + Não-Voucher
-    - coletas_2025: Voucher 2025 + Não-Voucher 2025
-    - status: Ativo/Inativo baseado nos critérios acima
+    Processa uma base ("empresas" ou "labs") uma vez por snapshot do seu arquivo:
+    processamento, tipos compactos (optimize_dtypes), chave de cidade (add_city_key)
+    e, nos PCLs, exclusão dos CNPJs internos.
+    cache_resource: a base é só leitura e é compartilhada sem cópia entre reruns.
+
+    Args:
+        dataset: Chave de PROCESSADORES
+        _df_raw: DataFrame bruto de load_data (não entra no hash)
+        snapshot_key: file_info['snapshot_keys'][dataset] - chave do cache
+
+    Returns:
+        BaseProcessada
     """
-    if df_empresas.empty:
-        return df_empresas
-    
-    df = normalize_column_names(df_empresas)
-    
-    # Garantir que colunas numéricas existam e sejam numéricas
-    if 'acumulado_vouchers' in df.columns:
-        df['acumulado_vouchers'] = pd.to_numeric(df['acumulado_vouchers'], errors='coerce').fillna(0)
-    else:
-        df['acumulado_vouchers'] = 0
+    df = PROCESSADORES[dataset](_df_raw)
+    antes = memory_mb(df)
+    df = add_city_key(optimize_dtypes(df))
+    memoria = (antes, memory_mb(df))
+    df, excluidos = exclude_cnpjs(dataset, df)
+    return BaseProcessada(df, memoria, excluidos)
+
+def prepare_dataset(dataset, df_raw):
+    """
+    Mesmo pipeline de get_dataset para um único DataFrame bruto (usado no histórico),
+    já sem os CNPJs excluídos dos PCLs, para os agregados baterem com o painel.
+    """
+    return exclude_cnpjs(dataset, add_city_key(optimize_dtypes(PROCESSADORES[dataset](df_raw))))[0]
+
+def history_sources(sp_connector, label):
+    """
+    Todos os .xlsx da pasta do dataset (SharePoint se conectado, senão local), como
+    fontes para history_store.ingest_sources. As chaves seguem as de load_data.
+    """
+    if sp_connector is not None:
+        sp_folder = f"Data Analysis/Acumulado de Coletas - {label}"
+        try:
+            itens = [i for i in sp_connector.list_files(sp_folder) if sp_connector.is_file_with_ext(i, ".xlsx")]
+        except Exception as e:
+            print(f"Histórico: não foi possível listar '{sp_folder}' no SharePoint: {e}")
+            itens = []
+        if itens:
+            fontes = []
+            for item in itens:
+                path_sp = f"{sp_folder}/{item['name']}"
+                sp_connector.remember_stat(path_sp, item)
+                modificado = item.get("lastModifiedDateTime", "")
+                fontes.append({
+                    'key': snapshot_key(path_sp, item.get('size'), modificado),
+                    'name': item['name'],
+                    'modified': modificado,
+                    'load': lambda p=path_sp: pd.read_excel(BytesIO(sp_connector.download(p)), engine='openpyxl'),
+                })
+            return fontes
+    
+    local_path = Path(f"Acumulado de Coletas - {label}")
+    if not local_path.exists():
+        return []
+    fontes = []
+    for local_file in local_path.glob("*.xlsx"):
+        stat = local_file.stat()
+        fontes.append({
+            'key': snapshot_key(local_file.name, stat.st_size, stat.st_mtime_ns),
+            'name': local_file.name,
+            'modified': stat.st_mtime_ns,
+            'load': lambda f=local_file: pd.read_excel(f, engine='openpyxl'),
+        })
+    return fontes
+
+@st.cache_data(show_spinner=False)
+def sync_history(_df_empresas_raw, _df_labs_raw, snapshot_id, snapshot_keys, usa_sharepoint, lote=0):
+    """
+    Ingestão incremental no histórico mensal (history_store), uma vez por snapshot e lote:
+    cada .xlsx entra uma única vez, na partição do seu mês de referência, e no máximo
+    history_store.SOURCES_PER_RUN arquivos por base são ingeridos por chamada. O arquivo
+    do snapshot atual reaproveita o DataFrame bruto já carregado em vez de ser relido.
+    O SharePoint só é listado se a carga atual veio dele (usa_sharepoint). lote só
+    entra na chave do cache: Tendências o incrementa para ingerir o lote seguinte.
+
+    Returns:
+        ({dataset: {'meses': [...], 'ingeridos': [resumos], 'pendentes': n}}, erros)
+    """
+    if not PARQUET_DISPONIVEL:
+        return {}, []
     
-    if 'acumulado_coletas_nao_voucher' in df.columns:
-        df['acumulado_coletas_nao_voucher'] = pd.to_numeric(df['acumulado_coletas_nao_voucher'], errors='coerce').fillna(0)
-    else:
-        df['acumulado_coletas_nao_voucher'] = 0
-    
-    # Total de coletas (Voucher + Não-Voucher)
-    df['acumulado_coletas_total'] = df['acumulado_vouchers'] + df['acumulado_coletas_nao_voucher']
-    
-    # Coletas 2025 (Voucher + Não-Voucher)
-    vouchers_2025 = pd.to_numeric(df.get('vouchers_2025', 0), errors='coerce').fillna(0)
-    nao_voucher_2025 = pd.to_numeric(df.get('coletas_nao_voucher_2025', 0), errors='coerce').fillna(0)
-    df['coletas_2025'] = vouchers_2025 + nao_voucher_2025
-    
-    # Calcular status baseado em AMBOS os tipos de coleta
-    # Usar a coluna "Dias Sem Coleta" que já existe no Excel
-    dias_voucher = pd.to_numeric(df.get('dias_sem_coleta_voucher', pd.Series([9999]*len(df))), errors='coerce').fillna(9999)
-    dias_nao_voucher = pd.to_numeric(df.get('dias_sem_coleta_nao_voucher', pd.Series([9999]*len(df))), errors='coerce').fillna(9999)
-    
-    # Empresa ativa: menor dos dois dias <= 365
-    df['dias_sem_coleta_min'] = pd.concat([dias_voucher, dias_nao_voucher], axis=1).min(axis=1)
-    df['status'] = df['dias_sem_coleta_min'].apply(lambda x: 'Ativo' if x <= 365 else 'Inativo')
-    
-    # Fallback: se não tem dias mas tem coletas > 0, considerar ativo
-    df.loc[(df['dias_sem_coleta_min'] > 365) & (df['acumulado_coletas_total'] > 0), 'status'] = 'Ativo'
-    
-    # Última coleta (a mais recente entre voucher e não-voucher)
-    if 'ultima_coleta_voucher' in df.columns:
-        df['ultima_coleta_voucher'] = pd.to_datetime(df['ultima_coleta_voucher'], errors='coerce', dayfirst=True)
-    if 'ultima_coleta_nao_voucher' in df.columns:
-        df['ultima_coleta_nao_voucher'] = pd.to_datetime(df['ultima_coleta_nao_voucher'], errors='coerce', dayfirst=True)
-    
-    # Criar coluna de última coleta geral (a mais recente)
-    if 'ultima_coleta_voucher' in df.columns and 'ultima_coleta_nao_voucher' in df.columns:
-        df['ultima_coleta'] = df[['ultima_coleta_voucher', 'ultima_coleta_nao_voucher']].max(axis=1)
-    elif 'ultima_coleta_nao_voucher' in df.columns:
-        df['ultima_coleta'] = df['ultima_coleta_nao_voucher']
-    elif 'ultima_coleta_voucher' in df.columns:
-        df['ultima_coleta'] = df['ultima_coleta_voucher']
+    sp_connector = None
+    if usa_sharepoint:
+        try:
+            sp_connector = get_sp_connector()
+        except Exception:
+            pass
+    
+    status, erros = {}, []
+    for dataset, label, df_raw in (("empresas", "Empresas", _df_empresas_raw), ("labs", "Labs", _df_labs_raw)):
+        fontes = history_sources(sp_connector, label)
+        for fonte in fontes:
+            if fonte['key'] == snapshot_keys.get(dataset) and not df_raw.empty:
+                fonte['load'] = lambda df=df_raw: df
+        resumos, erros_dataset, pendentes = history_store.ingest_sources(
+            dataset, fontes, lambda df, dataset=dataset: prepare_dataset(dataset, df)
+        )
+        erros.extend(erros_dataset)
+        status[dataset] = {'meses': history_store.months(dataset), 'ingeridos': resumos, 'pendentes': pendentes}
+    return status, erros
+
+@st.cache_data(show_spinner=False)
+def get_trends(dataset, meses, ufs, versao):
+    """
+    Agregados mensais por UF do histórico com as variações mês a mês.
+    Lê só os agregados dos meses pedidos (nunca as partições completas).
+    versao (history_store.version) só entra na chave: muda quando um lote é
+    ingerido ou a fonte de um mês é substituída, mesmo sem novo snapshot.
+    """
+    agregados = history_store.read_aggregates(dataset, list(meses), list(ufs) if ufs else None)
+    if agregados.empty:
+        return agregados
+    return history_store.monthly_deltas(agregados)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_export(_montar, formato, sheet_name, cache_key, pacote=False):
+    """
+    Bytes do arquivo exportado, um por cache_key (módulo, filtros, snapshot) e formato.
+    _montar: DataFrame ou função sem argumentos que o devolve (no pacote, {arquivo: (DataFrame, aba)}).
+    """
+    dados = _montar() if callable(_montar) else _montar
+    if pacote:
+        return zip_bytes(dados, formato)
+    return export_bytes(dados, formato, sheet_name)
+
+def export_download(montar, sheet_name, nome_base, cache_key, pacote=False):
+    """
+    Exportação sob demanda: escolha do formato (Excel, CSV, Parquet) e botão "Gerar";
+    o arquivo só é montado depois do clique e fica em cache por cache_key + formato,
+    então reruns seguintes só reexibem o download. Com pacote=True o resultado é um
+    .zip com um arquivo por tabela.
+    """
+    widget_key = "export_" + "|".join(str(parte) for parte in cache_key)
+    formato = st.radio("Formato", available_formats(), horizontal=True,
+                       key=f"formato_{widget_key}", label_visibility="collapsed")
+    extensao, mime = ('zip', ZIP_MIME) if pacote else FORMATOS[formato]
+    
+    gerados = st.session_state.setdefault('exports_gerados', set())
+    gerado_key = f"{widget_key}|{formato}"
+    if gerado_key not in gerados:
+        if not st.button(f"📄 Gerar {formato}", key=f"gerar_{gerado_key}"):
+            return
+        gerados.add(gerado_key)
+    with st.spinner(f"Gerando {formato}..."):
+        data = build_export(montar, formato, sheet_name, cache_key, pacote)
+    st.download_button(f"📥 Download {extensao.upper() if pacote else formato}", data,
+                       f'{nome_base}_{datetime.now().strftime("%Y%m%d")}.{extensao}', mime,
+                       key=f"download_{gerado_key}")
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_search_index(_df_base, listagem, snapshot_id):
+    """
+    Índice invertido da base completa (PCLs ou Empresas), um por snapshot.
+    cache_resource: o índice é só leitura e é compartilhado sem cópia entre reruns.
+    """
+    return build_search_index(_df_base)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_listing_order(_df, _df_base, listagem, filtros, snapshot_id, busca, ordenar_por, crescente):
+    """Ordem das linhas (posições) de uma listagem por estado de filtro/busca/ordenação"""
+    linhas = None
+    if busca:
+        linhas = _df_base.index[search(get_search_index(_df_base, listagem, snapshot_id), busca)]
+    return listing_order(_df, linhas, ordenar_por, crescente)
+
+def paginated_table(df, df_base, colunas_desejadas, rename_map, listagem, filtros, snapshot_id):
+    """
+    Listagem paginada: busca (índice invertido de df_base por CNPJ, Razão Social e
+    Nome Fantasia), ordenação e tamanho de página resolvidos no servidor. df é a listagem
+    enriquecida em cache (get_listing_frame), reaproveitada sem cópia a cada interação; só a
+    página visível é montada (prepare_display_dataframe) e enviada ao navegador, e a ordem
+    das linhas fica em cache por estado de filtro.
+
+    Returns:
+        Quantidade de linhas que passaram na busca
+    """
+    colunas = [c for c in dict.fromkeys(colunas_desejadas) if c in df.columns]
+    rotulos = {rename_map.get(c, c): c for c in colunas}
     
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+    with col1:
+        busca = st.text_input("Buscar", key=f"busca_{listagem}", placeholder="CNPJ, Razão Social ou Nome Fantasia")
+    with col2:
+        ordenar = st.selectbox("Ordenar por", ["(original)"] + list(rotulos), key=f"ordem_{listagem}")
+    with col3:
+        crescente = st.selectbox("Ordem", ["Crescente", "Decrescente"], key=f"sentido_{listagem}") == "Crescente"
+    with col4:
+        tamanho = st.selectbox("Linhas", PAGE_SIZES, index=1, key=f"tamanho_{listagem}")
+    
+    ordenar_por = rotulos.get(ordenar)
+    ordem = get_listing_order(df, df_base, listagem, filtros, snapshot_id, busca.strip(), ordenar_por, crescente)
+    
+    # Nova busca/ordenação/filtro volta para a primeira página
+    pagina_key = f"pagina_{listagem}"
+    consulta = (filtros, busca.strip(), ordenar_por, crescente, tamanho)
+    if st.session_state.get(f"consulta_{listagem}") != consulta:
+        st.session_state[f"consulta_{listagem}"] = consulta
+        st.session_state[pagina_key] = 1
+    
+    _, _, paginas = page_bounds(len(ordem), 1, tamanho)
+    if len(ordem) == 0:
+        st.info("Nenhum registro encontrado para a busca.")
+        return 0
+    
+    pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, step=1, key=pagina_key)
+    inicio, fim, _ = page_bounds(len(ordem), pagina, tamanho)
+    df_pagina = prepare_display_dataframe(df.iloc[ordem[inicio:fim]], colunas, rename_map)
+    st.dataframe(df_pagina, use_container_width=True, hide_index=True,
+                 height=min(500, 38 + 35 * len(df_pagina)))
+    st.caption(f"Mostrando {format_number(inicio + 1)}–{format_number(fim)} de {format_number(len(ordem))}")
+    return len(ordem)
+
+def export_frame(df, colunas_desejadas, rename_map):
+    """
+    Tabela exportada das listagens: as colunas exibidas primeiro, com os nomes de
+    exibição (mesmos colunas_desejadas/rename_map da tela), seguidas das demais
+    colunas calculadas, sem a chave interna de cidade.
+    """
+    extras = [c for c in df.columns if c not in colunas_desejadas and c != CITY_KEY]
+    return prepare_display_dataframe(df, list(colunas_desejadas) + extras, rename_map)
+
+def _cidade_uf(df):
+    """Colunas novas com Cidade-UF (vazio se faltar cidade ou UF)"""
+    if 'cidade' in df.columns and 'uf' in df.columns:
+        return {'cidade_uf': df['cidade'].astype(object).fillna('') + '-' + df['uf'].astype(object).fillna('')}
+    return {}
+
+def pcl_listing_frame(df, cidades):
+    """
+    Listagem de PCLs com as colunas calculadas (Cidade-UF e Empresas na cidade).
+    Não altera nem copia df: as colunas novas são acrescentadas numa visão (assign/join).
+    cidades: (índice por cidade só de Empresas, colunas de contagem) de 'cidades_empresas'
+    """
+    indice_empresas, colunas_cidade = cidades
+    df = df.assign(**_cidade_uf(df))
+    if CITY_KEY in df.columns and colunas_cidade:
+        df = df.join(city_counts(indice_empresas, df, colunas_cidade).rename(columns=colunas_cidade))
     return df
 
-def process_labs(df_labs):
+def empresa_listing_frame(df, cidades):
     """
-    Processa dados de labs (PCLs).
-    
-    CRITÉRIO DE ATIVIDADE:
-    Um PCL é considerado ATIVO se:
-    - Dias sem coleta <= 90 OU
-    - Acumulado de Coletas > 0
-    
-    Usa as colunas do Excel:
-    - 'Ativo em Coletas' (booleano)
-    - 'Dias sem coleta' (número)
-    - 'Acumulado de Coletas' (número)
+    Listagem de Empresas com as colunas calculadas (Cidade-UF, PCLs na cidade e
+    coletas como inteiros, zero onde a coluna não existir). Não altera nem copia df.
+    cidades: (índice por cidade só de PCLs, colunas de contagem) de 'cidades_labs'
     """
-    if df_labs.empty:
-        return df_labs
-    
-    df = normalize_column_names(df_labs)
-    
-    # Garantir que acumulado_coletas seja numérico
-    if 'acumulado_coletas' in df.columns:
-        df['acumulado_coletas'] = pd.to_numeric(df['acumulado_coletas'], errors='coerce').fillna(0)
-    else:
-        df['acumulado_coletas'] = 0
-    
-    # Usar coluna 'Ativo em Coletas' se existir (já vem do Excel)
-    if 'ativo em coletas' in df.columns:
-        df['status'] = df['ativo em coletas'].apply(lambda x: 'Ativo' if x == True or str(x).lower() == 'true' else 'Inativo')
-    elif 'dias sem coleta' in df.columns:
-        # Usar dias sem coleta
-        dias = pd.to_numeric(df['dias sem coleta'], errors='coerce').fillna(9999)
-        df['status'] = dias.apply(lambda x: 'Ativo' if x <= 90 else 'Inativo')
+    indice_pcls, colunas_cidade = cidades
+    df = df.assign(**_cidade_uf(df))
+    if CITY_KEY in df.columns and colunas_cidade:
+        contagens = city_counts(indice_pcls, df, colunas_cidade).rename(columns=colunas_cidade)
+        # PCL na cidade? (Sim/Não)
+        contagens.insert(1, 'pcl_na_cidade', np.where(contagens['qtd_pcls_cidade'] > 0, 'Sim', 'Não'))
+        df = df.join(contagens)
+    
+    def inteiros(col):
+        return pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int) if col in df.columns else 0
+    
+    vouchers = inteiros('acumulado_vouchers')
+    nao_voucher = inteiros('acumulado_coletas_nao_voucher')
+    total = inteiros('acumulado_coletas_total') if 'acumulado_coletas_total' in df.columns else vouchers + nao_voucher
+    return df.assign(acumulado_vouchers=vouchers, acumulado_coletas_nao_voucher=nao_voucher,
+                     acumulado_coletas_total=total, coletas_2025=inteiros('coletas_2025'))
+
+LISTING_FRAMES = {'pcls': pcl_listing_frame, 'empresas': empresa_listing_frame}
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_listing_frame(listagem, _df_filtrado, _cidades, filtros, snapshot_id):
+    """
+    Listagem enriquecida (LISTING_FRAMES), uma por (listagem, filtros, snapshot).
+    cache_resource: só leitura, reaproveitada sem cópia nos reruns de busca, ordenação
+    e paginação; a ordem das linhas (get_listing_order) e a exportação partem dela.
+    """
+    return LISTING_FRAMES[listagem](_df_filtrado, _cidades)
+
+# Colunas e nomes de exibição das quatro análises específicas (tela e exportação)
+COLUNAS_ANALISE_PCL = ['cnpj', 'razao_social', 'nome_fantasia', 'cidade', 'uf', 'status', 'acumulado_coletas', 'data_ultima_coleta']
+RENAME_ANALISE_PCL = {'cnpj': 'CNPJ', 'razao_social': 'Razão Social', 'nome_fantasia': 'Nome Fantasia',
+                      'cidade': 'Cidade', 'uf': 'UF', 'status': 'Status',
+                      'acumulado_coletas': 'Coletas', 'data_ultima_coleta': 'Última Coleta'}
+COLUNAS_ANALISE_EMPRESA = ['cnpj', 'razao_social', 'nome_fantasia', 'cidade', 'uf', 'status', 'acumulado_vouchers', 'data_ultima_utilizacao']
+RENAME_ANALISE_EMPRESA = {'cnpj': 'CNPJ', 'razao_social': 'Razão Social', 'nome_fantasia': 'Nome Fantasia',
+                          'cidade': 'Cidade', 'uf': 'UF', 'status': 'Status',
+                          'acumulado_vouchers': 'Vouchers', 'data_ultima_utilizacao': 'Última Utilização'}
+
+# Por regra: nome do arquivo, aba e ajustes (rótulo do status, coluna de inativos na cidade)
+ANALISES_TABELAS = {
+    analysis_engine.PCLS_SEM_EMPRESAS: {'arquivo': 'pcls_sem_empresas', 'aba': 'PCLs sem Empresas'},
+    analysis_engine.PCLS_EMPRESAS_INATIVAS: {'arquivo': 'pcls_empresas_inativas', 'aba': 'PCLs Empresas Inativas',
+                                             'status': 'Status PCL',
+                                             'contagem': ('empresas_inativas_cidade', 'Empresas Inativas na Cidade')},
+    analysis_engine.EMPRESAS_SEM_PCL: {'arquivo': 'empresas_sem_pcl', 'aba': 'Empresas sem PCL'},
+    analysis_engine.EMPRESAS_PCLS_INATIVOS: {'arquivo': 'empresas_pcls_inativos', 'aba': 'Empresas PCLs Inativos',
+                                             'status': 'Status Empresa',
+                                             'contagem': ('pcls_inativos_cidade', 'PCLs Inativos na Cidade')},
+}
+
+def analysis_frame(regra, analises, df_empresas, df_labs):
+    """Tabela de uma das quatro análises específicas, como exibida e exportada"""
+    resultado = analises[regra]
+    tabela = ANALISES_TABELAS[regra]
+    if resultado.dataset == 'labs':
+        df_result, cols, rename_map = df_labs.iloc[resultado.positions], COLUNAS_ANALISE_PCL, dict(RENAME_ANALISE_PCL)
     else:
-        # Fallback: usar acumulado
-        df['status'] = df['acumulado_coletas'].apply(lambda x: 'Ativo' if x > 0 else 'Inativo')
-    
-    # Coletas do ano
-    if 'coletas_2025' in df.columns:
-        df['acumulado_coletas_ano'] = pd.to_numeric(df['coletas_2025'], errors='coerce').fillna(0)
-    elif 'acumulado_coletas' in df.columns:
-        df['acumulado_coletas_ano'] = df['acumulado_coletas']
-    
-    return df
+        df_result, cols, rename_map = df_empresas.iloc[resultado.positions], COLUNAS_ANALISE_EMPRESA, dict(RENAME_ANALISE_EMPRESA)
+    
+    cols_available = [c for c in cols if c in df_result.columns]
+    # Fallback: usar todas as colunas se nenhuma das esperadas existir
+    if not cols_available:
+        cols_available = df_result.columns.tolist()
+    df_display = df_result[cols_available].copy()
+    
+    if 'status' in tabela:
+        rename_map['status'] = tabela['status']
+    if 'contagem' in tabela and resultado.inactive_counts is not None:
+        coluna, nome = tabela['contagem']
+        df_display[coluna] = resultado.inactive_counts
+        rename_map[coluna] = nome
+    return df_display.rename(columns=rename_map)
 
-def normalize_city_name(city):
-    """Normaliza nome da cidade para comparação (remove espaços extras, converte para minúsculas, remove acentos básicos)"""
-    if pd.isna(city) or city == '':
-        return ''
-    city_str = str(city).strip().lower()
-    # Remover espaços múltiplos
-    city_str = ' '.join(city_str.split())
-    return city_str
-
-def normalize_city_column(df, column='cidade'):
-    """Normaliza a coluna de cidade em um dataframe"""
-    if column in df.columns:
-        df = df.copy()
-        df[column] = df[column].apply(normalize_city_name)
-    return df
+@st.cache_data(show_spinner=False)
+def get_uf_cube(dataset, _df, snapshot_key):
+    """Cubo UF × status de uma base (contagens, somas, médias, cidades), um por snapshot"""
+    return build_uf_cube({dataset: _df})
 
-def apply_filters(df, estado, cidade):
-    """Aplica filtros ao dataframe"""
-    df_filtered = df.copy()
-    if estado != "Todos" and 'uf' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['uf'] == estado]
-    if cidade != "Todas" and 'cidade' in df_filtered.columns:
-        df_filtered = df_filtered[df_filtered['cidade'] == cidade]
-    return df_filtered
+@st.cache_data(show_spinner=False)
+def get_city_index(_df_empresas, _df_labs, snapshot_id):
+    """
+    Índice por cidade (cidade normalizada + UF) com as contagens de Empresas e PCLs,
+    montado uma vez por snapshot e lido por todos os módulos via city_counts().
+    Com uma das bases None, só as contagens da outra (listagens).
+    """
+    return build_city_index(_df_empresas, _df_labs)
+
+def city_count_columns(dataset, df):
+    """
+    Contagens por cidade de uma base exibidas na listagem da outra:
+    {coluna do índice por cidade: coluna da listagem}, conforme as colunas da base.
+    """
+    if df.empty or 'cidade' not in df.columns:
+        return {}
+    if dataset == "labs":
+        colunas = {'pcls': 'qtd_pcls_cidade'}
+        if 'status' in df.columns:
+            colunas['pcls_ativos'] = 'qtd_pcls_ativos_cidade'
+            colunas['pcls_inativos'] = 'qtd_pcls_inativos_cidade'
+            # PCLs ativos/inativos por representação (INTERNO/EXTERNO)
+            if 'representacao' in df.columns:
+                colunas['pcls_ativos_interno'] = 'qtd_pcls_ativos_interno'
+                colunas['pcls_inativos_interno'] = 'qtd_pcls_inativos_interno'
+        return colunas
+    colunas = {
+        'empresas': 'qtd_empresas_cidade',
+        'empresas_ativas': 'qtd_empresas_ativas_cidade',
+        'empresas_inativas': 'qtd_empresas_inativas_cidade',
+    }
+    # Empresas que utilizaram voucher (acumulado > 0) / nunca utilizaram
+    if 'acumulado_vouchers' in df.columns:
+        colunas['empresas_usaram_voucher'] = 'qtd_empresas_usaram_voucher'
+        colunas['empresas_nunca_voucher'] = 'qtd_empresas_nunca_voucher'
+        # Separado por representação (INTERNO/EXTERNO)
+        if 'representacao' in df.columns:
+            colunas['empresas_nunca_interno'] = 'qtd_empresas_nunca_interno'
+            colunas['empresas_usaram_interno'] = 'qtd_empresas_usaram_interno'
+    return colunas
+
+@st.cache_data(show_spinner=False)
+def get_analyses(_city_index, _df_empresas, _df_labs, snapshot_id):
+    """
+    As quatro regras das Análises Específicas (analysis_engine.run_analyses),
+    calculadas de uma vez por snapshot: só posições de linha e contagens por linha.
+    """
+    return analysis_engine.run_analyses(_city_index, _df_empresas, _df_labs)
+
+@st.cache_data(show_spinner=False)
+def get_centroids(modificado_em):
+    """Centroides dos municípios (CENTROIDS_PATH); recarrega quando o arquivo muda"""
+    return load_centroids(CENTROIDS_PATH)
+
+@st.cache_data(show_spinner=False)
+def get_proximity(_df_empresas, _df_labs, snapshot_id, raio_km):
+    """
+    PCL ativo mais próximo e PCLs no raio de cada empresa, mais as regras por raio
+    (analysis_engine.run_radius_analyses), por snapshot e raio.
+    """
+    centroides = get_centroids(CENTROIDS_PATH.stat().st_mtime_ns if CENTROIDS_PATH.exists() else None)
+    proximidade = nearest_pcls(_df_empresas, _df_labs, centroides, raio_km)
+    return proximidade, analysis_engine.run_radius_analyses(proximidade)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_filter_index(_df, dataset, snapshot_id):
+    """Grupos de linhas por UF/cidade/status de uma base, um por snapshot (só leitura)"""
+    return build_filter_index(_df)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_filtered_rows(_df, dataset, snapshot_id, filtros):
+    """Posições das linhas que passam nos filtros (None = sem filtro)"""
+    return select_rows(get_filter_index(_df, dataset, snapshot_id), dict(zip(FILTER_COLUMNS, filtros)))
+
+@st.cache_data(show_spinner=False)
+def get_city_hierarchy(dataset, _df, snapshot_key):
+    """UF → cidades (ordenadas) de uma base, uma vez por snapshot"""
+    return build_hierarchy([_df], 'uf', 'cidade')
+
+@st.cache_data(show_spinner=False)
+def get_history_ufs(versao):
+    """UFs presentes nos agregados do histórico (opções do filtro em Tendências); versao só entra na chave"""
+    return sorted({str(uf) for dataset in ("labs", "empresas")
+                   for uf in history_store.read_aggregates(dataset, columns=())['uf'].dropna().unique()})
+
+def apply_filters(df, dataset, filtros, snapshot_id):
+    """
+    Aplica os filtros da barra lateral.
+    filtros: tupla de seleções alinhada a FILTER_COLUMNS (UFs, cidades, status; vazia = todos).
+    Sem filtro devolve a própria base, sem cópia.
+    """
+    return apply_selection(df, get_filtered_rows(df, dataset, snapshot_id, filtros))
 
 def prepare_display_dataframe(df, colunas_desejadas, rename_map):
     """
@@ -1118,28 +1301,49 @@ with st.spinner("Carregando dados..."):
     if df_empresas_raw.empty and df_labs_raw.empty:
         st.error("⚠️ Nenhum arquivo encontrado nas pastas 'Acumulado de Coletas - Empresas' e 'Acumulado de Coletas - Labs'")
         st.stop()
-    
-    df_empresas = process_empresas(df_empresas_raw)
-    df_labs = process_labs(df_labs_raw)
-    
-    # ============================================
-    # LISTA DE EXCEÇÕES - CNPJs a serem excluídos das análises
-    # ============================================
-    # CNPJs da própria empresa que não devem ser contabilizados
-    CNPJS_EXCLUIDOS = [
-        '07.339.867/0001-15',  # CAEP - CENTRO AVANÇADO DE ESTUDOS E PESQUISA LTDA (nosso CNPJ)
-    ]
-    
-    # Remover CNPJs excluídos dos dados de Labs (PCLs)
-    pcls_excluidos = 0
-    if not df_labs.empty and 'cnpj' in df_labs.columns:
-        total_antes = len(df_labs)
-        df_labs = df_labs[~df_labs['cnpj'].isin(CNPJS_EXCLUIDOS)]
-        pcls_excluidos = total_antes - len(df_labs)
-    
-    # Remover CNPJs excluídos dos dados de Empresas (se necessário)
-    # if not df_empresas.empty and 'cnpj' in df_empresas.columns:
-    #     df_empresas = df_empresas[~df_empresas['cnpj'].isin(CNPJS_EXCLUIDOS)]
+
+
+# ============================================
+# BASES DERIVADAS (sob demanda, por módulo)
+# ============================================
+
+chaves_snapshot = file_info['snapshot_keys']
+
+# Cada base declara as dependências e como é montada (funções em cache por snapshot)
+DATASETS = {
+    'processado_empresas': Dataset((), lambda: get_dataset("empresas", df_empresas_raw, chaves_snapshot['empresas'])),
+    'processado_labs': Dataset((), lambda: get_dataset("labs", df_labs_raw, chaves_snapshot['labs'])),
+    'empresas': Dataset(('processado_empresas',), lambda base: base.df),
+    'labs': Dataset(('processado_labs',), lambda base: base.df),
+    'cubo_empresas': Dataset(('empresas',), lambda df: get_uf_cube("empresas", df, chaves_snapshot['empresas'])),
+    'cubo_labs': Dataset(('labs',), lambda df: get_uf_cube("labs", df, chaves_snapshot['labs'])),
+    # Contagens por cidade de uma só base (colunas de cidade das listagens)
+    'cidades_empresas': Dataset(('empresas',), lambda df: (
+        get_city_index(df, None, ("empresas", chaves_snapshot['empresas'])), city_count_columns("empresas", df))),
+    'cidades_labs': Dataset(('labs',), lambda df: (
+        get_city_index(None, df, ("labs", chaves_snapshot['labs'])), city_count_columns("labs", df))),
+    'indice_cidades': Dataset(('empresas', 'labs'), lambda emp, labs: get_city_index(emp, labs, file_info['snapshot_id'])),
+    'analises': Dataset(('indice_cidades', 'empresas', 'labs'),
+                        lambda indice, emp, labs: get_analyses(indice, emp, labs, file_info['snapshot_id'])),
+    # Histórico mensal: ingere só os arquivos novos (uma vez por snapshot, só em Tendências)
+    'historico': Dataset((), lambda: sync_history(
+        df_empresas_raw, df_labs_raw, file_info['snapshot_id'], chaves_snapshot,
+        'sharepoint' in (file_info.get('empresas_source'), file_info.get('labs_source')),
+        st.session_state.get('lote_historico', 0))),
+    'ufs_historico': Dataset(('historico',), lambda historico: get_history_ufs(
+        tuple(history_store.version(d) for d in ("labs", "empresas")))),
+}
+
+# Módulos da navegação: bases usadas e filtros da barra lateral que se aplicam
+Modulo = namedtuple('Modulo', ['bases', 'filtros'])
+MODULOS = {
+    "Visão Geral": Modulo(('cubo_labs', 'cubo_empresas'), ()),
+    "Análise de Coletas": Modulo(('labs', 'cubo_labs'), ()),
+    "Tendências": Modulo(('ufs_historico',), ('uf',)),
+    "Listagem de PCLs": Modulo(('labs', 'cidades_empresas'), FILTER_COLUMNS),
+    "Listagem de Empresas": Modulo(('empresas', 'cidades_labs'), FILTER_COLUMNS),
+    "Análises Específicas": Modulo(('empresas', 'labs', 'analises'), ()),
+}
 
 # ============================================
 # SIDEBAR
@@ -1159,25 +1363,56 @@ with st.sidebar:
     st.markdown("**NAVEGAÇÃO**")
     tipo_analise = st.selectbox(
         "Módulo",
-        ["Visão Geral", "Análise de Coletas", "Listagem de PCLs", "Listagem de Empresas", "Análises Específicas"],
+        list(MODULOS),
         label_visibility="collapsed",
         key="nav_selectbox"
     )
     
     st.markdown("---")
     
+    # Só as bases do módulo aberto (e suas dependências) são montadas neste rerun
+    modulo = MODULOS[tipo_analise]
+    with st.spinner("Preparando dados..."):
+        dados = resolve(DATASETS, modulo.bases)
+    
     # Filtros
     st.markdown("**FILTROS**")
     
-    if not df_labs.empty:
-        estados_disponiveis = sorted(df_labs['uf'].dropna().unique().tolist()) if 'uf' in df_labs.columns else []
-        cidades_disponiveis = sorted(df_labs['cidade'].dropna().unique().tolist()) if 'cidade' in df_labs.columns else []
-    else:
-        estados_disponiveis = []
-        cidades_disponiveis = []
+    # Mantém as seleções ao passar por módulos sem filtros (widget não exibido perde o estado)
+    for chave in ('filtro_ufs', 'filtro_cidades', 'filtro_status'):
+        if chave in st.session_state:
+            st.session_state[chave] = st.session_state[chave]
     
-    estado_selecionado = st.selectbox("Estado (UF)", ["Todos"] + estados_disponiveis) if estados_disponiveis else "Todos"
-    cidade_selecionada = st.selectbox("Cidade", ["Todas"] + cidades_disponiveis) if cidades_disponiveis else "Todas"
+    ufs_selecionadas, cidades_selecionadas, status_selecionados = [], [], []
+    if not modulo.filtros:
+        st.caption("Este módulo usa as bases completas, sem filtros.")
+    else:
+        # Opções a partir das bases do módulo (índices de filtro e hierarquia UF → cidades por snapshot)
+        bases_filtro = [d for d in ("labs", "empresas") if d in dados and not dados[d].empty]
+        indices_filtro = [get_filter_index(dados[d], d, chaves_snapshot[d]) for d in bases_filtro]
+        estados_disponiveis = sorted({v for indice in indices_filtro for v in column_values(indice, 'uf')}
+                                     | set(dados.get('ufs_historico', [])))
+        
+        def opcoes_validas(chave, opcoes):
+            """Descarta seleções que não estão entre as opções (ex.: cidades de outra UF)"""
+            if st.session_state.get(chave):
+                validas = set(opcoes)
+                st.session_state[chave] = [v for v in st.session_state[chave] if v in validas]
+        
+        opcoes_validas('filtro_ufs', estados_disponiveis)
+        ufs_selecionadas = st.multiselect("Estado (UF)", estados_disponiveis, placeholder="Todos", key="filtro_ufs")
+        
+        if 'cidade' in modulo.filtros:
+            # Cidades dependentes da UF: só as das UFs selecionadas (todas quando nenhuma)
+            hierarquia_cidades = merge_hierarchies(get_city_hierarchy(d, dados[d], chaves_snapshot[d]) for d in bases_filtro)
+            cidades_disponiveis = hierarchy_children(hierarquia_cidades, ufs_selecionadas)
+            opcoes_validas('filtro_cidades', cidades_disponiveis)
+            cidades_selecionadas = st.multiselect("Cidade", cidades_disponiveis, placeholder="Todas", key="filtro_cidades")
+        if 'status' in modulo.filtros:
+            status_selecionados = st.multiselect("Status", ["Ativo", "Inativo"], placeholder="Todos", key="filtro_status")
+    
+    # Estado dos filtros (alinhado a FILTER_COLUMNS), usado também nas chaves de cache
+    filtros = (tuple(ufs_selecionadas), tuple(cidades_selecionadas), tuple(status_selecionados))
     
     st.markdown("---")
     
@@ -1192,12 +1427,38 @@ with st.sidebar:
     
     if file_info['labs_file']:
         source_icon = "☁️" if file_info.get('labs_source') == 'sharepoint' else "💻"
-        st.caption(f"{source_icon} PCLs: {file_info['labs_file']}")
+        cache_icon = " ⚡" if file_info.get('labs_snapshot_hit') else ""
+        st.caption(f"{source_icon} PCLs: {file_info['labs_file']}{cache_icon}")
     if file_info['empresas_file']:
         source_icon = "☁️" if file_info.get('empresas_source') == 'sharepoint' else "💻"
-        st.caption(f"{source_icon} Empresas: {file_info['empresas_file']}")
+        cache_icon = " ⚡" if file_info.get('empresas_snapshot_hit') else ""
+        st.caption(f"{source_icon} Empresas: {file_info['empresas_file']}{cache_icon}")
+    if file_info.get('labs_snapshot_hit') or file_info.get('empresas_snapshot_hit'):
+        st.caption("⚡ Lido do cache Parquet (arquivo inalterado)")
+    timings = file_info.get('timings', {})
+    if timings.get('total') is not None:
+        st.caption(f"⏱️ Carga: {timings['total']:.2f}s "
+                   f"(PCLs {timings.get('labs', {}).get('total', 0):.2f}s | "
+                   f"Empresas {timings.get('empresas', {}).get('total', 0):.2f}s)")
+        if timings.get('parse'):
+            st.caption(f"📄 Parse do Excel: {timings['parse']:.2f}s somados (PCLs + Empresas)")
+    processados = [dados[chave] for chave in ('processado_empresas', 'processado_labs') if chave in dados]
+    if processados:
+        antes = sum(base.memoria[0] for base in processados)
+        depois = sum(base.memoria[1] for base in processados)
+        st.caption(f"🧠 Memória: {antes:.1f} MB → {depois:.1f} MB")
+    historico = dados['historico'][0] if 'historico' in dados else {}
+    if historico:
+        meses = historico.get('empresas', {}).get('meses', [])
+        st.caption(f"📚 Histórico: {len(meses)} mês(es) de Empresas, "
+                   f"{len(historico.get('labs', {}).get('meses', []))} de PCLs")
+        for dataset, nome in (("empresas", "Empresas"), ("labs", "PCLs")):
+            for resumo in historico.get(dataset, {}).get('ingeridos', []):
+                st.caption(f"➕ {nome} {resumo['mes']}: {resumo.get('novos', 0)} novos, "
+                           f"{resumo.get('removidos', 0)} removidos, {resumo.get('status_mudou', 0)} mudaram de status")
     
     # Mostrar quantos registros foram excluídos
+    pcls_excluidos = dados['processado_labs'].excluidos if 'processado_labs' in dados else 0
     if pcls_excluidos > 0:
         st.caption(f"🚫 {pcls_excluidos} PCL(s) excluído(s) (CNPJs internos)")
 
@@ -1205,35 +1466,32 @@ with st.sidebar:
 # CONTEÚDO PRINCIPAL
 # ============================================
 
+# Bases do módulo aberto (vazias quando o módulo não as declara)
+df_labs = dados.get('labs', pd.DataFrame())
+df_empresas = dados.get('empresas', pd.DataFrame())
+
 if tipo_analise == "Visão Geral":
     create_section_header("📈", "Visão Geral", "Métricas e indicadores principais da base CTOX")
     
-    # Calcular métricas
-    total_pcls = len(df_labs) if not df_labs.empty else 0
-    pcls_ativos = len(df_labs[df_labs['status'] == 'Ativo']) if not df_labs.empty else 0
+    # Métricas do cubo por UF (materializado uma vez por snapshot)
+    cubo = pd.concat([dados['cubo_labs'], dados['cubo_empresas']], ignore_index=True)
+    metricas_pcl = cube_totals(cubo, 'labs')
+    metricas_emp = cube_totals(cubo, 'empresas')
+    pcls_por_uf = cube_by_uf(cubo, 'labs')
+    empresas_por_uf = cube_by_uf(cubo, 'empresas')
+    
+    total_pcls = int(metricas_pcl['linhas'])
+    pcls_ativos = int(cube_totals(cubo, 'labs', status='Ativo')['linhas'])
     pcls_inativos = total_pcls - pcls_ativos
     pct_pcls_ativos = (pcls_ativos / total_pcls * 100) if total_pcls > 0 else 0
     
-    total_empresas = len(df_empresas) if not df_empresas.empty else 0
-    empresas_ativas = len(df_empresas[df_empresas['status'] == 'Ativo']) if not df_empresas.empty else 0
+    total_empresas = int(metricas_emp['linhas'])
+    empresas_ativas = int(cube_totals(cubo, 'empresas', status='Ativo')['linhas'])
     empresas_inativas = total_empresas - empresas_ativas
     pct_empresas_ativas = (empresas_ativas / total_empresas * 100) if total_empresas > 0 else 0
     
-    total_coletas = 0
-    if not df_labs.empty and 'acumulado_coletas' in df_labs.columns:
-        try:
-            coletas_sum = df_labs['acumulado_coletas'].sum()
-            total_coletas = float(coletas_sum) if pd.notna(coletas_sum) and np.isfinite(coletas_sum) else 0
-        except:
-            total_coletas = 0
-    
-    total_vouchers = 0
-    if not df_empresas.empty and 'acumulado_vouchers' in df_empresas.columns:
-        try:
-            vouchers_sum = df_empresas['acumulado_vouchers'].sum()
-            total_vouchers = float(vouchers_sum) if pd.notna(vouchers_sum) and np.isfinite(vouchers_sum) else 0
-        except:
-            total_vouchers = 0
+    total_coletas = float(metricas_pcl.get('soma_acumulado_coletas', 0))
+    total_vouchers = float(metricas_emp.get('soma_acumulado_vouchers', 0))
     
     # Linha 1: Métricas principais
     col1, col2, col3, col4 = st.columns(4)
@@ -1259,8 +1517,8 @@ if tipo_analise == "Visão Geral":
         media_vouchers = total_vouchers / total_empresas if total_empresas > 0 else 0
         create_metric_card("Total Vouchers", format_number(int(total_vouchers)), f"Média: {int(media_vouchers)}/Empresa", "", "gray")
     with col3:
-        estados_pcl = df_labs['uf'].nunique() if not df_labs.empty and 'uf' in df_labs.columns else 0
-        cidades_pcl = df_labs['cidade'].nunique() if not df_labs.empty and 'cidade' in df_labs.columns else 0
+        estados_pcl = len(pcls_por_uf)
+        cidades_pcl = int(metricas_pcl['cidades'])
         create_metric_card("Cobertura", f"{estados_pcl} UFs", f"{format_number(cidades_pcl)} cidades", "", "gray")
     with col4:
         razao = total_pcls / total_empresas if total_empresas > 0 else 0
@@ -1290,9 +1548,9 @@ if tipo_analise == "Visão Geral":
             create_progress_card("Empresas Ativas", 0, 1, "#3B82F6")
     
     with col3:
-        if not df_labs.empty and 'uf' in df_labs.columns:
+        if not pcls_por_uf.empty:
             try:
-                top5_pcl = df_labs.groupby('uf').size().nlargest(5)
+                top5_pcl = pcls_por_uf['linhas'].nlargest(5)
                 top5_pcl_dict = {str(k): int(v) for k, v in top5_pcl.to_dict().items() if pd.notna(v) and np.isfinite(v)}
                 if top5_pcl_dict:
                     create_top_list_card("Top 5 UFs (PCLs)", top5_pcl_dict, "#22C55E")
@@ -1300,9 +1558,9 @@ if tipo_analise == "Visão Geral":
                 pass
     
     with col4:
-        if not df_empresas.empty and 'uf' in df_empresas.columns:
+        if not empresas_por_uf.empty:
             try:
-                top5_emp = df_empresas.groupby('uf').size().nlargest(5)
+                top5_emp = empresas_por_uf['linhas'].nlargest(5)
                 top5_emp_dict = {str(k): int(v) for k, v in top5_emp.to_dict().items() if pd.notna(v) and np.isfinite(v)}
                 if top5_emp_dict:
                     create_top_list_card("Top 5 UFs (Empresas)", top5_emp_dict, "#3B82F6")
@@ -1314,19 +1572,20 @@ if tipo_analise == "Visão Geral":
     # Gráficos por Estado
     create_section_header("📊", "Distribuição por Estado", "Top 12 estados por volume")
     
+    # Gráficos da visão geral usam as bases completas (sem os filtros da barra lateral)
     col1, col2 = st.columns(2)
     
     with col1:
-        if not df_labs.empty and 'uf' in df_labs.columns:
-            df_estado = df_labs.groupby('uf').size().reset_index(name='Quantidade')
-            fig = create_bar_chart(df_estado, 'uf', 'Quantidade', "PCLs por Estado", max_items=12, color='#22C55E')
-            st.plotly_chart(fig, use_container_width=True)
+        if not pcls_por_uf.empty:
+            show_chart('geral_pcls_uf', file_info['snapshot_id'], lambda: chart_builder.bar_figure(
+                pcls_por_uf.index, pcls_por_uf['linhas'],
+                "PCLs por Estado", color='#22C55E', max_items=12))
     
     with col2:
-        if not df_empresas.empty and 'uf' in df_empresas.columns:
-            df_estado = df_empresas.groupby('uf').size().reset_index(name='Quantidade')
-            fig = create_bar_chart(df_estado, 'uf', 'Quantidade', "Empresas por Estado", max_items=12, color='#3B82F6')
-            st.plotly_chart(fig, use_container_width=True)
+        if not empresas_por_uf.empty:
+            show_chart('geral_empresas_uf', file_info['snapshot_id'], lambda: chart_builder.bar_figure(
+                empresas_por_uf.index, empresas_por_uf['linhas'],
+                "Empresas por Estado", color='#3B82F6', max_items=12))
     
     st.markdown("")
     
@@ -1336,14 +1595,16 @@ if tipo_analise == "Visão Geral":
     col1, col2 = st.columns(2)
     
     with col1:
-        if not df_labs.empty and 'uf' in df_labs.columns:
-            fig = create_grouped_bar_chart(df_labs, 'uf', "PCLs: Ativos vs Inativos", max_items=10)
-            st.plotly_chart(fig, use_container_width=True)
+        if not pcls_por_uf.empty:
+            show_chart('geral_pcls_status_uf', file_info['snapshot_id'],
+                       lambda: chart_builder.grouped_bar_figure(
+                           cube_status_by_uf(cubo, 'labs'), "PCLs: Ativos vs Inativos", max_items=10))
     
     with col2:
-        if not df_empresas.empty and 'uf' in df_empresas.columns:
-            fig = create_grouped_bar_chart(df_empresas, 'uf', "Empresas: Ativas vs Inativas", max_items=10)
-            st.plotly_chart(fig, use_container_width=True)
+        if not empresas_por_uf.empty:
+            show_chart('geral_empresas_status_uf', file_info['snapshot_id'],
+                       lambda: chart_builder.grouped_bar_figure(
+                           cube_status_by_uf(cubo, 'empresas'), "Empresas: Ativas vs Inativas", max_items=10))
 
 elif tipo_analise == "Análise de Coletas":
     create_section_header("🔬", "Análise de Coletas", "Métricas detalhadas de coletas por estado e PCL")
@@ -1351,21 +1612,15 @@ elif tipo_analise == "Análise de Coletas":
     if df_labs.empty or 'acumulado_coletas' not in df_labs.columns:
         st.warning("Dados de coletas não disponíveis.")
     else:
-        # Métricas de coletas
-        try:
-            total_coletas = float(df_labs['acumulado_coletas'].sum()) if pd.notna(df_labs['acumulado_coletas'].sum()) else 0.0
-            media_coletas = float(df_labs['acumulado_coletas'].mean()) if pd.notna(df_labs['acumulado_coletas'].mean()) else 0.0
-            mediana_coletas = float(df_labs['acumulado_coletas'].median()) if pd.notna(df_labs['acumulado_coletas'].median()) else 0.0
-            max_coletas = float(df_labs['acumulado_coletas'].max()) if pd.notna(df_labs['acumulado_coletas'].max()) else 0.0
-            pcls_sem_coleta = len(df_labs[df_labs['acumulado_coletas'].fillna(0) == 0])
-            pcls_com_coleta = len(df_labs[df_labs['acumulado_coletas'].fillna(0) > 0])
-        except:
-            total_coletas = 0.0
-            media_coletas = 0.0
-            mediana_coletas = 0.0
-            max_coletas = 0.0
-            pcls_sem_coleta = 0
-            pcls_com_coleta = 0
+        # Métricas de coletas (cubo por UF)
+        cubo = dados['cubo_labs']
+        metricas_pcl = cube_totals(cubo, 'labs')
+        total_coletas = float(metricas_pcl['soma_acumulado_coletas'])
+        media_coletas = mean_of(metricas_pcl, 'acumulado_coletas')
+        mediana_coletas = float(metricas_pcl['mediana_acumulado_coletas'])
+        max_coletas = float(metricas_pcl['max_acumulado_coletas'])
+        pcls_com_coleta = int(metricas_pcl['positivos_acumulado_coletas'])
+        pcls_sem_coleta = int(metricas_pcl['linhas']) - pcls_com_coleta
         
         col1, col2, col3, col4 = st.columns(4)
         
@@ -1380,7 +1635,7 @@ elif tipo_analise == "Análise de Coletas":
             max_int = int(max_coletas) if pd.notna(max_coletas) and np.isfinite(max_coletas) else 0
             create_metric_card("Máximo", format_number(max_int), "Maior volume", "", "gray")
         with col4:
-            pct_com_coleta = (pcls_com_coleta / len(df_labs) * 100) if len(df_labs) > 0 else 0
+            pct_com_coleta = (pcls_com_coleta / metricas_pcl['linhas'] * 100) if metricas_pcl['linhas'] > 0 else 0
             create_metric_card("PCLs com Coleta", format_number(pcls_com_coleta), f"{pct_com_coleta:.1f}% do total", "", "gray")
         
         st.markdown("---")
@@ -1389,71 +1644,29 @@ elif tipo_analise == "Análise de Coletas":
         create_section_header("📊", "Coletas por Estado")
         
         if 'uf' in df_labs.columns:
-            coletas_estado = df_labs.groupby('uf').agg({
-                'acumulado_coletas': ['sum', 'mean', 'count']
-            }).reset_index()
-            coletas_estado.columns = ['UF', 'Total Coletas', 'Média por PCL', 'Qtd PCLs']
+            por_uf = cube_by_uf(cubo, 'labs')
+            coletas_estado = pd.DataFrame({
+                'UF': por_uf.index.astype(str),
+                'Total Coletas': por_uf['soma_acumulado_coletas'].to_numpy(),
+                'Média por PCL': (por_uf['soma_acumulado_coletas'] / por_uf['n_acumulado_coletas'].replace(0, np.nan)).to_numpy(),
+                'Qtd PCLs': por_uf['n_acumulado_coletas'].to_numpy(),
+            })
             coletas_estado = coletas_estado.sort_values('Total Coletas', ascending=False)
             
             col1, col2 = st.columns(2)
             
             with col1:
                 # Gráfico de Total de Coletas por Estado
-                df_chart = coletas_estado[['UF', 'Total Coletas']].head(12)
-                df_chart = df_chart.sort_values('Total Coletas', ascending=True)
-                
-                fig = go.Figure()
-                valores_x = [float(x) if pd.notna(x) and np.isfinite(x) else 0.0 for x in df_chart['Total Coletas']]
-                valores_y = [str(y) if pd.notna(y) else "" for y in df_chart['UF']]
-                fig.add_trace(go.Bar(
-                    x=valores_x,
-                    y=valores_y,
-                    orientation='h',
-                    marker=dict(color='#22C55E'),
-                    text=[format_number(int(x)) for x in valores_x],
-                    textposition='outside',
-                    textfont=dict(size=11, color='#3F3F46', family='Inter')
-                ))
-                
-                fig.update_layout(
-                    title=dict(text="Total de Coletas por Estado (Top 12)", font=dict(size=15, color='#18181B', family='Inter'), x=0.5),
-                    xaxis=dict(title="", showgrid=True, gridcolor='#F4F4F5', tickfont=dict(size=11, color='#71717A')),
-                    yaxis=dict(title="", tickfont=dict(size=12, color='#3F3F46')),
-                    plot_bgcolor='#FFFFFF',
-                    paper_bgcolor='#FFFFFF',
-                    height=450,
-                    margin=dict(l=10, r=70, t=50, b=20)
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                show_chart('coletas_total_uf', file_info['snapshot_id'], lambda: chart_builder.bar_figure(
+                    coletas_estado['UF'], coletas_estado['Total Coletas'], "Total de Coletas por Estado (Top 12)",
+                    color='#22C55E', max_items=12, value_name='Total Coletas', height=450))
             
             with col2:
                 # Gráfico de Média de Coletas por Estado
-                df_chart = coletas_estado[['UF', 'Média por PCL']].head(12)
-                df_chart = df_chart.sort_values('Média por PCL', ascending=True)
-                
-                fig = go.Figure()
-                valores_x = [float(x) if pd.notna(x) and np.isfinite(x) else 0.0 for x in df_chart['Média por PCL']]
-                valores_y = [str(y) if pd.notna(y) else "" for y in df_chart['UF']]
-                fig.add_trace(go.Bar(
-                    x=valores_x,
-                    y=valores_y,
-                    orientation='h',
-                    marker=dict(color='#3B82F6'),
-                    text=[f"{x:.1f}" for x in valores_x],
-                    textposition='outside',
-                    textfont=dict(size=11, color='#3F3F46', family='Inter')
-                ))
-                
-                fig.update_layout(
-                    title=dict(text="Média de Coletas por PCL (Top 12)", font=dict(size=15, color='#18181B', family='Inter'), x=0.5),
-                    xaxis=dict(title="", showgrid=True, gridcolor='#F4F4F5', tickfont=dict(size=11, color='#71717A')),
-                    yaxis=dict(title="", tickfont=dict(size=12, color='#3F3F46')),
-                    plot_bgcolor='#FFFFFF',
-                    paper_bgcolor='#FFFFFF',
-                    height=450,
-                    margin=dict(l=10, r=70, t=50, b=20)
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                media = coletas_estado['Média por PCL']
+                show_chart('coletas_media_uf', file_info['snapshot_id'], lambda: chart_builder.bar_figure(
+                    coletas_estado['UF'], media, "Média de Coletas por PCL (Top 12)", color='#3B82F6',
+                    max_items=12, value_name='Média por PCL', text=chart_builder.decimal_text(media), height=450))
             
             st.markdown("---")
             
@@ -1497,10 +1710,113 @@ elif tipo_analise == "Análise de Coletas":
                     height=500
                 )
 
+elif tipo_analise == "Tendências":
+    create_section_header("📅", "Tendências", "Evolução mensal a partir do histórico de arquivos")
+    
+    for error in dados['historico'][1]:
+        st.warning(error)
+    
+    # Carga inicial de um histórico longo: um lote de arquivos por clique
+    pendentes_historico = sum(resumo.get('pendentes', 0) for resumo in dados['historico'][0].values())
+    if pendentes_historico:
+        col_info, col_botao = st.columns([3, 1])
+        with col_info:
+            st.info(f"ℹ️ {pendentes_historico} arquivo(s) antigo(s) ainda não ingerido(s) no histórico")
+        with col_botao:
+            if st.button("Ingerir próximo lote", use_container_width=True):
+                st.session_state['lote_historico'] = st.session_state.get('lote_historico', 0) + 1
+                st.rerun()
+    
+    meses_historico = sorted(set(history_store.months("empresas")) | set(history_store.months("labs")))
+    if not PARQUET_DISPONIVEL:
+        st.info("ℹ️ Histórico indisponível: instale o pyarrow")
+    elif len(meses_historico) < 2:
+        st.info("ℹ️ O histórico ainda tem menos de dois meses. As tendências aparecem a partir do segundo arquivo mensal ingerido.")
+    else:
+        janela = st.slider("Meses exibidos", min_value=2, max_value=len(meses_historico),
+                           value=min(24, len(meses_historico)))
+        meses_janela = tuple(meses_historico[-janela:])
+        # Filtro de estado da barra lateral aplicado na leitura dos agregados
+        ufs_filtro = tuple(ufs_selecionadas)
+        
+        tendencias = {
+            dataset: get_trends(dataset, meses_janela, ufs_filtro, history_store.version(dataset))
+            for dataset in ("labs", "empresas")
+        }
+        totais = {
+            dataset: df.groupby('mes', sort=True)[['total', 'ativos', 'inativos', 'coletas', 'coletas_no_mes']]
+                       .sum(min_count=1).reset_index()
+            for dataset, df in tendencias.items() if not df.empty
+        }
+        
+        # Último mês contra o anterior
+        col1, col2, col3, col4 = st.columns(4)
+        for coluna_card, dataset, titulo in ((col1, "labs", "PCLs Ativos"), (col2, "empresas", "Empresas Ativas")):
+            with coluna_card:
+                df_total = totais.get(dataset)
+                if df_total is not None and len(df_total) >= 2:
+                    atual, anterior = df_total['ativos'].iloc[-1], df_total['ativos'].iloc[-2]
+                    create_metric_card(titulo, format_number(int(atual)), f"em {df_total['mes'].iloc[-1]}",
+                                       f"{int(atual - anterior):+,}".replace(',', '.'))
+        for coluna_card, dataset, titulo in ((col3, "labs", "Coletas no mês (PCLs)"), (col4, "empresas", "Coletas no mês (Empresas)")):
+            with coluna_card:
+                df_total = totais.get(dataset)
+                if df_total is not None and len(df_total) >= 2 and pd.notna(df_total['coletas_no_mes'].iloc[-1]):
+                    create_metric_card(titulo, format_number(int(df_total['coletas_no_mes'].iloc[-1])),
+                                       f"{df_total['mes'].iloc[-2]} → {df_total['mes'].iloc[-1]}")
+        
+        st.markdown("---")
+        
+        # Ativos x inativos ao longo do tempo
+        create_section_header("📈", "Ativos vs Inativos por Mês")
+        col1, col2 = st.columns(2)
+        for coluna_grafico, dataset, titulo in ((col1, "labs", "PCLs"), (col2, "empresas", "Empresas")):
+            with coluna_grafico:
+                if dataset in totais:
+                    fig = create_line_chart(totais[dataset], 'mes',
+                                            {'ativos': ('Ativos', '#22C55E'), 'inativos': ('Inativos', '#EF4444')},
+                                            f"{titulo}: Ativos vs Inativos")
+                    st.plotly_chart(fig, use_container_width=True)
+        
+        # Ativos por UF (as UFs com mais ativos no último mês, para o gráfico ficar legível)
+        create_section_header("🗺️", "Ativos por Estado", "Até 8 estados com mais ativos no último mês")
+        col1, col2 = st.columns(2)
+        for coluna_grafico, dataset, titulo in ((col1, "labs", "PCLs ativos por UF"), (col2, "empresas", "Empresas ativas por UF")):
+            with coluna_grafico:
+                df_uf = tendencias[dataset]
+                if not df_uf.empty:
+                    ultimo = df_uf[df_uf['mes'] == df_uf['mes'].max()]
+                    principais = ultimo.nlargest(8, 'ativos')['uf']
+                    fig = create_line_chart(df_uf[df_uf['uf'].isin(principais)], 'mes', {'ativos': ('Ativos', None)},
+                                            titulo, color_col='uf')
+                    st.plotly_chart(fig, use_container_width=True)
+        
+        # Coletas mês a mês (diferença das acumuladas)
+        create_section_header("🔬", "Coletas Mês a Mês", "Diferença das coletas acumuladas entre meses consecutivos")
+        col1, col2 = st.columns(2)
+        for coluna_grafico, dataset, titulo, cor in ((col1, "labs", "Coletas dos PCLs por mês", '#22C55E'),
+                                                     (col2, "empresas", "Coletas das Empresas por mês", '#3B82F6')):
+            with coluna_grafico:
+                if dataset in totais:
+                    df_delta = totais[dataset].dropna(subset=['coletas_no_mes'])
+                    fig = create_line_chart(df_delta, 'mes', {'coletas_no_mes': ('Coletas no mês', cor)},
+                                            titulo, kind='bar')
+                    st.plotly_chart(fig, use_container_width=True)
+        
+        with st.expander("📋 Tabela por estado e mês"):
+            for dataset, titulo in (("labs", "PCLs"), ("empresas", "Empresas")):
+                df_uf = tendencias[dataset]
+                if not df_uf.empty:
+                    st.markdown(f"**{titulo}**")
+                    st.dataframe(df_uf.rename(columns={
+                        'mes': 'Mês', 'uf': 'UF', 'total': 'Total', 'ativos': 'Ativos', 'inativos': 'Inativos',
+                        'coletas': 'Coletas Acumuladas', 'coletas_no_mes': 'Coletas no Mês', 'saldo_ativos': 'Saldo de Ativos',
+                    }), use_container_width=True, hide_index=True)
+
 elif tipo_analise == "Listagem de PCLs":
     create_section_header("🏥", "Listagem de PCLs", "Base completa de laboratórios credenciados")
     
-    df_labs_filtered = apply_filters(df_labs, estado_selecionado, cidade_selecionada)
+    df_labs_filtered = apply_filters(df_labs, "labs", filtros, chaves_snapshot["labs"])
     
     if df_labs_filtered.empty:
         st.warning("Nenhum PCL encontrado com os filtros selecionados.")
@@ -1523,42 +1839,9 @@ elif tipo_analise == "Listagem de PCLs":
         
         st.markdown("---")
         
-        # Enriquecer dados com campos calculados
-        df_display = df_labs_filtered.copy()
-        
-        # Criar Cidade+UF
-        if 'cidade' in df_display.columns and 'uf' in df_display.columns:
-            df_display['cidade_uf'] = df_display['cidade'].fillna('') + '-' + df_display['uf'].fillna('')
-        
-        # Calcular quantidade de empresas na cidade do PCL
-        if 'cidade' in df_display.columns and not df_empresas.empty and 'cidade' in df_empresas.columns:
-            empresas_por_cidade = df_empresas.groupby('cidade').size().to_dict()
-            df_display['qtd_empresas_cidade'] = df_display['cidade'].map(empresas_por_cidade).fillna(0).astype(int)
-            
-            # Empresas ativas na cidade
-            empresas_ativas_cidade = df_empresas[df_empresas['status'] == 'Ativo'].groupby('cidade').size().to_dict() if 'status' in df_empresas.columns else {}
-            df_display['qtd_empresas_ativas_cidade'] = df_display['cidade'].map(empresas_ativas_cidade).fillna(0).astype(int)
-            
-            # Empresas inativas na cidade
-            df_display['qtd_empresas_inativas_cidade'] = df_display['qtd_empresas_cidade'] - df_display['qtd_empresas_ativas_cidade']
-            
-            # Empresas que utilizaram voucher (acumulado > 0)
-            if 'acumulado_vouchers' in df_empresas.columns:
-                empresas_com_voucher = df_empresas[df_empresas['acumulado_vouchers'].fillna(0) > 0].groupby('cidade').size().to_dict()
-                df_display['qtd_empresas_usaram_voucher'] = df_display['cidade'].map(empresas_com_voucher).fillna(0).astype(int)
-                
-                empresas_sem_voucher = df_empresas[df_empresas['acumulado_vouchers'].fillna(0) == 0].groupby('cidade').size().to_dict()
-                df_display['qtd_empresas_nunca_voucher'] = df_display['cidade'].map(empresas_sem_voucher).fillna(0).astype(int)
-                
-                # Empresas que nunca utilizaram - separado por representação (INTERNO/EXTERNO)
-                if 'representacao' in df_empresas.columns:
-                    empresas_nunca_interno = df_empresas[(df_empresas['acumulado_vouchers'].fillna(0) == 0) & 
-                                                          (df_empresas['representacao'].str.upper().str.contains('INTERNO', na=False))].groupby('cidade').size().to_dict()
-                    df_display['qtd_empresas_nunca_interno'] = df_display['cidade'].map(empresas_nunca_interno).fillna(0).astype(int)
-                    
-                    empresas_usaram_interno = df_empresas[(df_empresas['acumulado_vouchers'].fillna(0) > 0) & 
-                                                           (df_empresas['representacao'].str.upper().str.contains('INTERNO', na=False))].groupby('cidade').size().to_dict()
-                    df_display['qtd_empresas_usaram_interno'] = df_display['cidade'].map(empresas_usaram_interno).fillna(0).astype(int)
+        # Campos calculados (Cidade-UF, empresas na cidade): montados uma vez por filtro e snapshot
+        df_display = get_listing_frame('pcls', df_labs_filtered, dados['cidades_empresas'], filtros,
+                                       file_info['snapshot_id'])
         
         # Preparar DataFrame para exibição
         colunas_pcl = [
@@ -1577,29 +1860,20 @@ elif tipo_analise == "Listagem de PCLs":
             'qtd_empresas_cidade': 'Empresas na Cidade'
         }
         
-        df_final = prepare_display_dataframe(df_display, colunas_pcl, rename_map_pcl)
-        
-        if not df_final.empty:
-            st.dataframe(df_final, use_container_width=True, hide_index=True, height=500)
+        if any(c in df_display.columns for c in colunas_pcl):
+            paginated_table(df_display, df_labs, colunas_pcl, rename_map_pcl, 'pcls', filtros,
+                            file_info['snapshot_id'])
         else:
             st.warning("Nenhum dado disponível para exibição.")
         
-        # Download
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_display.to_excel(writer, index=False, sheet_name='PCLs')
-        
-        st.download_button(
-            label="📥 Download Excel",
-            data=output.getvalue(),
-            file_name=f'pcls_{datetime.now().strftime("%Y%m%d")}.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # Download (gerado só quando pedido)
+        export_download(lambda: export_frame(df_display, colunas_pcl, rename_map_pcl), 'PCLs', 'pcls',
+                        ('pcls', filtros, file_info['snapshot_id']))
 
 elif tipo_analise == "Listagem de Empresas":
     create_section_header("🏢", "Listagem de Empresas", "Base completa de empresas credenciadas")
     
-    df_empresas_filtered = apply_filters(df_empresas, estado_selecionado, cidade_selecionada)
+    df_empresas_filtered = apply_filters(df_empresas, "empresas", filtros, chaves_snapshot["empresas"])
     
     if df_empresas_filtered.empty:
         st.warning("Nenhuma empresa encontrada com os filtros selecionados.")
@@ -1626,56 +1900,9 @@ elif tipo_analise == "Listagem de Empresas":
         
         st.markdown("---")
         
-        # Enriquecer dados com campos calculados
-        df_display = df_empresas_filtered.copy()
-        
-        
-        # Criar Cidade+UF
-        if 'cidade' in df_display.columns and 'uf' in df_display.columns:
-            df_display['cidade_uf'] = df_display['cidade'].fillna('') + '-' + df_display['uf'].fillna('')
-        
-        # Calcular quantidade de PCLs na cidade da empresa
-        if 'cidade' in df_display.columns and not df_labs.empty and 'cidade' in df_labs.columns:
-            pcls_por_cidade = df_labs.groupby('cidade').size().to_dict()
-            df_display['qtd_pcls_cidade'] = df_display['cidade'].map(pcls_por_cidade).fillna(0).astype(int)
-            
-            # PCL na cidade? (Sim/Não)
-            df_display['pcl_na_cidade'] = df_display['qtd_pcls_cidade'].apply(lambda x: 'Sim' if x > 0 else 'Não')
-            
-            # PCLs ativos na cidade
-            if 'status' in df_labs.columns:
-                pcls_ativos_cidade = df_labs[df_labs['status'] == 'Ativo'].groupby('cidade').size().to_dict()
-                df_display['qtd_pcls_ativos_cidade'] = df_display['cidade'].map(pcls_ativos_cidade).fillna(0).astype(int)
-                
-                # PCLs inativos na cidade
-                df_display['qtd_pcls_inativos_cidade'] = df_display['qtd_pcls_cidade'] - df_display['qtd_pcls_ativos_cidade']
-                
-                # PCLs ativos/inativos por representação (INTERNO/EXTERNO)
-                if 'representacao' in df_labs.columns:
-                    # PCLs ativos INTERNO
-                    pcls_ativos_interno = df_labs[(df_labs['status'] == 'Ativo') & 
-                                                   (df_labs['representacao'].str.upper().str.contains('INTERNO', na=False))].groupby('cidade').size().to_dict()
-                    df_display['qtd_pcls_ativos_interno'] = df_display['cidade'].map(pcls_ativos_interno).fillna(0).astype(int)
-                    
-                    # PCLs inativos INTERNO
-                    pcls_inativos_interno = df_labs[(df_labs['status'] == 'Inativo') & 
-                                                     (df_labs['representacao'].str.upper().str.contains('INTERNO', na=False))].groupby('cidade').size().to_dict()
-                    df_display['qtd_pcls_inativos_interno'] = df_display['cidade'].map(pcls_inativos_interno).fillna(0).astype(int)
-        
-        # Garantir que colunas existam para exibição
-        if 'acumulado_vouchers' not in df_display.columns:
-            df_display['acumulado_vouchers'] = 0
-        if 'acumulado_coletas_nao_voucher' not in df_display.columns:
-            df_display['acumulado_coletas_nao_voucher'] = 0
-        if 'acumulado_coletas_total' not in df_display.columns:
-            df_display['acumulado_coletas_total'] = df_display['acumulado_vouchers'] + df_display['acumulado_coletas_nao_voucher']
-        if 'coletas_2025' not in df_display.columns:
-            df_display['coletas_2025'] = 0
-        
-        # Formatar valores para exibição
-        for col in ['acumulado_vouchers', 'acumulado_coletas_nao_voucher', 'acumulado_coletas_total', 'coletas_2025']:
-            if col in df_display.columns:
-                df_display[col] = pd.to_numeric(df_display[col], errors='coerce').fillna(0).astype(int)
+        # Campos calculados (Cidade-UF, PCLs na cidade, coletas): montados uma vez por filtro e snapshot
+        df_display = get_listing_frame('empresas', df_empresas_filtered, dados['cidades_labs'], filtros,
+                                       file_info['snapshot_id'])
         
         # Preparar DataFrame para exibição
         colunas_empresa = [
@@ -1696,24 +1923,15 @@ elif tipo_analise == "Listagem de Empresas":
             'qtd_pcls_cidade': 'PCLs na Cidade'
         }
         
-        df_final = prepare_display_dataframe(df_display, colunas_empresa, rename_map_empresa)
-        
-        if not df_final.empty:
-            st.dataframe(df_final, use_container_width=True, hide_index=True, height=500)
+        if any(c in df_display.columns for c in colunas_empresa):
+            paginated_table(df_display, df_empresas, colunas_empresa, rename_map_empresa, 'empresas', filtros,
+                            file_info['snapshot_id'])
         else:
             st.warning("Nenhum dado disponível para exibição.")
         
-        # Download
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_display.to_excel(writer, index=False, sheet_name='Empresas')
-        
-        st.download_button(
-            label="📥 Download Excel",
-            data=output.getvalue(),
-            file_name=f'empresas_{datetime.now().strftime("%Y%m%d")}.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        # Download (gerado só quando pedido)
+        export_download(lambda: export_frame(df_display, colunas_empresa, rename_map_empresa), 'Empresas', 'empresas',
+                        ('empresas', filtros, file_info['snapshot_id']))
 
 elif tipo_analise == "Análises Específicas":
     create_section_header("🔍", "Análises Específicas", "Consultas customizadas conforme demanda")
@@ -1725,56 +1943,33 @@ elif tipo_analise == "Análises Específicas":
             "2. PCLs em cidades COM Empresas INATIVAS (365 dias)",
             "3. Empresas em cidades SEM PCL credenciado",
             "4. Empresas em cidades COM PCL INATIVO (90 dias)",
+            "3b. Empresas SEM PCL em um raio de N km",
+            "4b. Empresas com PCLs no raio, todos INATIVOS (90 dias)",
             "Top PCLs por volume de coletas",
             "Estados com menor cobertura"
         ]
     )
     
+    # Resultado das quatro regras (uma passada, em cache por snapshot)
+    analises = dados['analises']
+    
     # Análise 1: PCLs em cidades SEM Empresas
     if analise_tipo == "1. PCLs em cidades SEM Empresas credenciadas":
         st.markdown("**Descrição:** Lista de PCLs em cidades que não têm nenhuma empresa credenciada.")
         
         if not df_labs.empty and not df_empresas.empty:
-            # Normalizar cidades antes de comparar
-            df_labs_norm = normalize_city_column(df_labs.copy().reset_index(drop=True), 'cidade')
-            df_empresas_norm = normalize_city_column(df_empresas.copy().reset_index(drop=True), 'cidade')
-            
-            cidades_com_empresa = set(df_empresas_norm['cidade'].dropna().unique()) if 'cidade' in df_empresas_norm.columns else set()
-            cidades_com_empresa = {c for c in cidades_com_empresa if c != ''}  # Remover strings vazias
-            
-            df_result_norm = df_labs_norm[~df_labs_norm['cidade'].isin(cidades_com_empresa)] if 'cidade' in df_labs_norm.columns else pd.DataFrame()
-            # Usar o dataframe original para manter os dados originais
-            if not df_result_norm.empty:
-                df_result = df_labs.iloc[df_result_norm.index].copy()
-            else:
-                df_result = pd.DataFrame()
+            resultado = analises[analysis_engine.PCLS_SEM_EMPRESAS]
+            df_result = df_labs.iloc[resultado.positions].copy()
             
             if not df_result.empty:
                 st.success(f"✅ Encontrados {len(df_result)} PCLs em cidades sem empresas credenciadas")
                 
-                cols = ['cnpj', 'razao_social', 'nome_fantasia', 'cidade', 'uf', 'status', 'acumulado_coletas', 'data_ultima_coleta']
-                cols_available = [c for c in cols if c in df_result.columns]
-                
-                # Fallback: usar todas as colunas se nenhuma das esperadas existir
-                if not cols_available:
-                    cols_available = df_result.columns.tolist()
-                
-                df_display = df_result[cols_available].copy()
-                
-                rename_map = {'cnpj': 'CNPJ', 'razao_social': 'Razão Social', 'nome_fantasia': 'Nome Fantasia',
-                              'cidade': 'Cidade', 'uf': 'UF', 'status': 'Status', 
-                              'acumulado_coletas': 'Coletas', 'data_ultima_coleta': 'Última Coleta'}
-                df_display = df_display.rename(columns=rename_map)
+                df_display = analysis_frame(analysis_engine.PCLS_SEM_EMPRESAS, analises, df_empresas, df_labs)
                 
                 st.dataframe(df_display, use_container_width=True, hide_index=True, height=500)
                 
                 # Download
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df_display.to_excel(writer, index=False, sheet_name='PCLs sem Empresas')
-                st.download_button("📥 Download Excel", output.getvalue(), 
-                                   f'pcls_sem_empresas_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                                   'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                export_download(df_display, 'PCLs sem Empresas', 'pcls_sem_empresas', (analise_tipo, file_info['snapshot_id']))
             else:
                 st.info("✅ Todos os PCLs estão em cidades com empresas credenciadas.")
         else:
@@ -1785,63 +1980,19 @@ elif tipo_analise == "Análises Específicas":
         st.markdown("**Descrição:** Lista de PCLs em cidades que têm empresas credenciadas, mas TODAS as empresas estão inativas (>365 dias sem voucher).")
         
         if not df_labs.empty and not df_empresas.empty:
-            # Normalizar cidades antes de comparar
-            df_labs_norm = normalize_city_column(df_labs.copy().reset_index(drop=True), 'cidade')
-            df_empresas_norm = normalize_city_column(df_empresas.copy().reset_index(drop=True), 'cidade')
-            
-            # Encontrar cidades onde TODAS as empresas são inativas
-            if 'cidade' in df_empresas_norm.columns and 'status' in df_empresas_norm.columns:
-                empresas_por_cidade = df_empresas_norm.groupby('cidade').agg({
-                    'status': lambda x: (x == 'Ativo').sum()
-                }).reset_index()
-                empresas_por_cidade.columns = ['cidade', 'empresas_ativas']
-                
-                # Cidades com empresas, mas nenhuma ativa
-                cidades_empresas_inativas = set(empresas_por_cidade[empresas_por_cidade['empresas_ativas'] == 0]['cidade'])
-                cidades_empresas_inativas = {c for c in cidades_empresas_inativas if c != ''}  # Remover strings vazias
-                
-                # PCLs nessas cidades
-                df_result_norm = df_labs_norm[df_labs_norm['cidade'].isin(cidades_empresas_inativas)] if 'cidade' in df_labs_norm.columns else pd.DataFrame()
-                # Usar o dataframe original para manter os dados originais
-                if not df_result_norm.empty:
-                    df_result = df_labs.iloc[df_result_norm.index].copy()
-                else:
-                    df_result = pd.DataFrame()
+            # Cidades com empresas, mas nenhuma ativa
+            if 'cidade' in df_empresas.columns and 'status' in df_empresas.columns:
+                resultado = analises[analysis_engine.PCLS_EMPRESAS_INATIVAS]
+                df_result = df_labs.iloc[resultado.positions].copy()
                 
                 if not df_result.empty:
                     st.warning(f"⚠️ Encontrados {len(df_result)} PCLs em cidades onde todas as empresas estão inativas")
                     
-                    cols = ['cnpj', 'razao_social', 'nome_fantasia', 'cidade', 'uf', 'status', 'acumulado_coletas', 'data_ultima_coleta']
-                    cols_available = [c for c in cols if c in df_result.columns]
-                    
-                    # Fallback: usar todas as colunas se nenhuma das esperadas existir
-                    if not cols_available:
-                        cols_available = df_result.columns.tolist()
-                    
-                    df_display = df_result[cols_available].copy()
-                    
-                    # Adicionar quantidade de empresas inativas na cidade
-                    # Criar mapeamento de cidade normalizada para original
-                    cidade_map_norm_to_orig = dict(zip(df_empresas_norm['cidade'], df_empresas['cidade']))
-                    # Mapear cidades normalizadas de volta para originais
-                    cidades_originais = {cidade_map_norm_to_orig.get(c, c) for c in cidades_empresas_inativas if c in cidade_map_norm_to_orig}
-                    emp_count = df_empresas[df_empresas['cidade'].isin(cidades_originais)].groupby('cidade').size().to_dict()
-                    df_display['empresas_inativas_cidade'] = df_display['cidade'].map(emp_count).fillna(0).astype(int)
-                    
-                    rename_map = {'cnpj': 'CNPJ', 'razao_social': 'Razão Social', 'nome_fantasia': 'Nome Fantasia',
-                                  'cidade': 'Cidade', 'uf': 'UF', 'status': 'Status PCL', 
-                                  'acumulado_coletas': 'Coletas', 'data_ultima_coleta': 'Última Coleta',
-                                  'empresas_inativas_cidade': 'Empresas Inativas na Cidade'}
-                    df_display = df_display.rename(columns=rename_map)
+                    df_display = analysis_frame(analysis_engine.PCLS_EMPRESAS_INATIVAS, analises, df_empresas, df_labs)
                     
                     st.dataframe(df_display, use_container_width=True, hide_index=True, height=500)
                     
-                    output = BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        df_display.to_excel(writer, index=False, sheet_name='PCLs Empresas Inativas')
-                    st.download_button("📥 Download Excel", output.getvalue(), 
-                                       f'pcls_empresas_inativas_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                                       'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                    export_download(df_display, 'PCLs Empresas Inativas', 'pcls_empresas_inativas', (analise_tipo, file_info['snapshot_id']))
                 else:
                     st.success("✅ Não há PCLs em cidades onde todas as empresas estão inativas.")
             else:
@@ -1854,45 +2005,17 @@ elif tipo_analise == "Análises Específicas":
         st.markdown("**Descrição:** Lista de empresas em cidades que não têm nenhum PCL credenciado.")
         
         if not df_labs.empty and not df_empresas.empty:
-            # Normalizar cidades antes de comparar
-            df_labs_norm = normalize_city_column(df_labs.copy().reset_index(drop=True), 'cidade')
-            df_empresas_norm = normalize_city_column(df_empresas.copy().reset_index(drop=True), 'cidade')
-            
-            cidades_com_pcl = set(df_labs_norm['cidade'].dropna().unique()) if 'cidade' in df_labs_norm.columns else set()
-            cidades_com_pcl = {c for c in cidades_com_pcl if c != ''}  # Remover strings vazias
-            
-            df_result_norm = df_empresas_norm[~df_empresas_norm['cidade'].isin(cidades_com_pcl)] if 'cidade' in df_empresas_norm.columns else pd.DataFrame()
-            # Usar o dataframe original para manter os dados originais
-            if not df_result_norm.empty:
-                df_result = df_empresas.iloc[df_result_norm.index].copy()
-            else:
-                df_result = pd.DataFrame()
+            resultado = analises[analysis_engine.EMPRESAS_SEM_PCL]
+            df_result = df_empresas.iloc[resultado.positions].copy()
             
             if not df_result.empty:
                 st.error(f"❌ Encontradas {len(df_result)} empresas em cidades sem PCL credenciado")
                 
-                cols = ['cnpj', 'razao_social', 'nome_fantasia', 'cidade', 'uf', 'status', 'acumulado_vouchers', 'data_ultima_utilizacao']
-                cols_available = [c for c in cols if c in df_result.columns]
-                
-                # Fallback: usar todas as colunas se nenhuma das esperadas existir
-                if not cols_available:
-                    cols_available = df_result.columns.tolist()
-                
-                df_display = df_result[cols_available].copy()
-                
-                rename_map = {'cnpj': 'CNPJ', 'razao_social': 'Razão Social', 'nome_fantasia': 'Nome Fantasia',
-                              'cidade': 'Cidade', 'uf': 'UF', 'status': 'Status', 
-                              'acumulado_vouchers': 'Vouchers', 'data_ultima_utilizacao': 'Última Utilização'}
-                df_display = df_display.rename(columns=rename_map)
+                df_display = analysis_frame(analysis_engine.EMPRESAS_SEM_PCL, analises, df_empresas, df_labs)
                 
                 st.dataframe(df_display, use_container_width=True, hide_index=True, height=500)
                 
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df_display.to_excel(writer, index=False, sheet_name='Empresas sem PCL')
-                st.download_button("📥 Download Excel", output.getvalue(), 
-                                   f'empresas_sem_pcl_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                                   'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                export_download(df_display, 'Empresas sem PCL', 'empresas_sem_pcl', (analise_tipo, file_info['snapshot_id']))
             else:
                 st.success("✅ Todas as empresas estão em cidades com PCL credenciado.")
         else:
@@ -1903,63 +2026,19 @@ elif tipo_analise == "Análises Específicas":
         st.markdown("**Descrição:** Lista de empresas em cidades que têm PCL credenciado, mas TODOS os PCLs estão inativos (>90 dias sem coleta).")
         
         if not df_labs.empty and not df_empresas.empty:
-            # Normalizar cidades antes de comparar
-            df_labs_norm = normalize_city_column(df_labs.copy().reset_index(drop=True), 'cidade')
-            df_empresas_norm = normalize_city_column(df_empresas.copy().reset_index(drop=True), 'cidade')
-            
-            # Encontrar cidades onde TODOS os PCLs são inativos
-            if 'cidade' in df_labs_norm.columns and 'status' in df_labs_norm.columns:
-                pcls_por_cidade = df_labs_norm.groupby('cidade').agg({
-                    'status': lambda x: (x == 'Ativo').sum()
-                }).reset_index()
-                pcls_por_cidade.columns = ['cidade', 'pcls_ativos']
-                
-                # Cidades com PCLs, mas nenhum ativo
-                cidades_pcls_inativos = set(pcls_por_cidade[pcls_por_cidade['pcls_ativos'] == 0]['cidade'])
-                cidades_pcls_inativos = {c for c in cidades_pcls_inativos if c != ''}  # Remover strings vazias
-                
-                # Empresas nessas cidades
-                df_result_norm = df_empresas_norm[df_empresas_norm['cidade'].isin(cidades_pcls_inativos)] if 'cidade' in df_empresas_norm.columns else pd.DataFrame()
-                # Usar o dataframe original para manter os dados originais
-                if not df_result_norm.empty:
-                    df_result = df_empresas.iloc[df_result_norm.index].copy()
-                else:
-                    df_result = pd.DataFrame()
+            # Cidades com PCLs, mas nenhum ativo
+            if 'cidade' in df_labs.columns and 'status' in df_labs.columns:
+                resultado = analises[analysis_engine.EMPRESAS_PCLS_INATIVOS]
+                df_result = df_empresas.iloc[resultado.positions].copy()
                 
                 if not df_result.empty:
                     st.warning(f"⚠️ Encontradas {len(df_result)} empresas em cidades onde todos os PCLs estão inativos")
                     
-                    cols = ['cnpj', 'razao_social', 'nome_fantasia', 'cidade', 'uf', 'status', 'acumulado_vouchers', 'data_ultima_utilizacao']
-                    cols_available = [c for c in cols if c in df_result.columns]
-                    
-                    # Fallback: usar todas as colunas se nenhuma das esperadas existir
-                    if not cols_available:
-                        cols_available = df_result.columns.tolist()
-                    
-                    df_display = df_result[cols_available].copy()
-                    
-                    # Adicionar quantidade de PCLs inativos na cidade
-                    # Criar mapeamento de cidade normalizada para original
-                    cidade_map_norm_to_orig = dict(zip(df_labs_norm['cidade'], df_labs['cidade']))
-                    # Mapear cidades normalizadas de volta para originais
-                    cidades_originais = {cidade_map_norm_to_orig.get(c, c) for c in cidades_pcls_inativos if c in cidade_map_norm_to_orig}
-                    pcl_count = df_labs[df_labs['cidade'].isin(cidades_originais)].groupby('cidade').size().to_dict()
-                    df_display['pcls_inativos_cidade'] = df_display['cidade'].map(pcl_count).fillna(0).astype(int)
-                    
-                    rename_map = {'cnpj': 'CNPJ', 'razao_social': 'Razão Social', 'nome_fantasia': 'Nome Fantasia',
-                                  'cidade': 'Cidade', 'uf': 'UF', 'status': 'Status Empresa', 
-                                  'acumulado_vouchers': 'Vouchers', 'data_ultima_utilizacao': 'Última Utilização',
-                                  'pcls_inativos_cidade': 'PCLs Inativos na Cidade'}
-                    df_display = df_display.rename(columns=rename_map)
+                    df_display = analysis_frame(analysis_engine.EMPRESAS_PCLS_INATIVOS, analises, df_empresas, df_labs)
                     
                     st.dataframe(df_display, use_container_width=True, hide_index=True, height=500)
                     
-                    output = BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        df_display.to_excel(writer, index=False, sheet_name='Empresas PCLs Inativos')
-                    st.download_button("📥 Download Excel", output.getvalue(), 
-                                       f'empresas_pcls_inativos_{datetime.now().strftime("%Y%m%d")}.xlsx',
-                                       'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+                    export_download(df_display, 'Empresas PCLs Inativos', 'empresas_pcls_inativos', (analise_tipo, file_info['snapshot_id']))
                 else:
                     st.success("✅ Não há empresas em cidades onde todos os PCLs estão inativos.")
             else:
@@ -1967,6 +2046,63 @@ elif tipo_analise == "Análises Específicas":
         else:
             st.warning("Dados insuficientes para análise.")
     
+    # Análises 3b/4b: por distância entre municípios (centroides IBGE)
+    elif analise_tipo in ("3b. Empresas SEM PCL em um raio de N km",
+                          "4b. Empresas com PCLs no raio, todos INATIVOS (90 dias)"):
+        sem_pcl = analise_tipo.startswith("3b")
+        if sem_pcl:
+            st.markdown("**Descrição:** Lista de empresas sem nenhum PCL credenciado a até N km (distância entre os centros dos municípios), mesmo que em outra cidade.")
+        else:
+            st.markdown("**Descrição:** Lista de empresas com PCLs credenciados a até N km, mas TODOS inativos (>90 dias sem coleta).")
+        
+        centroides = get_centroids(CENTROIDS_PATH.stat().st_mtime_ns if CENTROIDS_PATH.exists() else None)
+        if centroides is None:
+            st.info(f"📍 Tabela de municípios não encontrada em `{CENTROIDS_PATH}`. Veja o README para obter o arquivo do IBGE.")
+        elif df_labs.empty or df_empresas.empty:
+            st.warning("Dados insuficientes para análise.")
+        else:
+            raio_km = st.slider("Raio (km)", min_value=5, max_value=200, value=RAIO_PADRAO_KM, step=5)
+            proximidade, resultados = get_proximity(df_empresas, df_labs, file_info['snapshot_id'], raio_km)
+            
+            regra = analysis_engine.EMPRESAS_SEM_PCL_RAIO if sem_pcl else analysis_engine.EMPRESAS_PCLS_INATIVOS_RAIO
+            resultado = resultados[regra]
+            df_result = df_empresas.iloc[resultado.positions].copy()
+            for col in ['pcl_proximo_nome', 'pcl_proximo_cidade', 'pcl_proximo_uf', 'distancia_pcl_km', 'pcls_no_raio']:
+                df_result[col] = proximidade[col].to_numpy()[resultado.positions]
+            
+            sem_coordenada = int((proximidade['pcls_no_raio'] < 0).sum())
+            if sem_coordenada:
+                st.caption(f"📍 {sem_coordenada} empresa(s) em cidades sem coordenada na tabela de municípios ficaram fora da análise")
+            
+            if not df_result.empty:
+                if sem_pcl:
+                    st.error(f"❌ Encontradas {len(df_result)} empresas sem PCL credenciado a até {raio_km} km")
+                else:
+                    st.warning(f"⚠️ Encontradas {len(df_result)} empresas onde todos os PCLs a até {raio_km} km estão inativos")
+                
+                cols = ['cnpj', 'razao_social', 'nome_fantasia', 'cidade', 'uf', 'status',
+                        'pcl_proximo_nome', 'pcl_proximo_cidade', 'pcl_proximo_uf', 'distancia_pcl_km']
+                if not sem_pcl:
+                    cols.append('pcls_no_raio')
+                df_display = df_result[[c for c in cols if c in df_result.columns]].copy()
+                
+                rename_map = {'cnpj': 'CNPJ', 'razao_social': 'Razão Social', 'nome_fantasia': 'Nome Fantasia',
+                              'cidade': 'Cidade', 'uf': 'UF', 'status': 'Status Empresa',
+                              'pcl_proximo_nome': 'PCL Ativo Mais Próximo', 'pcl_proximo_cidade': 'Cidade do PCL',
+                              'pcl_proximo_uf': 'UF do PCL', 'distancia_pcl_km': 'Distância (km)',
+                              'pcls_no_raio': f'PCLs Inativos até {raio_km} km'}
+                df_display = df_display.rename(columns=rename_map)
+                
+                st.dataframe(df_display, use_container_width=True, hide_index=True, height=500)
+                
+                arquivo = 'empresas_sem_pcl_raio' if sem_pcl else 'empresas_pcls_inativos_raio'
+                export_download(df_display, 'Empresas por Raio', f'{arquivo}_{raio_km}km',
+                                (analise_tipo, raio_km, file_info['snapshot_id']))
+            elif sem_pcl:
+                st.success(f"✅ Todas as empresas têm PCL credenciado a até {raio_km} km.")
+            else:
+                st.success(f"✅ Não há empresas onde todos os PCLs a até {raio_km} km estão inativos.")
+    
     # Top PCLs por volume
     elif analise_tipo == "Top PCLs por volume de coletas":
         if not df_labs.empty and 'acumulado_coletas' in df_labs.columns:
@@ -1982,13 +2118,22 @@ elif tipo_analise == "Análises Específicas":
     # Estados com menor cobertura
     elif analise_tipo == "Estados com menor cobertura":
         if not df_labs.empty and 'uf' in df_labs.columns:
-            cobertura = df_labs.groupby('uf').agg({
+            cobertura = df_labs.groupby('uf', observed=True).agg({
                 'cidade': 'nunique',
                 'acumulado_coletas': 'sum' if 'acumulado_coletas' in df_labs.columns else 'count'
             }).reset_index()
             cobertura.columns = ['UF', 'Cidades Atendidas', 'Total Coletas']
             cobertura = cobertura.sort_values('Cidades Atendidas')
             st.dataframe(cobertura, use_container_width=True, hide_index=True)
+    
+    # Pacote com as quatro análises (mesmas tabelas da tela)
+    st.markdown("---")
+    with st.expander("📦 Exportar as análises 1 a 4 em um único .zip"):
+        export_download(
+            lambda: {tabela['arquivo']: (analysis_frame(regra, analises, df_empresas, df_labs), tabela['aba'])
+                     for regra, tabela in ANALISES_TABELAS.items()},
+            None, 'analises_especificas', ('analises', file_info['snapshot_id']), pacote=True
+        )
 
 # ============================================
 # RODAPÉ
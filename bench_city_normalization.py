@@ -0,0 +1,77 @@
+"""
+Benchmark da normalização de cidades usada nos joins PCL x Empresa.
+
+Compara a normalização por linha (.apply de uma função por valor, com a mesma
+regra de acentos) com city_normalization.city_keys, que normaliza só os valores
+distintos, em 10 mil, 100 mil e 1 milhão de linhas, e confere que as duas
+agrupam as linhas do mesmo jeito.
+
+Uso:
+    python bench_city_normalization.py
+"""
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from city_normalization import CITY_ALIASES, city_keys
+
+TAMANHOS = [10_000, 100_000, 1_000_000]
+MUNICIPIOS = 5_570
+
+
+def normalizar_linha(valor):
+    """Mesma regra de city_normalization, sem memoização (uma chamada por linha)"""
+    if pd.isna(valor) or valor == '':
+        return ''
+    texto = unicodedata.normalize('NFKD', str(valor))
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch))
+    texto = ' '.join(texto.lower().split())
+    return CITY_ALIASES.get(texto, texto)
+
+
+def por_linha(cidades, ufs):
+    """Referência: normalização linha a linha com .apply"""
+    return cidades.apply(normalizar_linha) + '|' + ufs.apply(normalizar_linha).str.upper()
+
+
+def gerar_dados(n, seed=0):
+    rng = np.random.default_rng(seed)
+    nomes = np.array([f"São José do Município {i}" for i in range(MUNICIPIOS)], dtype=object)
+    # Mesma cidade com grafias diferentes (acento, caixa, espaços)
+    variantes = np.array([nomes, np.char.upper(nomes.astype(str)).astype(object),
+                          np.array([f"  Sao Jose do  Municipio {i} " for i in range(MUNICIPIOS)], dtype=object)])
+    escolha = rng.integers(0, MUNICIPIOS, n)
+    cidades = pd.Series(variantes[rng.integers(0, 3, n), escolha])
+    ufs = pd.Series(np.array(['SP', 'sp', 'MG', 'RJ'], dtype=object)[escolha % 4])
+    return cidades, ufs
+
+
+def cronometrar(func, *args, repeticoes=3):
+    melhor = float('inf')
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = func(*args)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+
+def main():
+    print(f"{'linhas':>10} | {'por linha (s)':>13} | {'únicos (s)':>10} | {'category (s)':>12} | {'speedup':>8}")
+    print("-" * 67)
+    for n in TAMANHOS:
+        cidades, ufs = gerar_dados(n)
+        t_antigo, r_antigo = cronometrar(por_linha, cidades, ufs, repeticoes=1)
+        t_novo, r_novo = cronometrar(city_keys, cidades, ufs)
+        # Colunas já compactadas por optimize_dtypes (como no app)
+        t_cat, r_cat = cronometrar(city_keys, cidades.astype('category'), ufs.astype('category'))
+        # Mesma partição das linhas (chave inteira x texto normalizado)
+        for r in (r_novo, r_cat):
+            assert (pd.factorize(r_antigo)[0] == pd.factorize(r)[0]).all(), "divergência nas chaves"
+        print(f"{n:>10,} | {t_antigo:>13.4f} | {t_novo:>10.4f} | {t_cat:>12.4f} | {t_antigo / t_cat:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# chart_builder.py
+"""
+Gráficos de barras do app montados a partir de agregados.
+
+Os valores, textos e a ordem do top N são calculados com arrays (numpy/pandas),
+sem listas montadas elemento a elemento. O layout é um dicionário fixo por
+tipo de gráfico. O app serializa a figura (to_json) e guarda em cache por
+(gráfico, filtros, snapshot); num rerun sem mudança só o JSON é reaproveitado.
+"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+STATUS_COLORS = {'Ativo': '#22C55E', 'Inativo': '#EF4444'}
+STATUS_NAMES = {'Ativo': 'Ativos', 'Inativo': 'Inativos'}
+
+_TITLE_FONT = dict(size=15, color='#18181B', family='Inter')
+_AXIS_X = dict(title="", showgrid=True, gridcolor='#F4F4F5', showline=False, zeroline=False,
+               tickfont=dict(size=11, color='#71717A', family='Inter'))
+_AXIS_Y = dict(title="", showline=False, tickfont=dict(size=12, color='#3F3F46', family='Inter'))
+_LEGEND = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5,
+               font=dict(size=12, color='#3F3F46', family='Inter'), bgcolor='rgba(255,255,255,0)')
+
+
+def _finite(values) -> np.ndarray:
+    """float64 com NaN/±inf trocados por 0"""
+    return np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def _labels(values) -> np.ndarray:
+    """Rótulos em texto ('' nos nulos)"""
+    return pd.Series(values, dtype=object).fillna('').astype(str).to_numpy()
+
+
+def number_text(values) -> np.ndarray:
+    """Inteiros com separador de milhar '.' (como format_number do app)"""
+    inteiros = pd.Series(_finite(values)).astype(np.int64)
+    return inteiros.map('{:,}'.format).str.replace(',', '.', regex=False).to_numpy()
+
+
+def decimal_text(values, casas=1) -> np.ndarray:
+    return np.char.mod(f'%.{casas}f', _finite(values))
+
+
+def status_counts(df, column) -> pd.DataFrame:
+    """Tabela coluna × status (Ativo/Inativo) com as contagens de linhas"""
+    if df.empty or 'status' not in df.columns:
+        return pd.DataFrame(columns=list(STATUS_COLORS))
+    tabela = df.groupby([column, 'status'], observed=True).size().unstack('status', fill_value=0)
+    return tabela[[s for s in STATUS_COLORS if s in tabela.columns]]
+
+
+def _top(values, max_items):
+    """Posições do top N pelo valor (maior primeiro, estável)"""
+    return np.argsort(-values, kind='stable')[:max_items]
+
+
+def bar_figure(labels, values, title, color='#22C55E', max_items=12, value_name='Quantidade',
+               text=None, height=None) -> go.Figure:
+    """
+    Barras horizontais do top N (maior valor no alto).
+
+    Args:
+        labels, values: Categorias e valores já agregados
+        text: Textos das barras alinhados a values (padrão: number_text)
+        height: Altura fixa (padrão: proporcional ao número de barras)
+    """
+    valores = _finite(values)
+    top = _top(valores, max_items)[::-1]
+    textos = number_text(valores) if text is None else np.asarray(text, dtype=object)
+
+    fig = go.Figure(go.Bar(
+        x=valores[top],
+        y=_labels(labels)[top],
+        orientation='h',
+        marker=dict(color=color, line=dict(width=0)),
+        text=textos[top],
+        textposition='outside',
+        textfont=dict(size=11, color='#3F3F46', family='Inter'),
+        hovertemplate=f'<b>%{{y}}</b><br>{value_name}: %{{x:,.0f}}<extra></extra>',
+    ))
+    fig.update_layout(
+        title=dict(text=title, font=_TITLE_FONT, x=0.5, xanchor='center', y=0.97),
+        xaxis=_AXIS_X,
+        yaxis=_AXIS_Y,
+        plot_bgcolor='#FFFFFF',
+        paper_bgcolor='#FFFFFF',
+        height=height or max(350, len(top) * 32 + 80),
+        margin=dict(l=10, r=60, t=50, b=20),
+        showlegend=False,
+        font=dict(family='Inter'),
+    )
+    return fig
+
+
+def grouped_bar_figure(tabela, title, colors=None, max_items=10) -> go.Figure:
+    """
+    Barras agrupadas Ativos × Inativos do top N pelo total.
+
+    Args:
+        tabela: Saída de status_counts (índice = categoria, colunas = status)
+    """
+    colors = colors or STATUS_COLORS
+    matriz = _finite(tabela.to_numpy())
+    top = _top(matriz.sum(axis=1) if matriz.size else np.zeros(len(tabela)), max_items)
+    # Ordem de exibição: crescente pela primeira série (maior no alto)
+    if matriz.size:
+        top = top[np.argsort(matriz[top, 0], kind='stable')]
+    categorias = _labels(tabela.index)[top]
+
+    fig = go.Figure()
+    for j, status in enumerate(tabela.columns):
+        nome = STATUS_NAMES.get(status, str(status))
+        valores = matriz[top, j]
+        fig.add_trace(go.Bar(
+            name=nome,
+            x=valores,
+            y=categorias,
+            orientation='h',
+            marker=dict(color=colors.get(status, STATUS_COLORS.get(status))),
+            text=number_text(valores),
+            textposition='outside',
+            textfont=dict(size=10, color='#3F3F46', family='Inter'),
+            hovertemplate=f'<b>%{{y}}</b><br>{nome}: %{{x:,.0f}}<extra></extra>',
+        ))
+    fig.update_layout(
+        title=dict(text=title, font=_TITLE_FONT, x=0.5, xanchor='center', y=0.97),
+        xaxis=_AXIS_X,
+        yaxis=_AXIS_Y,
+        barmode='group',
+        plot_bgcolor='#FFFFFF',
+        paper_bgcolor='#FFFFFF',
+        height=max(400, len(top) * 40 + 100),
+        margin=dict(l=10, r=70, t=50, b=20),
+        legend=_LEGEND,
+        font=dict(family='Inter'),
+        bargap=0.3,
+        bargroupgap=0.1,
+    )
+    return fig
+
+
+def figure_json(fig) -> str:
+    """Figura serializada (o que fica em cache)"""
+    return fig.to_json()
+
+
+def figure_from_json(texto) -> go.Figure:
+    return pio.from_json(texto, skip_invalid=True)
@@ -0,0 +1,123 @@
+# city_index.py
+"""
+Índice agregado por cidade, compartilhado pelos módulos do app.
+
+Cada linha de Empresas e Labs (PCLs) recebe uma chave inteira de cidade
+normalizada (cidade + UF, coluna CITY_KEY; ver city_normalization). O índice
+guarda, por chave, todas as contagens usadas nas listagens e análises (total,
+ativos, voucher, interno...), calculadas com um único groupby por base. As telas só fazem um join O(n) pela chave
+(city_counts) em vez de refazer vários groupby a cada rerun.
+"""
+import numpy as np
+import pandas as pd
+
+from city_normalization import MISSING_CITY_KEY, city_keys
+
+# Coluna com a chave inteira da cidade normalizada (cidade + UF)
+CITY_KEY = 'cidade_key'
+
+# Contagens por cidade de cada base
+EMPRESA_COUNTS = (
+    'empresas', 'empresas_ativas', 'empresas_inativas',
+    'empresas_usaram_voucher', 'empresas_nunca_voucher',
+    'empresas_usaram_interno', 'empresas_nunca_interno',
+)
+PCL_COUNTS = (
+    'pcls', 'pcls_ativos', 'pcls_inativos',
+    'pcls_ativos_interno', 'pcls_inativos_interno',
+)
+
+
+def add_city_key(df):
+    """
+    Acrescenta a coluna CITY_KEY: chave inteira estável de cidade+UF
+    (city_normalization.city_keys). Linhas sem cidade ficam com MISSING_CITY_KEY.
+    """
+    if df is None or df.empty or 'cidade' not in df.columns:
+        return df
+
+    df = df.copy(deep=False)
+    df[CITY_KEY] = city_keys(df['cidade'], df['uf'] if 'uf' in df.columns else None)
+    return df
+
+
+def _interno_mask(df) -> np.ndarray:
+    if 'representacao' not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    return df['representacao'].astype(str).str.upper().str.contains('INTERNO', na=False).to_numpy()
+
+
+def _count_by_key(df, flags: dict) -> pd.DataFrame:
+    """Soma das máscaras por chave de cidade (um único groupby)"""
+    frame = pd.DataFrame({name: np.asarray(mask, dtype=np.int32) for name, mask in flags.items()})
+    frame[CITY_KEY] = df[CITY_KEY].to_numpy()
+    frame = frame[frame[CITY_KEY].to_numpy() != MISSING_CITY_KEY]
+    return frame.groupby(CITY_KEY, sort=False).sum()
+
+
+def _empresa_flags(df) -> dict:
+    ativo = (df['status'] == 'Ativo').to_numpy() if 'status' in df.columns else np.zeros(len(df), dtype=bool)
+    if 'acumulado_vouchers' in df.columns:
+        vouchers = pd.to_numeric(df['acumulado_vouchers'], errors='coerce').fillna(0).to_numpy()
+    else:
+        vouchers = np.zeros(len(df))
+    usou_voucher = vouchers > 0
+    nunca_voucher = vouchers == 0
+    interno = _interno_mask(df)
+    return {
+        'empresas': np.ones(len(df), dtype=bool),
+        'empresas_ativas': ativo,
+        'empresas_inativas': ~ativo,
+        'empresas_usaram_voucher': usou_voucher,
+        'empresas_nunca_voucher': nunca_voucher,
+        'empresas_usaram_interno': usou_voucher & interno,
+        'empresas_nunca_interno': nunca_voucher & interno,
+    }
+
+
+def _pcl_flags(df) -> dict:
+    ativo = (df['status'] == 'Ativo').to_numpy() if 'status' in df.columns else np.zeros(len(df), dtype=bool)
+    inativo = (df['status'] == 'Inativo').to_numpy() if 'status' in df.columns else np.zeros(len(df), dtype=bool)
+    interno = _interno_mask(df)
+    return {
+        'pcls': np.ones(len(df), dtype=bool),
+        'pcls_ativos': ativo,
+        'pcls_inativos': inativo,
+        'pcls_ativos_interno': ativo & interno,
+        'pcls_inativos_interno': inativo & interno,
+    }
+
+
+def build_city_index(df_empresas, df_labs) -> pd.DataFrame:
+    """
+    Monta o índice por cidade (uma linha por CITY_KEY, colunas EMPRESA_COUNTS + PCL_COUNTS).
+
+    As duas bases precisam ter passado por add_city_key(). Cidades presentes em
+    só uma das bases ficam com 0 nas contagens da outra.
+    """
+    partes = []
+    for df, flags, colunas in ((df_empresas, _empresa_flags, EMPRESA_COUNTS), (df_labs, _pcl_flags, PCL_COUNTS)):
+        if df is not None and not df.empty and CITY_KEY in df.columns:
+            partes.append(_count_by_key(df, flags(df)))
+        else:
+            partes.append(pd.DataFrame(columns=list(colunas), index=pd.Index([], dtype=np.int64), dtype=np.int32))
+
+    index = pd.concat(partes, axis=1, join='outer').fillna(0).astype(np.int32)
+    index.index.name = CITY_KEY
+    return index
+
+
+def city_counts(index: pd.DataFrame, df, columns) -> pd.DataFrame:
+    """
+    Contagens da cidade de cada linha de df (join pela chave, alinhado ao índice de df).
+    Linhas sem cidade ou de cidades fora do índice recebem 0.
+    """
+    columns = list(columns)
+    if df is None or df.empty or CITY_KEY not in df.columns:
+        return pd.DataFrame(0, index=getattr(df, 'index', None), columns=columns, dtype=int)
+
+    # Join pelos valores distintos da chave + linha de zeros para cidades ausentes
+    codes, uniques = pd.factorize(df[CITY_KEY].to_numpy())
+    table = index.reindex(uniques)[columns].fillna(0).to_numpy(dtype=np.int64)
+    table = np.vstack([table, np.zeros((1, len(columns)), dtype=np.int64)])
+    return pd.DataFrame(table[codes], index=df.index, columns=columns)
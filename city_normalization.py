@@ -0,0 +1,111 @@
+# city_normalization.py
+"""
+Normalização de nomes de cidade para joins entre PCLs e Empresas.
+
+A normalização (NFKD sem acentos, minúsculas, espaços colapsados e tabela de
+apelidos opcional) roda só nos valores distintos: factorize -> normaliza os
+únicos -> espalha pelos códigos. O resultado final é uma chave inteira estável
+por cidade+UF (hash de 64 bits do nome normalizado), igual nas duas bases e
+entre execuções, usada como chave de join no city_index.
+"""
+import hashlib
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Chave das linhas sem cidade
+MISSING_CITY_KEY = -1
+
+# Apelidos/grafias antigas -> nome oficial (já normalizados, sem acento e em minúsculas)
+CITY_ALIASES = {
+    'embu': 'embu das artes',
+    'moji mirim': 'mogi mirim',
+    'moji guacu': 'mogi guacu',
+    'moji das cruzes': 'mogi das cruzes',
+    'parati': 'paraty',
+    'sao luis do maranhao': 'sao luis',
+}
+
+
+@lru_cache(maxsize=65536)
+def _fold_str(text: str) -> str:
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def fold_text(value) -> str:
+    """Texto sem acentos (NFKD), em minúsculas e com espaços colapsados; '' para nulos (memoizado)"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    return _fold_str(str(value))
+
+
+def normalize_city_name(city, aliases=None) -> str:
+    """Normaliza um nome de cidade (sem acentos, minúsculas, apelidos resolvidos)"""
+    name = fold_text(city)
+    if aliases is None:
+        aliases = CITY_ALIASES
+    return aliases.get(name, name)
+
+
+def normalize_uf(uf) -> str:
+    return fold_text(uf).upper()
+
+
+def _factorize(values):
+    """(códigos por linha, valores distintos); nulos com código -1"""
+    if isinstance(values, pd.Series) and isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values)
+
+
+def normalize_values(values, normalizer) -> np.ndarray:
+    """
+    Aplica o normalizador só nos valores distintos e espalha pelas linhas.
+    Nulos viram ''.
+    """
+    codes, uniques = _factorize(values)
+    normalized = np.array([normalizer(u) for u in uniques] + [''], dtype=object)
+    return normalized[codes]  # código -1 (nulo) cai no '' final
+
+
+def _stable_key(text: str) -> int:
+    """Hash de 64 bits (com sinal, não negativo) estável entre execuções"""
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+def city_keys(cidades, ufs=None, aliases=None) -> np.ndarray:
+    """
+    Chave inteira (int64) de cidade+UF por linha; MISSING_CITY_KEY quando não há cidade.
+
+    Args:
+        cidades: Série/array com os nomes de cidade como vieram do Excel
+        ufs: Série/array com as UFs (opcional)
+        aliases: Tabela de apelidos {nome normalizado: nome oficial}; padrão CITY_ALIASES
+    """
+    codes_cidade, cidades_unicas = _factorize(cidades)
+    nomes = [normalize_city_name(c, aliases) for c in cidades_unicas] + ['']
+    if ufs is not None:
+        codes_uf, ufs_unicas = _factorize(ufs)
+        estados = [normalize_uf(u) for u in ufs_unicas] + ['']
+    else:
+        codes_uf = np.full(len(codes_cidade), -1)
+        estados = ['']
+
+    # Nulos (código -1) apontam para o '' no fim de cada lista
+    codes_cidade = np.where(codes_cidade < 0, len(nomes) - 1, codes_cidade).astype(np.int64)
+    codes_uf = np.where(codes_uf < 0, len(estados) - 1, codes_uf).astype(np.int64)
+
+    # Par (cidade, UF) como um único inteiro; o hash só roda nos pares distintos
+    codes, pares = pd.factorize(codes_cidade * len(estados) + codes_uf)
+    keys = np.empty(len(pares), dtype=np.int64)
+    for i, p in enumerate(pares):
+        nome = nomes[p // len(estados)]
+        estado = estados[p % len(estados)]
+        keys[i] = _stable_key(f"{nome}|{estado}") if nome else MISSING_CITY_KEY
+    return keys[codes]
@@ -0,0 +1,2 @@
+# test_sp_connection.py é uma página Streamlit de verificação manual (streamlit run), não um teste
+collect_ignore = ["test_sp_connection.py"]
@@ -0,0 +1,19 @@
+# csv_stream.py
+"""
+CSV de um DataFrame gerado em blocos de linhas (bytes UTF-8, cabeçalho só no
+primeiro bloco), sem montar o texto inteiro em memória.
+
+Módulo neutro, só com pandas: usado pelo upload do SPConnector (write_csv) e
+pelas exportações do app (export_service), sem que um dependa do outro.
+"""
+import pandas as pd
+
+# Linhas por bloco do CSV
+CSV_CHUNK_ROWS = 50_000
+
+
+def csv_chunks(df: pd.DataFrame, rows: int = CSV_CHUNK_ROWS):
+    """Gera o CSV (UTF-8) em blocos de linhas (cabeçalho só no primeiro bloco)"""
+    for start in range(0, max(len(df), 1), rows):
+        part = df.iloc[start:start + rows]
+        yield part.to_csv(index=False, header=(start == 0)).encode('utf-8')
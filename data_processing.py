@@ -0,0 +1,353 @@
+# data_processing.py
+"""
+Normalização de colunas e processamento das bases de Empresas e Labs (PCLs).
+
+Funções puras sobre DataFrames (sem Streamlit), usadas pelo app.py e pelos benchmarks.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Status como Categorical de dois valores (ordem fixa: códigos 0 = Ativo, 1 = Inativo)
+STATUS_DTYPE = pd.CategoricalDtype(["Ativo", "Inativo"])
+
+# Limites de atividade (dias sem coleta)
+DIAS_ATIVO_EMPRESA = 365
+DIAS_ATIVO_PCL = 90
+
+# Compactação de tipos (optimize_dtypes)
+# Texto de baixa cardinalidade -> category
+CATEGORY_COLUMNS = ('uf', 'cidade', 'representante', 'status')
+# Só vira category se houver no máximo esta fração de valores distintos
+CATEGORY_MAX_RATIO = 0.5
+# Contadores (float64 por causa do fillna(0)) -> inteiro
+COUNT_COLUMNS = (
+    'acumulado_coletas', 'acumulado_coletas_ano', 'coletas_2025',
+    'acumulado_vouchers', 'acumulado_coletas_nao_voucher', 'acumulado_coletas_total',
+)
+# Inteiro mínimo dos contadores: int32 evita overflow em somas elemento a elemento
+COUNT_MIN_DTYPE = np.int32
+# Datas -> datetime64
+DATE_COLUMNS = (
+    'data_credenciamento', 'data_ultima_coleta',
+    'ultima_coleta', 'ultima_coleta_voucher', 'ultima_coleta_nao_voucher',
+)
+
+
+def status_from_mask(ativo) -> pd.Categorical:
+    """Converte uma máscara booleana em Categorical Ativo/Inativo (sem loop Python)"""
+    codes = np.where(np.asarray(ativo, dtype=bool), 0, 1).astype(np.int8)
+    return pd.Categorical.from_codes(codes, dtype=STATUS_DTYPE)
+
+
+def _numeric(df, col, default):
+    """Coluna numérica como array float (default para ausentes/não numéricos)"""
+    if col in df.columns:
+        return pd.to_numeric(df[col], errors='coerce').fillna(default).to_numpy(dtype=float)
+    return np.full(len(df), default, dtype=float)
+
+
+def truthy_mask(values: pd.Series) -> np.ndarray:
+    """
+    Máscara de valores verdadeiros com a mesma regra de antes
+    (x == True ou str(x).lower() == 'true'), avaliada só nos valores distintos.
+    """
+    if pd.api.types.is_bool_dtype(values):
+        return values.fillna(False).to_numpy(dtype=bool)
+    codes, uniques = pd.factorize(values)
+    if len(uniques) == 0:
+        return np.zeros(len(values), dtype=bool)
+    flags = np.array([u == True or str(u).lower() == 'true' for u in uniques], dtype=bool)
+    return np.where(codes >= 0, flags[codes], False)
+
+
+# Mapeamento baseado nas colunas reais dos arquivos Excel (cabeçalho já em minúsculas, sem espaços nas pontas)
+# Inclui versões com e sem acentos para compatibilidade de encoding
+COLUMN_MAPPING = {
+    # Identificação - Empresas
+    'cnpj da empresa': 'cnpj',
+    'cnpj': 'cnpj',
+    'nome da empresa': 'razao_social',
+    'razao social': 'razao_social',
+    'razão social': 'razao_social',
+    'nome fantasia': 'nome_fantasia',
+    # Datas
+    'data de credenciamento': 'data_credenciamento',
+    'data credenciamento': 'data_credenciamento',
+    'data da última coleta': 'data_ultima_coleta',
+    'data da ultima coleta': 'data_ultima_coleta',
+    'data última coleta': 'data_ultima_coleta',
+    'última coleta (voucher)': 'ultima_coleta_voucher',
+    'ultima coleta (voucher)': 'ultima_coleta_voucher',
+    'última coleta (não-voucher)': 'ultima_coleta_nao_voucher',
+    'ultima coleta (nao-voucher)': 'ultima_coleta_nao_voucher',
+    # Dias sem coleta
+    'dias sem coleta': 'dias_sem_coleta',
+    'dias sem coleta (voucher)': 'dias_sem_coleta_voucher',
+    'dias sem coleta (não-voucher)': 'dias_sem_coleta_nao_voucher',
+    'dias sem coleta (nao-voucher)': 'dias_sem_coleta_nao_voucher',
+    # Localização
+    'cidade': 'cidade',
+    'estado': 'uf',
+    'uf': 'uf',
+    'representante': 'representante',
+    # Vouchers/Coletas - Empresas
+    'acumulado coletas voucher': 'acumulado_vouchers',
+    'acumulado coletas não-voucher': 'acumulado_coletas_nao_voucher',
+    'acumulado coletas nao-voucher': 'acumulado_coletas_nao_voucher',
+    'total coletas voucher 2024': 'vouchers_2024',
+    'total coletas voucher 2025': 'vouchers_2025',
+    'total coletas não-voucher 2024': 'coletas_nao_voucher_2024',
+    'total coletas nao-voucher 2024': 'coletas_nao_voucher_2024',
+    'total coletas não-voucher 2025': 'coletas_nao_voucher_2025',
+    'total coletas nao-voucher 2025': 'coletas_nao_voucher_2025',
+    # Coletas - PCLs
+    'acumulado de coletas': 'acumulado_coletas',
+    'total de coletas 2024': 'coletas_2024',
+    'total de coletas 2025': 'coletas_2025',
+}
+
+def _antes_de_voucher(col_lower):
+    return col_lower.split('voucher')[0][-5:]
+
+
+def _eh_nao_voucher(col_lower):
+    return 'n' in _antes_de_voucher(col_lower) or 'nao' in col_lower or 'não' in col_lower
+
+
+# Fallback por substring (lidar com diferentes encodings), na ordem de prioridade.
+# Cada regra só dispara se a coluna canônica ainda não existir.
+COLUMN_HEURISTICS = (
+    ('razao_social', lambda c: 'raz' in c and 'social' in c),
+    ('nome_fantasia', lambda c: 'nome fantasia' in c),
+    ('data_ultima_coleta', lambda c: 'ltima coleta' in c and 'voucher' not in c),
+    ('ultima_coleta_voucher', lambda c: 'ltima coleta' in c and 'voucher' in c and 'n' not in _antes_de_voucher(c)),
+    ('ultima_coleta_nao_voucher', lambda c: 'ltima coleta' in c and 'voucher' in c and _eh_nao_voucher(c)),
+    ('dias_sem_coleta_voucher', lambda c: 'dias sem coleta' in c and 'voucher' in c and 'n' not in _antes_de_voucher(c)),
+    ('dias_sem_coleta_nao_voucher', lambda c: 'dias sem coleta' in c and 'voucher' in c and _eh_nao_voucher(c)),
+)
+
+# Resultado da resolução: nomes finais (na ordem das colunas) e, por coluna, (original, final, regra)
+ColumnResolution = namedtuple('ColumnResolution', ['names', 'report'])
+
+
+@lru_cache(maxsize=64)
+def resolve_column_mapping(headers: tuple) -> ColumnResolution:
+    """
+    Resolve cabeçalho bruto -> nomes canônicos uma única vez por assinatura de cabeçalho
+    (memoizado pela tupla de nomes originais).
+
+    A regra registrada para cada coluna no report é 'direto' (COLUMN_MAPPING),
+    'heuristica:<canônico>' (COLUMN_HEURISTICS) ou None (mantida só normalizada).
+    """
+    names = [h.strip().lower() if isinstance(h, str) else h for h in headers]
+    rules = [None] * len(names)
+
+    # Mapeamento direto
+    for i, name in enumerate(names):
+        if name in COLUMN_MAPPING:
+            names[i] = COLUMN_MAPPING[name]
+            rules[i] = 'direto'
+
+    # Fallback por substring, mesma semântica do rename sequencial: cada coluna do
+    # cabeçalho pós-mapeamento é testada uma vez, vendo as renomeações anteriores
+    for col in list(names):
+        if not isinstance(col, str):
+            continue
+        col_lower = col.lower()
+        for target, regra in COLUMN_HEURISTICS:
+            if target not in names and regra(col_lower):
+                for i, name in enumerate(names):
+                    if name == col:
+                        names[i] = target
+                        rules[i] = f'heuristica:{target}'
+                break
+
+    report = tuple(zip(headers, names, rules))
+    return ColumnResolution(tuple(names), report)
+
+
+def column_mapping_report(df) -> pd.DataFrame:
+    """Tabela coluna original -> canônica -> regra aplicada (para inspeção e testes)"""
+    resolution = resolve_column_mapping(tuple(df.columns))
+    return pd.DataFrame(list(resolution.report), columns=['original', 'canonica', 'regra'])
+
+
+def normalize_column_names(df):
+    """
+    Normaliza nomes de colunas baseado nas colunas reais dos arquivos Excel.
+    Aplica todos os renomes de uma vez, sem copiar os dados (cópia rasa).
+    """
+    resolution = resolve_column_mapping(tuple(df.columns))
+    df = df.copy(deep=False)
+    df.columns = list(resolution.names)
+    return df
+
+def process_empresas(df_empresas):
+    """
+    Processa dados de empresas.
+    
+    CRITÉRIO DE ATIVIDADE:
+    Uma empresa é considerada ATIVA se:
+    - Última Coleta (Voucher) <= 365 dias OU
+    - Última Coleta (Não-Voucher) <= 365 dias OU
+    - Dias Sem Coleta (Voucher) <= 365 OU
+    - Dias Sem Coleta (Não-Voucher) <= 365
+    
+    MÉTRICAS CALCULADAS:
+    - acumulado_coletas_total: Voucher + Não-Voucher
+    - coletas_2025: Voucher 2025 + Não-Voucher 2025
+    - status: Ativo/Inativo baseado nos critérios acima
+    """
+    if df_empresas.empty:
+        return df_empresas
+    
+    df = normalize_column_names(df_empresas)
+    
+    # Garantir que colunas numéricas existam e sejam numéricas
+    if 'acumulado_vouchers' in df.columns:
+        df['acumulado_vouchers'] = pd.to_numeric(df['acumulado_vouchers'], errors='coerce').fillna(0)
+    else:
+        df['acumulado_vouchers'] = 0
+    
+    if 'acumulado_coletas_nao_voucher' in df.columns:
+        df['acumulado_coletas_nao_voucher'] = pd.to_numeric(df['acumulado_coletas_nao_voucher'], errors='coerce').fillna(0)
+    else:
+        df['acumulado_coletas_nao_voucher'] = 0
+    
+    # Total de coletas (Voucher + Não-Voucher)
+    df['acumulado_coletas_total'] = df['acumulado_vouchers'] + df['acumulado_coletas_nao_voucher']
+    
+    # Coletas 2025 (Voucher + Não-Voucher)
+    df['coletas_2025'] = _numeric(df, 'vouchers_2025', 0) + _numeric(df, 'coletas_nao_voucher_2025', 0)
+    
+    # Calcular status baseado em AMBOS os tipos de coleta
+    # Usar a coluna "Dias Sem Coleta" que já existe no Excel
+    dias_voucher = _numeric(df, 'dias_sem_coleta_voucher', 9999)
+    dias_nao_voucher = _numeric(df, 'dias_sem_coleta_nao_voucher', 9999)
+    
+    # Empresa ativa: menor dos dois dias <= 365
+    df['dias_sem_coleta_min'] = np.minimum(dias_voucher, dias_nao_voucher)
+    # Fallback: se não tem dias mas tem coletas > 0, considerar ativo
+    ativo = (df['dias_sem_coleta_min'].to_numpy() <= DIAS_ATIVO_EMPRESA) | (df['acumulado_coletas_total'].to_numpy() > 0)
+    df['status'] = status_from_mask(ativo)
+    
+    # Última coleta (a mais recente entre voucher e não-voucher)
+    if 'ultima_coleta_voucher' in df.columns:
+        df['ultima_coleta_voucher'] = pd.to_datetime(df['ultima_coleta_voucher'], errors='coerce', dayfirst=True)
+    if 'ultima_coleta_nao_voucher' in df.columns:
+        df['ultima_coleta_nao_voucher'] = pd.to_datetime(df['ultima_coleta_nao_voucher'], errors='coerce', dayfirst=True)
+    
+    # Criar coluna de última coleta geral (a mais recente)
+    if 'ultima_coleta_voucher' in df.columns and 'ultima_coleta_nao_voucher' in df.columns:
+        df['ultima_coleta'] = df[['ultima_coleta_voucher', 'ultima_coleta_nao_voucher']].max(axis=1)
+    elif 'ultima_coleta_nao_voucher' in df.columns:
+        df['ultima_coleta'] = df['ultima_coleta_nao_voucher']
+    elif 'ultima_coleta_voucher' in df.columns:
+        df['ultima_coleta'] = df['ultima_coleta_voucher']
+    
+    return df
+
+def process_labs(df_labs):
+    """
+    Processa dados de labs (PCLs).
+    
+    CRITÉRIO DE ATIVIDADE:
+    Um PCL é considerado ATIVO se:
+    - Dias sem coleta <= 90 OU
+    - Acumulado de Coletas > 0
+    
+    Usa as colunas do Excel:
+    - 'Ativo em Coletas' (booleano)
+    - 'Dias sem coleta' (número)
+    - 'Acumulado de Coletas' (número)
+    """
+    if df_labs.empty:
+        return df_labs
+    
+    df = normalize_column_names(df_labs)
+    
+    # Garantir que acumulado_coletas seja numérico
+    if 'acumulado_coletas' in df.columns:
+        df['acumulado_coletas'] = pd.to_numeric(df['acumulado_coletas'], errors='coerce').fillna(0)
+    else:
+        df['acumulado_coletas'] = 0
+    
+    # Usar coluna 'Ativo em Coletas' se existir (já vem do Excel)
+    if 'ativo em coletas' in df.columns:
+        ativo = truthy_mask(df['ativo em coletas'])
+    elif 'dias sem coleta' in df.columns:
+        # Usar dias sem coleta
+        ativo = _numeric(df, 'dias sem coleta', 9999) <= DIAS_ATIVO_PCL
+    else:
+        # Fallback: usar acumulado
+        ativo = df['acumulado_coletas'].to_numpy() > 0
+    df['status'] = status_from_mask(ativo)
+    
+    # Coletas do ano
+    if 'coletas_2025' in df.columns:
+        df['acumulado_coletas_ano'] = pd.to_numeric(df['coletas_2025'], errors='coerce').fillna(0)
+    elif 'acumulado_coletas' in df.columns:
+        df['acumulado_coletas_ano'] = df['acumulado_coletas']
+    
+    return df
+
+
+def memory_mb(df) -> float:
+    """Memória ocupada pelo DataFrame em MB (inclui o conteúdo das strings)"""
+    if df is None or df.empty:
+        return 0.0
+    return float(df.memory_usage(index=True, deep=True).sum()) / (1024 * 1024)
+
+
+def _to_count(values: pd.Series):
+    """Contador como inteiro compacto; mantém float se houver nulos ou frações"""
+    if not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+        return values
+    arr = values.to_numpy()
+    if pd.api.types.is_float_dtype(arr):
+        if not np.isfinite(arr).all() or (arr != np.round(arr)).any():
+            return values
+    if len(arr) and (arr.min() < np.iinfo(COUNT_MIN_DTYPE).min or arr.max() > np.iinfo(COUNT_MIN_DTYPE).max):
+        return values.astype(np.int64)
+    return values.astype(COUNT_MIN_DTYPE)
+
+
+def _to_date(values: pd.Series):
+    """Data como datetime64; mantém o original se algum valor preenchido não for data"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    parsed = pd.to_datetime(values, errors='coerce', dayfirst=True)
+    if parsed.notna().sum() < values.notna().sum():
+        return values
+    return parsed
+
+
+def _to_category(values: pd.Series):
+    """Texto de baixa cardinalidade como category"""
+    if isinstance(values.dtype, pd.CategoricalDtype) or len(values) == 0:
+        return values
+    if values.nunique(dropna=True) > CATEGORY_MAX_RATIO * len(values):
+        return values
+    return values.astype('category')
+
+
+def optimize_dtypes(df):
+    """
+    Compacta os tipos das bases já processadas (process_empresas / process_labs):
+    category para uf/cidade/representante/status, contadores como inteiro
+    e colunas de data como datetime64. Não copia os dados das demais colunas.
+    """
+    if df is None or df.empty:
+        return df
+
+    df = df.copy(deep=False)
+    # Colunas com nome repetido (ex.: 'estado' e 'uf' no mesmo arquivo) ficam como estão
+    unicas = set(df.columns[~df.columns.duplicated(keep=False)])
+    for cols, converter in ((CATEGORY_COLUMNS, _to_category), (COUNT_COLUMNS, _to_count), (DATE_COLUMNS, _to_date)):
+        for col in cols:
+            if col in unicas:
+                df[col] = converter(df[col])
+    return df
@@ -0,0 +1,47 @@
+# dataset_registry.py
+"""
+Registro das bases derivadas do app, resolvidas sob demanda por módulo.
+
+Cada base (ex.: 'labs', 'cubo_labs', 'indice_cidades') declara as bases de que
+depende e a função que a monta a partir delas; cada módulo da navegação declara
+só as bases que usa. A cada rerun o app resolve as bases do módulo aberto e as
+suas dependências, cada uma uma única vez, e nada mais: abrir a listagem de
+Empresas não processa PCLs. As funções de montagem são as funções em cache do
+app (por snapshot), então resolver uma base já montada é só uma consulta ao cache.
+"""
+from collections import namedtuple
+
+# deps: nomes das bases de que depende; build: função que recebe essas bases
+# (na ordem de deps) e devolve a base montada
+Dataset = namedtuple('Dataset', ['deps', 'build'])
+
+
+def _resolve_one(registry, nome, resolvidas, pilha):
+    if nome in resolvidas:
+        return resolvidas[nome]
+    if nome in pilha:
+        raise ValueError(f"Dependência circular entre bases: {' -> '.join(pilha + [nome])}")
+    if nome not in registry:
+        raise KeyError(f"Base não registrada: {nome}")
+    spec = registry[nome]
+    argumentos = [_resolve_one(registry, dep, resolvidas, pilha + [nome]) for dep in spec.deps]
+    resolvidas[nome] = spec.build(*argumentos)
+    return resolvidas[nome]
+
+
+def resolve(registry, nomes, resolvidas=None) -> dict:
+    """
+    Monta as bases pedidas e as suas dependências.
+
+    Args:
+        registry: {nome: Dataset}
+        nomes: Bases pedidas
+        resolvidas: Bases já montadas neste rerun (reaproveitadas e atualizadas)
+
+    Returns:
+        {nome: base} com as bases pedidas e todas as dependências montadas
+    """
+    resolvidas = {} if resolvidas is None else resolvidas
+    for nome in nomes:
+        _resolve_one(registry, nome, resolvidas, [])
+    return resolvidas
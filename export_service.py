@@ -0,0 +1,126 @@
+# export_service.py
+"""
+Exportação das listagens e análises: Excel, CSV, Parquet e pacote .zip.
+
+O .xlsx é gravado com o openpyxl em modo write-only: as linhas vão direto para
+o arquivo (XML em streaming), sem montar a planilha inteira em memória como o
+pd.ExcelWriter faz. O CSV é gerado em blocos de linhas (csv_chunks, o mesmo
+gerador usado no upload para o SharePoint) e o Parquet via pyarrow, o formato mais rápido de
+reimportar nos jobs de BI. O app só chama estas funções quando o usuário pede o
+arquivo, e guarda os bytes em cache por (módulo, filtros, snapshot, formato).
+"""
+import zipfile
+from io import BytesIO
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from csv_stream import CSV_CHUNK_ROWS, csv_chunks
+from snapshot_cache import PARQUET_DISPONIVEL, arrow_safe
+
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_MIME = 'text/csv'
+PARQUET_MIME = 'application/vnd.apache.parquet'
+ZIP_MIME = 'application/zip'
+
+# Formatos oferecidos: rótulo -> (extensão, mime)
+FORMATOS = {
+    'Excel': ('xlsx', XLSX_MIME),
+    'CSV': ('csv', CSV_MIME),
+    'Parquet': ('parquet', PARQUET_MIME),
+}
+
+# Limite de caracteres do nome de aba no Excel
+MAX_SHEET_NAME = 31
+
+
+def _column_values(serie: pd.Series) -> list:
+    """Valores da coluna como objetos Python, com None nos nulos (NaN/NaT/NA)"""
+    valores = serie.astype(object).to_numpy()
+    nulos = pd.isna(valores)
+    if nulos.any():
+        valores = valores.copy()
+        valores[nulos] = None
+    return valores.tolist()
+
+
+def xlsx_bytes(df: pd.DataFrame, sheet_name: str = 'Dados', rows: int = CSV_CHUNK_ROWS) -> bytes:
+    """
+    Gera o .xlsx de um DataFrame (uma aba, cabeçalho em negrito, sem índice)
+    em modo write-only. As linhas são convertidas para objetos Python em blocos
+    de `rows` linhas, então a memória extra é limitada pelo bloco, não pela base.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=str(sheet_name)[:MAX_SHEET_NAME])
+
+    negrito = Font(bold=True)
+    cabecalho = []
+    for nome in df.columns:
+        cell = WriteOnlyCell(ws, value=str(nome))
+        cell.font = negrito
+        cabecalho.append(cell)
+    ws.append(cabecalho)
+
+    for start in range(0, len(df), rows):
+        bloco = df.iloc[start:start + rows]
+        colunas = [_column_values(bloco.iloc[:, i]) for i in range(bloco.shape[1])]
+        for linha in zip(*colunas):
+            ws.append(linha)
+
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def csv_bytes(df: pd.DataFrame) -> bytes:
+    return b''.join(csv_chunks(df))
+
+
+def parquet_bytes(df: pd.DataFrame) -> bytes:
+    if not PARQUET_DISPONIVEL:
+        raise RuntimeError("pyarrow não instalado: exportação Parquet indisponível")
+    output = BytesIO()
+    arrow_safe(df).to_parquet(output, engine="pyarrow", index=False)
+    return output.getvalue()
+
+
+def available_formats() -> list:
+    """Rótulos de FORMATOS disponíveis neste ambiente"""
+    return [f for f in FORMATOS if f != 'Parquet' or PARQUET_DISPONIVEL]
+
+
+def export_bytes(df: pd.DataFrame, formato: str, sheet_name: str = 'Dados') -> bytes:
+    """Bytes do DataFrame no formato pedido ('Excel', 'CSV' ou 'Parquet')"""
+    if formato == 'Excel':
+        return xlsx_bytes(df, sheet_name)
+    if formato == 'CSV':
+        return csv_bytes(df)
+    if formato == 'Parquet':
+        return parquet_bytes(df)
+    raise ValueError(f"Formato de exportação desconhecido: {formato}")
+
+
+def zip_bytes(frames: dict, formato: str) -> bytes:
+    """
+    Pacote .zip com um arquivo por DataFrame no formato pedido.
+
+    Args:
+        frames: {nome do arquivo sem extensão: (DataFrame, nome da aba)}
+        formato: Rótulo de FORMATOS
+    """
+    extensao = FORMATOS[formato][0]
+    output = BytesIO()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for nome, (df, sheet_name) in frames.items():
+            arquivo = f"{nome}.{extensao}"
+            if formato == 'CSV':
+                # Blocos direto para a entrada do zip (sem o CSV inteiro em memória)
+                with zf.open(arquivo, 'w') as destino:
+                    for chunk in csv_chunks(df):
+                        destino.write(chunk)
+            else:
+                # xlsx e Parquet já são comprimidos
+                zf.writestr(arquivo, export_bytes(df, formato, sheet_name), compress_type=zipfile.ZIP_STORED)
+    return output.getvalue()
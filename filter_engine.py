@@ -0,0 +1,135 @@
+# filter_engine.py
+"""
+Filtros da barra lateral (UF, cidade, status) por posições de linha.
+
+Uma vez por snapshot, cada coluna de filtro vira grupos de posições por valor
+(CSR: os códigos da categoria, sem comparar texto). Um filtro com vários
+valores marca só as linhas desses grupos numa máscara booleana; filtros de
+colunas diferentes se combinam com &. O resultado são posições de linha
+(np.ndarray), e sem filtro nenhum a base é usada como está, sem cópia.
+
+A hierarquia UF → cidades (das duas bases) alimenta o filtro dependente de
+cidade na barra lateral: só as cidades das UFs selecionadas viram opções.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+FILTER_COLUMNS = ('uf', 'cidade', 'status')
+
+# Por coluna: valores distintos (pd.Index), offsets e posições agrupadas por valor
+# (linhas do valor i em rows[offsets[i]:offsets[i + 1]])
+ColumnGroups = namedtuple('ColumnGroups', ['values', 'offsets', 'rows'])
+FilterIndex = namedtuple('FilterIndex', ['n_rows', 'columns'])
+
+
+def _factorize(series):
+    """(códigos, valores distintos); usa os códigos da categoria quando houver"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), pd.Index(series.cat.categories)
+    codes, uniques = pd.factorize(series)
+    return codes, pd.Index(uniques)
+
+
+def _column_groups(series) -> ColumnGroups:
+    codes, values = _factorize(series)
+    validos = np.flatnonzero(codes >= 0)
+    codes = codes[validos]
+    ordem = np.argsort(codes, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(values)))))
+    return ColumnGroups(values, offsets.astype(np.int64), validos[ordem].astype(np.int32))
+
+
+def build_filter_index(df, columns=FILTER_COLUMNS) -> FilterIndex:
+    """Grupos de posições por valor das colunas de filtro presentes em df"""
+    return FilterIndex(len(df), {col: _column_groups(df[col]) for col in columns if col in df.columns})
+
+
+def column_values(index, column) -> list:
+    """Valores distintos de uma coluna indexada (que têm ao menos uma linha), ordenados"""
+    grupos = index.columns.get(column)
+    if grupos is None:
+        return []
+    com_linhas = np.flatnonzero(np.diff(grupos.offsets) > 0)
+    return sorted(str(v) for v in grupos.values[com_linhas])
+
+
+def _value_pairs(df, parent, child) -> pd.DataFrame:
+    """Pares distintos (pai, filho) de uma base, deduplicados pelos códigos"""
+    codes_pai, pais = _factorize(df[parent])
+    codes_filho, filhos = _factorize(df[child])
+    validos = codes_filho >= 0
+    chaves = np.unique(codes_pai[validos].astype(np.int64) * len(filhos) + codes_filho[validos])
+    pai, filho = np.divmod(chaves, max(len(filhos), 1))
+    # Código -1 (pai nulo) vira None
+    pais = np.append(np.asarray(pais, dtype=object), None)
+    return pd.DataFrame({parent: pais[pai], child: np.asarray(filhos, dtype=object)[filho]})
+
+
+def build_hierarchy(frames, parent='uf', child='cidade') -> dict:
+    """
+    Hierarquia pai → filhos (ex.: UF → cidades) a partir de várias bases.
+
+    Returns:
+        {pai: lista ordenada de filhos}; filhos com pai nulo ficam na chave None
+    """
+    partes = [_value_pairs(df, parent, child) for df in frames
+              if df is not None and not df.empty and parent in df.columns and child in df.columns]
+    if not partes:
+        return {}
+    pares = pd.concat(partes, ignore_index=True).drop_duplicates()
+    hierarquia = {}
+    for pai, filho in zip(pares[parent].tolist(), pares[child].tolist()):
+        hierarquia.setdefault(None if pd.isna(pai) else str(pai), []).append(str(filho))
+    return {pai: sorted(set(filhos)) for pai, filhos in hierarquia.items()}
+
+
+def merge_hierarchies(hierarquias) -> dict:
+    """Une hierarquias de bases diferentes (filhos ordenados e sem repetição)"""
+    unida = {}
+    for hierarquia in hierarquias:
+        for pai, filhos in hierarquia.items():
+            unida.setdefault(pai, set()).update(filhos)
+    return {pai: sorted(filhos) for pai, filhos in unida.items()}
+
+
+def hierarchy_children(hierarchy, parents=()) -> list:
+    """Filhos dos pais selecionados (todos quando nenhum), ordenados e sem repetição"""
+    chaves = parents if parents else hierarchy.keys()
+    return sorted({filho for pai in chaves for filho in hierarchy.get(pai, ())})
+
+
+def _value_mask(index, column, selected) -> np.ndarray:
+    grupos = index.columns[column]
+    mask = np.zeros(index.n_rows, dtype=bool)
+    for i in grupos.values.get_indexer(list(selected)):
+        if i >= 0:
+            mask[grupos.rows[grupos.offsets[i]:grupos.offsets[i + 1]]] = True
+    return mask
+
+
+def select_rows(index, selections) -> np.ndarray:
+    """
+    Posições das linhas que atendem a todos os filtros.
+
+    Args:
+        index: FilterIndex da base
+        selections: {coluna: valores aceitos}; lista vazia/None = sem filtro na coluna.
+                    Coluna filtrada que não existe na base não tem efeito.
+
+    Returns:
+        np.ndarray de posições ordenadas, ou None quando não há filtro (todas as linhas)
+    """
+    mask = None
+    for column, selected in selections.items():
+        if not selected or column not in index.columns:
+            continue
+        coluna_mask = _value_mask(index, column, selected)
+        mask = coluna_mask if mask is None else (mask & coluna_mask)
+    return None if mask is None else np.flatnonzero(mask)
+
+
+def apply_selection(df, positions):
+    """Base filtrada pelas posições de select_rows (a própria base se None)"""
+    return df if positions is None else df.iloc[positions]
@@ -0,0 +1,475 @@
+# history_store.py
+"""
+Histórico mensal (append-only) das bases de Empresas e Labs (PCLs).
+
+Cada .xlsx mensal entra uma única vez no histórico, já processado, como uma
+partição Parquet do mês de referência:
+
+    historico/{dataset}/dados/mes=AAAA-MM/part.parquet
+    historico/{dataset}/diffs/mes=AAAA-MM/part.parquet
+    historico/{dataset}/agregados/mes=AAAA-MM/part.parquet
+    historico/{dataset}/manifest.json
+
+O manifest registra os arquivos de origem já ingeridos (chave snapshot_key:
+nome + tamanho + data de modificação), então nenhum workbook antigo é relido.
+A cada mês ingerido são calculadas as diferenças por CNPJ em relação ao mês
+anterior: empresas/PCLs novos, removidos, alterados e mudanças de status.
+Um arquivo reemitido para um mês já existente substitui aquela partição se
+for mais recente (a data de modificação da fonte vencedora fica no manifest);
+versões mais antigas do mesmo mês são ignoradas.
+
+Também na ingestão são gravados os agregados do mês por UF (total, ativos,
+inativos e coletas acumuladas), de algumas dezenas de linhas. As tendências
+leem só esses agregados, com filtro de meses e UFs empurrado para a leitura
+Parquet, sem abrir as partições completas.
+"""
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from snapshot_cache import PARQUET_DISPONIVEL, arrow_safe
+
+if PARQUET_DISPONIVEL:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+HISTORY_DIR = Path("historico")
+
+# Colunas comparadas entre meses consecutivos
+DIFF_COLUMNS = (
+    'status', 'cidade', 'uf', 'representante',
+    'acumulado_coletas', 'acumulado_vouchers', 'acumulado_coletas_nao_voucher', 'acumulado_coletas_total',
+)
+
+# Agregados mensais por UF
+AGGREGATE_COLUMNS = ('total', 'ativos', 'inativos', 'coletas')
+
+# Coluna de coletas acumuladas somada nos agregados (a primeira que existir)
+COLETAS_COLUMNS = ('acumulado_coletas_total', 'acumulado_coletas')
+
+# UF ausente nos agregados
+UF_NAO_INFORMADA = 'N/I'
+
+# Máximo de arquivos ingeridos por chamada de ingest_sources (a carga inicial
+# de um histórico longo é feita em lotes, sob demanda)
+SOURCES_PER_RUN = 6
+
+# Data no nome do arquivo: AAAA-MM-DD / AAAAMMDD, DD-MM-AAAA ou AAAA-MM
+_DATA_AMD = re.compile(r'(20\d{2})[-_.]?(0[1-9]|1[0-2])[-_.]?(0[1-9]|[12]\d|3[01])(?!\d)')
+_DATA_DMA = re.compile(r'(?<!\d)(0[1-9]|[12]\d|3[01])[-_.](0[1-9]|1[0-2])[-_.](20\d{2})')
+_DATA_AM = re.compile(r'(20\d{2})[-_.](0[1-9]|1[0-2])(?!\d)')
+
+
+def reference_month(name, modified=None):
+    """
+    Mês de referência (AAAA-MM) de um arquivo: data no nome, se houver,
+    senão a data de modificação (datetime, ISO 8601 ou timestamp em ns).
+    """
+    m = _DATA_AMD.search(name)
+    if m:
+        return f"{m.group(1)}-{m.group(2)}"
+    m = _DATA_DMA.search(name)
+    if m:
+        return f"{m.group(3)}-{m.group(2)}"
+    m = _DATA_AM.search(name)
+    if m:
+        return f"{m.group(1)}-{m.group(2)}"
+    if modified is None or modified == '':
+        return None
+    if isinstance(modified, (int, np.integer)):
+        data = pd.Timestamp(int(modified), unit='ns')
+    else:
+        data = pd.Timestamp(modified)
+    return data.strftime('%Y-%m')
+
+
+def modified_key(modified):
+    """
+    Data de modificação comparável entre fontes (texto UTC de largura fixa) a partir
+    de datetime, ISO 8601 ou timestamp em ns; None se ausente ou inválida.
+    """
+    if modified is None or modified == '':
+        return None
+    try:
+        if isinstance(modified, (int, np.integer)):
+            data = pd.Timestamp(int(modified), unit='ns', tz='UTC')
+        else:
+            data = pd.Timestamp(modified)
+            data = data.tz_localize('UTC') if data.tzinfo is None else data.tz_convert('UTC')
+    except (TypeError, ValueError):
+        return None
+    return data.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _dataset_dir(dataset):
+    return HISTORY_DIR / dataset
+
+
+def partition_path(dataset, mes, kind='dados'):
+    return _dataset_dir(dataset) / kind / f"mes={mes}" / "part.parquet"
+
+
+def load_manifest(dataset):
+    path = _dataset_dir(dataset) / "manifest.json"
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding='utf-8'))
+        except Exception as e:
+            print(f"Manifest do histórico inválido '{path}', será recriado: {e}")
+    return {'fontes': {}, 'meses': {}, 'ignoradas': {}}
+
+
+def _save_manifest(dataset, manifest):
+    path = _dataset_dir(dataset) / "manifest.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding='utf-8')
+    os.replace(tmp, path)
+
+
+def is_ingested(dataset, source_key, manifest=None):
+    manifest = manifest if manifest is not None else load_manifest(dataset)
+    return source_key in manifest['fontes']
+
+
+def months(dataset):
+    """Meses presentes no histórico, em ordem"""
+    return sorted(load_manifest(dataset)['meses'])
+
+
+def version(dataset):
+    """
+    Estado do histórico para chaves de cache: (mês, fonte ingerida) em ordem.
+    Muda quando um mês entra ou quando a fonte de um mês é substituída.
+    """
+    return tuple(sorted(load_manifest(dataset)['meses'].items()))
+
+
+def _write_partition(df, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        arrow_safe(df).to_parquet(tmp, engine="pyarrow", index=False)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def read_month(dataset, mes, columns=None):
+    """Partição de um mês (ou None se não existir)"""
+    path = partition_path(dataset, mes)
+    if not path.exists():
+        return None
+    return pd.read_parquet(path, engine="pyarrow", columns=columns)
+
+
+def read_diffs(dataset, meses=None):
+    """Diferenças por CNPJ dos meses pedidos (todos se None), com a coluna 'mes'"""
+    partes = []
+    for mes in (meses if meses is not None else months(dataset)):
+        path = partition_path(dataset, mes, 'diffs')
+        if path.exists():
+            partes.append(pd.read_parquet(path, engine="pyarrow").assign(mes=mes))
+    return pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+
+
+def _by_cnpj(df):
+    """Linhas indexadas pelo CNPJ só com dígitos (sem CNPJ ficam de fora; repetidos: último)"""
+    if df is None or df.empty or 'cnpj' not in df.columns:
+        return pd.DataFrame()
+    chave = df['cnpj'].astype(str).str.replace(r'\D', '', regex=True)
+    df = df.assign(_cnpj=chave.to_numpy())
+    df = df[(chave != '').to_numpy()]
+    return df.drop_duplicates('_cnpj', keep='last').set_index('_cnpj')
+
+
+def _alterado(antes: pd.Series, depois: pd.Series) -> np.ndarray:
+    """Valores diferentes (nulo == nulo), comparando números como números e o resto como texto"""
+    if pd.api.types.is_numeric_dtype(antes) and pd.api.types.is_numeric_dtype(depois):
+        a = antes.to_numpy(dtype=float)
+        b = depois.to_numpy(dtype=float)
+        return ~((a == b) | (np.isnan(a) & np.isnan(b)))
+    a = antes.astype(object)
+    b = depois.astype(object)
+    nulos = a.isna().to_numpy() & b.isna().to_numpy()
+    return ~(nulos | (a.astype(str).to_numpy() == b.astype(str).to_numpy()))
+
+
+def compute_diff(df_anterior, df_atual, mes_anterior=None) -> pd.DataFrame:
+    """
+    Diferenças por CNPJ entre dois meses.
+
+    Returns:
+        DataFrame com cnpj, razao_social, cidade, uf, tipo ('novo', 'removido',
+        'alterado'), status_anterior, status_atual, status_mudou,
+        colunas_alteradas e mes_anterior. CNPJs sem mudança não entram.
+    """
+    anterior = _by_cnpj(df_anterior)
+    atual = _by_cnpj(df_atual)
+
+    novos = atual.index.difference(anterior.index)
+    removidos = anterior.index.difference(atual.index)
+    comuns = atual.index.intersection(anterior.index)
+
+    colunas = [c for c in DIFF_COLUMNS if c in atual.columns and c in anterior.columns]
+    alteradas = np.full(len(comuns), '', dtype=object)
+    mudou = np.zeros(len(comuns), dtype=bool)
+    status_mudou = np.zeros(len(comuns), dtype=bool)
+    for col in colunas:
+        flag = _alterado(anterior.loc[comuns, col], atual.loc[comuns, col])
+        alteradas = np.where(flag, alteradas + np.where(alteradas == '', '', ',') + col, alteradas)
+        mudou |= flag
+        if col == 'status':
+            status_mudou = flag
+    alterados = comuns[mudou]
+
+    def info(df, idx, col):
+        if col not in df.columns or len(idx) == 0:
+            return np.full(len(idx), None, dtype=object)
+        return df.loc[idx, col].astype(object).to_numpy()
+
+    partes = []
+    for tipo, idx, origem in (('novo', novos, atual), ('removido', removidos, anterior), ('alterado', alterados, atual)):
+        if len(idx) == 0:
+            continue
+        parte = pd.DataFrame({
+            'cnpj': info(origem, idx, 'cnpj'),
+            'razao_social': info(origem, idx, 'razao_social'),
+            'cidade': info(origem, idx, 'cidade'),
+            'uf': info(origem, idx, 'uf'),
+            'tipo': tipo,
+            'status_anterior': info(anterior, idx, 'status') if tipo != 'novo' else None,
+            'status_atual': info(atual, idx, 'status') if tipo != 'removido' else None,
+        })
+        if tipo == 'alterado':
+            parte['status_mudou'] = status_mudou[mudou]
+            parte['colunas_alteradas'] = alteradas[mudou]
+        else:
+            parte['status_mudou'] = False
+            parte['colunas_alteradas'] = ''
+        partes.append(parte)
+
+    colunas_saida = ['cnpj', 'razao_social', 'cidade', 'uf', 'tipo', 'status_anterior', 'status_atual',
+                     'status_mudou', 'colunas_alteradas', 'mes_anterior']
+    if not partes:
+        return pd.DataFrame(columns=colunas_saida)
+    diff = pd.concat(partes, ignore_index=True)
+    diff['mes_anterior'] = mes_anterior
+    return diff[colunas_saida]
+
+
+def _update_diff(dataset, mes, meses):
+    """Recalcula o diff de um mês contra o mês anterior presente no histórico"""
+    anteriores = [m for m in meses if m < mes]
+    path = partition_path(dataset, mes, 'diffs')
+    if not anteriores:
+        # Primeiro mês do histórico: não há com o que comparar
+        path.unlink(missing_ok=True)
+        return None
+    mes_anterior = anteriores[-1]
+    colunas = ['cnpj', 'razao_social'] + list(DIFF_COLUMNS)
+    diff = compute_diff(_read_columns(dataset, mes_anterior, colunas), _read_columns(dataset, mes, colunas), mes_anterior)
+    _write_partition(diff, path)
+    return diff
+
+
+def _read_columns(dataset, mes, columns):
+    """Lê só as colunas existentes na partição (pushdown de colunas)"""
+    path = partition_path(dataset, mes)
+    existentes = set(pq.read_schema(path).names)
+    return read_month(dataset, mes, [c for c in columns if c in existentes])
+
+
+def compute_aggregates(df) -> pd.DataFrame:
+    """Por UF: total de linhas, ativos, inativos e soma das coletas acumuladas"""
+    n = len(df)
+    if 'uf' in df.columns:
+        uf = df['uf'].astype(object).fillna(UF_NAO_INFORMADA).replace('', UF_NAO_INFORMADA).to_numpy()
+    else:
+        uf = np.full(n, UF_NAO_INFORMADA, dtype=object)
+    ativo = (df['status'] == 'Ativo').to_numpy() if 'status' in df.columns else np.zeros(n, dtype=bool)
+    coluna = next((c for c in COLETAS_COLUMNS if c in df.columns), None)
+    coletas = (pd.to_numeric(df[coluna], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+               if coluna else np.zeros(n))
+
+    codes, ufs = pd.factorize(uf)
+    total = np.bincount(codes, minlength=len(ufs)).astype(np.int64)
+    ativos = np.bincount(codes, weights=ativo, minlength=len(ufs)).astype(np.int64)
+    return pd.DataFrame({
+        'uf': np.asarray(ufs, dtype=object),
+        'total': total,
+        'ativos': ativos,
+        'inativos': total - ativos,
+        'coletas': np.bincount(codes, weights=coletas, minlength=len(ufs)),
+    })
+
+
+def ensure_aggregates(dataset):
+    """
+    Gera os agregados dos meses que ainda não têm (ingeridos antes deles existirem),
+    lendo só uf/status/coletas da partição do mês.
+    """
+    for mes in months(dataset):
+        if partition_path(dataset, mes, 'agregados').exists() or not partition_path(dataset, mes).exists():
+            continue
+        df = _read_columns(dataset, mes, ['uf', 'status', *COLETAS_COLUMNS])
+        _write_partition(compute_aggregates(df), partition_path(dataset, mes, 'agregados'))
+
+
+def read_aggregates(dataset, meses=None, ufs=None, columns=AGGREGATE_COLUMNS) -> pd.DataFrame:
+    """
+    Agregados por mês e UF. Só as partições dos meses pedidos são abertas e o
+    filtro de UF e a seleção de colunas vão para o leitor Parquet.
+
+    Args:
+        dataset: "empresas" ou "labs"
+        meses: Meses (AAAA-MM) desejados; todos do histórico se None
+        ufs: UFs desejadas; todas se None
+        columns: Colunas de AGGREGATE_COLUMNS a ler
+
+    Returns:
+        DataFrame com 'mes', 'uf' e as colunas pedidas, ordenado por mês e UF
+    """
+    colunas = ['mes', 'uf', *columns]
+    if not PARQUET_DISPONIVEL:
+        return pd.DataFrame(columns=colunas)
+    ensure_aggregates(dataset)
+
+    disponiveis = months(dataset)
+    meses = disponiveis if meses is None else [m for m in disponiveis if m in set(meses)]
+    arquivos = [str(p) for p in (partition_path(dataset, m, 'agregados') for m in meses) if p.exists()]
+    if not arquivos:
+        return pd.DataFrame(columns=colunas)
+
+    particoes = ds.partitioning(pa.schema([('mes', pa.string())]), flavor='hive')
+    fonte = ds.dataset(arquivos, format='parquet', partitioning=particoes,
+                       partition_base_dir=str(_dataset_dir(dataset) / 'agregados'))
+    filtro = ds.field('uf').isin(list(ufs)) if ufs is not None else None
+    df = fonte.to_table(columns=colunas, filter=filtro).to_pandas()
+    return df.sort_values(['mes', 'uf'], ignore_index=True)
+
+
+def monthly_deltas(agregados) -> pd.DataFrame:
+    """
+    Variação mês a mês por UF a partir de read_aggregates: coletas no mês
+    (diferença das acumuladas) e saldo de ativos. O primeiro mês de cada UF fica NaN.
+    """
+    df = agregados.sort_values(['uf', 'mes'], ignore_index=True)
+    por_uf = df.groupby('uf', sort=False)
+    df['coletas_no_mes'] = por_uf['coletas'].diff()
+    if 'ativos' in df.columns:
+        df['saldo_ativos'] = por_uf['ativos'].diff()
+    return df.sort_values(['mes', 'uf'], ignore_index=True)
+
+
+def ingest(dataset, source_key, source_name, mes, df, modified=None) -> dict:
+    """
+    Grava um mês já processado no histórico e atualiza os diffs afetados
+    (o próprio mês e o mês seguinte, se houver). modified (data de modificação
+    da fonte) fica no manifest para comparar com fontes do mesmo mês que surgirem depois.
+
+    Returns:
+        Resumo: {'mes', 'linhas', 'novos', 'removidos', 'alterados', 'status_mudou'}
+    """
+    if not PARQUET_DISPONIVEL:
+        raise RuntimeError("pyarrow não instalado: histórico indisponível")
+
+    manifest = load_manifest(dataset)
+    _write_partition(df, partition_path(dataset, mes))
+    _write_partition(compute_aggregates(df), partition_path(dataset, mes, 'agregados'))
+
+    # Fonte anterior do mesmo mês (arquivo reemitido) deixa de valer
+    manifest['meses'][mes] = source_key
+    manifest['fontes'][source_key] = {
+        'nome': source_name,
+        'mes': mes,
+        'linhas': int(len(df)),
+        'modificado': modified_key(modified),
+        'ingerido_em': datetime.now().isoformat(timespec='seconds'),
+    }
+    _save_manifest(dataset, manifest)
+
+    meses = sorted(manifest['meses'])
+    diff = _update_diff(dataset, mes, meses)
+    seguintes = [m for m in meses if m > mes]
+    if seguintes:
+        _update_diff(dataset, seguintes[0], meses)
+
+    resumo = {'mes': mes, 'linhas': int(len(df)), 'novos': 0, 'removidos': 0, 'alterados': 0, 'status_mudou': 0}
+    if diff is not None and not diff.empty:
+        tipos = diff['tipo'].value_counts()
+        resumo.update({
+            'novos': int(tipos.get('novo', 0)),
+            'removidos': int(tipos.get('removido', 0)),
+            'alterados': int(tipos.get('alterado', 0)),
+            'status_mudou': int(diff['status_mudou'].sum()),
+        })
+    return resumo
+
+
+def ingest_sources(dataset, sources, process, limite=SOURCES_PER_RUN):
+    """
+    Ingere as fontes ainda não registradas no manifest, no máximo limite por chamada
+    (None = todas). Os meses mais recentes entram primeiro; as fontes que ficarem
+    de fora são ingeridas nas chamadas seguintes.
+
+    Por mês vale a fonte de modificação mais recente: uma fonte pendente mais antiga
+    que a já ingerida para o mês (ou que outra pendente do mesmo mês) não é lida;
+    fica registrada em 'ignoradas' no manifest e é reportada uma única vez.
+
+    Args:
+        dataset: "empresas" ou "labs"
+        sources: Iterável de dicts {'key', 'name', 'modified', 'load'}; 'load' é uma
+                 função sem argumentos que devolve o DataFrame bruto (só chamada se
+                 a fonte for ingerida nesta chamada)
+        process: Função DataFrame bruto -> DataFrame processado
+        limite: Máximo de fontes ingeridas nesta chamada
+
+    Returns:
+        (resumos, erros, pendentes restantes)
+    """
+    manifest = load_manifest(dataset)
+    ignoradas = manifest.setdefault('ignoradas', {})
+    por_mes = {}
+    for source in sources:
+        if source['key'] in manifest['fontes'] or source['key'] in ignoradas:
+            continue
+        mes = reference_month(source['name'], source.get('modified'))
+        if mes is None:
+            continue
+        por_mes.setdefault(mes, []).append((modified_key(source.get('modified')) or '', source))
+
+    pendentes, erros = [], []
+    for mes, candidatas in por_mes.items():
+        # A mais recente do mês vence, se não for mais antiga que a já ingerida
+        candidatas.sort(key=lambda c: c[0])
+        modificado, source = candidatas[-1]
+        atual = manifest['fontes'].get(manifest['meses'].get(mes), {}).get('modificado')
+        if atual and modificado and modificado < atual:
+            perdedoras = candidatas
+        else:
+            perdedoras = candidatas[:-1]
+            pendentes.append((mes, source))
+        for _, perdedora in perdedoras:
+            ignoradas[perdedora['key']] = {'nome': perdedora['name'], 'mes': mes}
+            erros.append(f"Histórico: {perdedora['name']} ignorado: {mes} já tem uma versão mais recente")
+    if erros:
+        _save_manifest(dataset, manifest)
+
+    resumos = []
+    # Meses mais recentes primeiro
+    pendentes.sort(key=lambda p: p[0], reverse=True)
+    lote = pendentes if limite is None else pendentes[:limite]
+    for mes, source in lote:
+        try:
+            resumos.append(ingest(dataset, source['key'], source['name'], mes,
+                                  process(source['load']()), source.get('modified')))
+        except Exception as e:
+            erros.append(f"Histórico: erro ao ingerir {source['name']}: {e}")
+    return resumos, erros, len(pendentes) - len(lote)
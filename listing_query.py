@@ -0,0 +1,39 @@
+# listing_query.py
+"""
+Consulta das listagens paginadas: ordenação e fatia da página.
+
+Tudo trabalha com posições de linha (np.ndarray): a consulta devolve a ordem
+das linhas que passam na busca (search_index), pequena o bastante para ficar
+em cache por estado de filtro, e a página é só um .iloc dessa ordem. Assim só
+as linhas visíveis são montadas e enviadas ao navegador.
+"""
+import numpy as np
+
+# Opções de linhas por página
+PAGE_SIZES = (25, 50, 100, 200)
+
+
+def listing_order(df, linhas=None, sort_column=None, ascending=True) -> np.ndarray:
+    """
+    Posições das linhas da listagem, na ordem pedida (estável; nulos por último).
+
+    Args:
+        df: DataFrame da listagem (nomes internos das colunas)
+        linhas: Rótulos do índice encontrados pela busca (None = todas as linhas)
+        sort_column: Coluna de ordenação (None = ordem original)
+        ascending: Ordem crescente
+    """
+    posicoes = np.flatnonzero(df.index.isin(linhas)) if linhas is not None else np.arange(len(df))
+    if sort_column is None or sort_column not in df.columns or len(posicoes) == 0:
+        return posicoes
+    valores = df[sort_column].iloc[posicoes].reset_index(drop=True)
+    ordem = valores.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+    return posicoes[ordem]
+
+
+def page_bounds(total, page, page_size):
+    """(início, fim, total de páginas) da página pedida (1-based, ajustada aos limites)"""
+    pages = max(1, -(-total // page_size))
+    page = min(max(1, int(page)), pages)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total), pages
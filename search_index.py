@@ -0,0 +1,199 @@
+# search_index.py
+"""
+Índice invertido de busca por snapshot: CNPJ, Razão Social e Nome Fantasia.
+
+Os textos são normalizados (NFKD sem acentos, minúsculas) e quebrados em
+tokens alfanuméricos, com operações vetorizadas só nos valores distintos; cada
+token aponta para as posições das linhas que o contêm (postings em formato CSR).
+O CNPJ fica num vetor ordenado à parte, só com os dígitos, então "07339867",
+"07.339.867/0001-15" ou "073398670001" encontram a mesma empresa (busca por
+prefixo, que cobre a raiz).
+
+Consulta: cada termo casa com os tokens que começam por ele (busca binária no
+vocabulário ordenado) ou, com 3+ letras, que o contêm (índice de trigramas
+sobre o vocabulário); termos diferentes se combinam com E. Nada é varrido
+linha a linha por consulta.
+"""
+import re
+import unicodedata
+from collections import defaultdict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+SEARCH_COLUMNS = ('cnpj', 'razao_social', 'nome_fantasia')
+
+# Tamanho dos n-gramas do índice de substrings
+TRIGRAM = 3
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# tokens: vocabulário ordenado; offsets/rows: postings CSR (linhas de tokens[i] em
+# rows[offsets[i]:offsets[i + 1]]); trigrams: {trigrama: ids de tokens};
+# cnpj_digits/cnpj_rows: dígitos do CNPJ ordenados e a linha de cada um; n_rows: linhas indexadas
+SearchIndex = namedtuple('SearchIndex', ['tokens', 'offsets', 'rows', 'trigrams', 'cnpj_digits', 'cnpj_rows', 'n_rows'])
+
+
+def normalize_text(values) -> pd.Series:
+    """Textos sem acentos (NFKD, só ASCII) e em minúsculas"""
+    texto = pd.Series(values, dtype=object).astype(str)
+    return texto.str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.lower()
+
+
+def normalize_one(value) -> str:
+    """normalize_text para um único valor (consultas)"""
+    return unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def tokenize(value) -> list:
+    """Tokens alfanuméricos do texto normalizado"""
+    return _TOKEN_RE.findall(normalize_one(value))
+
+
+def _prefix_range(sorted_values, termo):
+    """Faixa [início, fim) dos valores ordenados que começam pelo termo"""
+    return (np.searchsorted(sorted_values, termo, side='left'),
+            np.searchsorted(sorted_values, termo + '\uffff', side='left'))
+
+
+def _cnpj_index(series):
+    """Dígitos do CNPJ por linha (só linhas com dígitos), ordenados, e as linhas"""
+    codes, uniques = pd.factorize(series)
+    unicos = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.replace(r'\D', '', regex=True)
+    digitos = np.append(unicos.to_numpy(dtype=str), '')[codes]
+    linhas = np.flatnonzero(digitos != '')
+    ordem = np.argsort(digitos[linhas], kind='stable')
+    return digitos[linhas][ordem], linhas[ordem].astype(np.int32)
+
+
+def _value_tokens(series):
+    """
+    Pares (token, linha) de uma coluna, tokenizando só os valores distintos.
+    """
+    codes, uniques = pd.factorize(series)
+    validos = codes >= 0
+    linhas = np.flatnonzero(validos)
+    codes = codes[validos]
+
+    # Linhas agrupadas por valor: ordem[inicio[v]:inicio[v] + contagem[v]]
+    ordem = linhas[np.argsort(codes, kind='stable')]
+    contagem = np.bincount(codes, minlength=len(uniques))
+    inicio = np.concatenate(([0], np.cumsum(contagem)[:-1]))
+
+    # Tokens distintos de cada valor distinto: pares (valor, token)
+    pares = normalize_text(np.asarray(uniques, dtype=object)).str.findall(_TOKEN_RE).explode().dropna()
+    pares = pares[pares != ''].reset_index().drop_duplicates()
+    if pares.empty:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.int64)
+
+    par_valor = pares['index'].to_numpy(dtype=np.int64)
+    par_token = pares.iloc[:, 1].to_numpy(dtype=object)
+    repeticoes = contagem[par_valor]
+    # Cada par (valor, token) vira uma entrada por linha com aquele valor
+    deslocamento = np.arange(repeticoes.sum()) - np.repeat(np.cumsum(repeticoes) - repeticoes, repeticoes)
+    rows = ordem[np.repeat(inicio[par_valor], repeticoes) + deslocamento]
+    tokens = np.repeat(par_token, repeticoes)
+    return tokens, rows
+
+
+def build_search_index(df, columns=SEARCH_COLUMNS) -> SearchIndex:
+    """Monta o índice das colunas de busca presentes em df (posições de linha)"""
+    n = len(df)
+    cnpj_digits, cnpj_rows = np.empty(0, dtype=str), np.empty(0, dtype=np.int32)
+    partes_tokens, partes_rows = [], []
+    for col in columns:
+        if col not in df.columns:
+            continue
+        if col == 'cnpj':
+            cnpj_digits, cnpj_rows = _cnpj_index(df[col])
+            continue
+        tokens, rows = _value_tokens(df[col])
+        partes_tokens.append(tokens)
+        partes_rows.append(rows)
+
+    if not sum(len(t) for t in partes_tokens):
+        return SearchIndex(np.empty(0, dtype=str), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32),
+                           {}, cnpj_digits, cnpj_rows, n)
+
+    # Vocabulário: hash dos tokens (factorize) e ordenação só dos distintos
+    token_ids, distintos = pd.factorize(np.concatenate(partes_tokens))
+    distintos = np.asarray(distintos, dtype=str)
+    ordem = np.argsort(distintos, kind='stable')
+    vocabulario = distintos[ordem]
+    posto = np.empty(len(ordem), dtype=np.int64)
+    posto[ordem] = np.arange(len(ordem))
+    token_ids = posto[token_ids]
+
+    # Um posting por (token, linha), ordenado por token e linha
+    chaves = np.unique(token_ids.astype(np.int64) * max(n, 1) + np.concatenate(partes_rows))
+    ids, rows = np.divmod(chaves, max(n, 1))
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(ids, minlength=len(vocabulario)))))
+
+    # Trigramas do vocabulário (os tokens só de dígitos usam o prefixo)
+    trigramas = defaultdict(list)
+    for i, token in enumerate(vocabulario):
+        if len(token) > TRIGRAM and not token.isdigit():
+            for g in {token[j:j + TRIGRAM] for j in range(len(token) - TRIGRAM + 1)}:
+                trigramas[g].append(i)
+    trigramas = {g: np.asarray(ids_g, dtype=np.int64) for g, ids_g in trigramas.items()}
+
+    return SearchIndex(vocabulario, offsets.astype(np.int64), rows.astype(np.int32), trigramas,
+                       cnpj_digits, cnpj_rows, n)
+
+
+def _matching_tokens(index, termo) -> np.ndarray:
+    """Ids dos tokens que começam pelo termo ou, com 3+ caracteres, que o contêm"""
+    ids = np.arange(*_prefix_range(index.tokens, termo))
+    if len(termo) >= TRIGRAM and not termo.isdigit():
+        candidatos = None
+        for g in {termo[j:j + TRIGRAM] for j in range(len(termo) - TRIGRAM + 1)}:
+            ids_g = index.trigrams.get(g)
+            if ids_g is None:
+                candidatos = None
+                break
+            candidatos = ids_g if candidatos is None else np.intersect1d(candidatos, ids_g, assume_unique=True)
+        if candidatos is not None and len(candidatos):
+            contem = np.fromiter((termo in index.tokens[i] for i in candidatos), dtype=bool, count=len(candidatos))
+            ids = np.union1d(ids, candidatos[contem])
+    return ids
+
+
+def _term_mask(index, termo) -> np.ndarray:
+    """Máscara das linhas com algum token que casa com o termo (ou CNPJ com esse prefixo)"""
+    mask = np.zeros(index.n_rows, dtype=bool)
+    ids = _matching_tokens(index, termo)
+    if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+        # Faixa contígua do vocabulário (prefixo): um único bloco de postings
+        mask[index.rows[index.offsets[ids[0]]:index.offsets[ids[-1] + 1]]] = True
+    else:
+        for i in ids:
+            mask[index.rows[index.offsets[i]:index.offsets[i + 1]]] = True
+    if termo.isdigit() and len(index.cnpj_digits):
+        inicio, fim = _prefix_range(index.cnpj_digits, termo)
+        mask[index.cnpj_rows[inicio:fim]] = True
+    return mask
+
+
+def query_terms(texto) -> list:
+    """Termos da consulta; só números/pontuação vira um único termo de dígitos (CNPJ)"""
+    termo = normalize_one(texto).strip()
+    if termo and not any(ch.isalpha() for ch in termo):
+        digitos = ''.join(ch for ch in termo if ch.isdigit())
+        return [digitos] if digitos else []
+    return list(dict.fromkeys(_TOKEN_RE.findall(termo)))
+
+
+def search(index, texto) -> np.ndarray:
+    """
+    Posições (ordenadas) das linhas que casam com todos os termos da consulta.
+    Consulta vazia devolve todas as linhas.
+    """
+    termos = query_terms(texto)
+    if not termos:
+        return np.arange(index.n_rows)
+    resultado = _term_mask(index, termos[0])
+    for termo in termos[1:]:
+        if not resultado.any():
+            break
+        resultado &= _term_mask(index, termo)
+    return np.flatnonzero(resultado)
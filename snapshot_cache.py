@@ -0,0 +1,113 @@
+# snapshot_cache.py
+"""
+Cache colunar (Parquet) dos arquivos Excel de origem.
+
+Cada .xlsx é convertido uma única vez para Parquet. O nome do snapshot é
+derivado de nome do arquivo + tamanho + data de modificação (local: mtime;
+SharePoint: lastModifiedDateTime do Graph). Leituras seguintes fazem
+memory-map do Parquet em vez de re-parsear o XLSX com openpyxl.
+
+Quando um arquivo mais novo é encontrado (glob local ou
+get_latest_file_from_sp), a chave muda, o snapshot é recriado e os
+snapshots antigos do mesmo dataset são removidos.
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (engine do Parquet)
+    PARQUET_DISPONIVEL = True
+except ImportError:
+    PARQUET_DISPONIVEL = False
+
+SNAPSHOT_DIR = Path(".cache") / "snapshots"
+
+# Tipos que o pyarrow consegue gravar diretamente a partir de colunas object
+_TIPOS_ARROW_OK = {
+    "string", "empty", "boolean", "integer", "floating", "mixed-integer-float",
+    "decimal", "datetime", "datetime64", "date", "time", "bytes",
+}
+
+
+def snapshot_key(name, size=None, modified=None) -> str:
+    """Gera a chave do snapshot a partir de nome + tamanho + data de modificação"""
+    raw = f"{name}|{size if size is not None else ''}|{modified if modified is not None else ''}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def snapshot_path(dataset: str, key: str) -> Path:
+    return SNAPSHOT_DIR / f"{dataset}-{key}.parquet"
+
+
+def arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """Prepara o DataFrame para Parquet: nomes de coluna como texto e colunas
+    object com tipos mistos convertidas para string (nulos preservados)"""
+    df = df.copy(deep=False)
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns[df.dtypes == object]:
+        tipo = pd.api.types.infer_dtype(df[col], skipna=True)
+        if tipo not in _TIPOS_ARROW_OK:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def load_snapshot(dataset: str, key: str):
+    """Lê o snapshot via memory-map. Retorna None se não existir ou estiver corrompido."""
+    if not PARQUET_DISPONIVEL:
+        return None
+    path = snapshot_path(dataset, key)
+    if not path.exists():
+        return None
+    try:
+        return pd.read_parquet(path, engine="pyarrow", memory_map=True)
+    except Exception as e:
+        print(f"Snapshot inválido '{path.name}', será recriado: {e}")
+        return None
+
+
+def save_snapshot(dataset: str, key: str, df: pd.DataFrame) -> bool:
+    """Grava o snapshot (escrita atômica) e remove snapshots antigos do mesmo dataset"""
+    if not PARQUET_DISPONIVEL:
+        return False
+    path = snapshot_path(dataset, key)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        arrow_safe(df).to_parquet(tmp, engine="pyarrow", index=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"Não foi possível gravar snapshot de '{dataset}': {e}")
+        tmp.unlink(missing_ok=True)
+        return False
+
+    # Invalidação: só o snapshot da chave atual fica em disco
+    for old in SNAPSHOT_DIR.glob(f"{dataset}-*.parquet"):
+        if old != path:
+            old.unlink(missing_ok=True)
+    return True
+
+
+def read_with_snapshot(dataset: str, key: str, loader):
+    """
+    Retorna (DataFrame, veio_do_snapshot).
+
+    Args:
+        dataset: Nome lógico do dataset ("empresas" ou "labs")
+        key: Chave gerada por snapshot_key()
+        loader: Função sem argumentos que lê o XLSX original (só chamada em cache miss)
+
+    No cache miss devolve o snapshot recém-gravado (relido do Parquet), para a
+    primeira carga e as seguintes entregarem os mesmos tipos e nulos.
+    """
+    df = load_snapshot(dataset, key)
+    if df is not None:
+        return df, True
+    df = arrow_safe(loader())
+    if save_snapshot(dataset, key, df):
+        salvo = load_snapshot(dataset, key)
+        if salvo is not None:
+            return salvo, False
+    return df, False
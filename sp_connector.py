@@ -1,9 +1,148 @@
 # sp_connector.py
-import io, time, requests, msal, pandas as pd
+import io, os, json, time, random, hashlib, tempfile, threading, requests, msal, pandas as pd
+from email.utils import parsedate_to_datetime
+from pathlib import Path
 from urllib.parse import quote
+from requests.adapters import HTTPAdapter
 import streamlit as st
+from csv_stream import csv_chunks
 
 GRAPH = "https://graph.microsoft.com/v1.0"
+BLOB_CACHE_DIR = Path(".cache") / "sp_blobs"
+
+# Status do Graph que indicam throttling/indisponibilidade temporária (vale repetir)
+RETRY_STATUS = {429, 502, 503, 504}
+# Para métodos não idempotentes (POST) só repete quando o Graph garante que não processou
+THROTTLE_STATUS = {429, 503}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+
+# Upload: PUT simples até ~4 MB; acima disso, sessão de upload em chunks
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 10 * 320 * 1024      # Graph exige múltiplos de 320 KiB
+UPLOAD_MAX_RESUMES = 5
+
+# Metadados de item: campos pedidos ao Graph e validade do cache em memória (segundos)
+STAT_FIELDS = "id,name,size,eTag,cTag,lastModifiedDateTime,file,folder"
+STAT_TTL = 60
+
+# Listagem: campos por item, tamanho de página e estado persistido da delta query
+LIST_FIELDS = "id,name,size,eTag,cTag,lastModifiedDateTime,file,folder,parentReference"
+LIST_PAGE_SIZE = 200
+DELTA_STATE_DIR = Path(".cache") / "sp_delta"
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _shared_session(pool_size: int) -> requests.Session:
+    """
+    Sessão HTTP keep-alive compartilhada pelo processo (uma por tamanho de pool).
+    Vários SPConnector (sessões Streamlit diferentes) reaproveitam as mesmas conexões TLS;
+    o token vai em cada requisição, então compartilhar a sessão é seguro.
+    """
+    with _sessions_lock:
+        session = _sessions.get(pool_size)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[pool_size] = session
+        return session
+
+
+def _retry_after_seconds(response):
+    """Interpreta o cabeçalho Retry-After (segundos ou data HTTP). None se ausente/inválido."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Locks do índice do cache de blobs, um por diretório (compartilhados entre conectores)
+_blob_locks = {}
+_blob_locks_guard = threading.Lock()
+
+
+def _blob_lock(root: Path) -> threading.Lock:
+    key = str(root.resolve())
+    with _blob_locks_guard:
+        return _blob_locks.setdefault(key, threading.Lock())
+
+
+class _BlobCache:
+    """
+    Cache persistente do conteúdo baixado do Graph, chaveado por id do item + eTag.
+    Mantém um índice caminho -> (id, eTag) para revalidar com If-None-Match.
+    O índice é sempre lido do disco sob um lock por diretório: vários conectores
+    (um por sessão/chamada de get_sp_connector) gravam no mesmo index.json sem
+    que um apague as entradas do outro.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._index_path = self.root / "index.json"
+        self._lock = _blob_lock(self.root)
+
+    @staticmethod
+    def _digest(value: str) -> str:
+        return hashlib.sha1(value.encode("utf-8")).hexdigest()[:20]
+
+    def _blob_path(self, item_id: str, etag: str) -> Path:
+        return self.root / f"{self._digest(item_id)}-{self._digest(etag)}.bin"
+
+    def _load_index(self):
+        """Índice atual do disco (chamar com o lock)"""
+        try:
+            return json.loads(self._index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, key: str):
+        """Retorna {'id', 'etag'} conhecido para o caminho, se o blob ainda existir"""
+        with self._lock:
+            entry = self._load_index().get(key)
+        if entry and self._blob_path(entry["id"], entry["etag"]).exists():
+            return entry
+        return None
+
+    def read(self, item_id: str, etag: str):
+        try:
+            return self._blob_path(item_id, etag).read_bytes()
+        except OSError:
+            return None
+
+    def store(self, key: str, item_id: str, etag: str, content: bytes):
+        """Grava o blob (escrita atômica), atualiza o índice e remove versões antigas do item"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._blob_path(item_id, etag)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(content)
+        os.replace(tmp, path)
+        for old in self.root.glob(f"{self._digest(item_id)}-*.bin"):
+            if old != path:
+                old.unlink(missing_ok=True)
+        self.remember(key, item_id, etag)
+
+    def remember(self, key: str, item_id: str, etag: str):
+        """Acrescenta a entrada ao índice relido do disco (mescla com o que outros gravaram)"""
+        with self._lock:
+            index = self._load_index()
+            if index.get(key) == {"id": item_id, "etag": etag}:
+                return
+            index[key] = {"id": item_id, "etag": etag}
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self._index_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps(index), encoding="utf-8")
+            os.replace(tmp, self._index_path)
+
 
 class SPConnector:
     """
@@ -16,14 +155,30 @@ class SPConnector:
         (aceita tb /personal/<upn>/Documents/... que será normalizado)
       - SharePoint: RELATIVO à biblioteca (ex: "Pasta/arquivo.xlsx")
         (aceita tb server-relative /sites/<site>/<lib>/... que será normalizado)
+    Downloads:
+      - O conteúdo baixado fica em cache local (cache_dir), chaveado por id do item + eTag.
+        Cada download revalida com If-None-Match e reaproveita os bytes locais num 304.
+      - cache_dir=None desativa o cache; graph_url permite apontar para um servidor stub.
+    HTTP:
+      - Sessão keep-alive compartilhada com pool de pool_size conexões.
+      - 429/502/503/504 e falhas de conexão são repetidos até max_retries vezes, respeitando
+        Retry-After ou, na falta dele, backoff exponencial (backoff_factor * 2^tentativa).
+      - Latência por operação em stats() (requisições, tentativas extras, throttles, tempos).
+    Listagem:
+      - iter_files() percorre todas as páginas (@odata.nextLink) sob demanda.
+      - latest_file() acha o arquivo mais recente; com use_delta=True usa delta query
+        com token persistido em delta_dir (custo proporcional às mudanças).
     """
 
     def __init__(self, tenant_id, client_id, client_secret,
                  hostname=None, site_path=None, library_name=None, user_upn=None,
-                 access_token=None):
+                 access_token=None, cache_dir=BLOB_CACHE_DIR, graph_url=GRAPH,
+                 pool_size=10, max_retries=4, backoff_factor=0.5, max_backoff=60.0,
+                 use_delta=False, delta_dir=DELTA_STATE_DIR):
         self.tenant_id = tenant_id
         self.client_id = client_id
         self.client_secret = client_secret
+        self.graph_url = graph_url.rstrip("/")
 
         self.hostname = hostname or ""
         self.site_path = site_path or ""
@@ -31,15 +186,23 @@ class SPConnector:
         self.user_upn = user_upn or ""          # se presente, opera em OneDrive
         self._delegated_token = access_token     # se presente, usa token do usuário (delegated)
 
-        self._app = msal.ConfidentialClientApplication(
-            client_id=self.client_id,
-            authority=f"https://login.microsoftonline.com/{self.tenant_id}",
-            client_credential=self.client_secret,
-        )
+        self._app = None                         # criado sob demanda (só no fluxo app-only)
         self._tok = None
         self._exp = 0
         self._site_id_cache = None
         self._drive_id_cache = None
+        self._blobs = _BlobCache(cache_dir) if cache_dir else None
+        self._stat_cache = {}                    # caminho normalizado -> (instante, stat)
+        self.use_delta = use_delta               # latest_file() via delta query incremental
+        self._delta_dir = Path(delta_dir)
+        self._delta_lock = threading.Lock()
+        # Sessão HTTP compartilhada (keep-alive) entre métodos, threads e conectores
+        self._http = _shared_session(pool_size)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self._stats = {}
+        self._stats_lock = threading.Lock()
 
     # -------- Auth --------
     def _token(self):
@@ -49,6 +212,12 @@ class SPConnector:
         now = time.time()
         if self._tok and now < self._exp:
             return self._tok
+        if self._app is None:
+            self._app = msal.ConfidentialClientApplication(
+                client_id=self.client_id,
+                authority=f"https://login.microsoftonline.com/{self.tenant_id}",
+                client_credential=self.client_secret,
+            )
         res = self._app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
         if "access_token" not in res:
             raise RuntimeError(res.get("error_description") or res)
@@ -59,6 +228,63 @@ class SPConnector:
     def _headers(self):
         return {"Authorization": f"Bearer {self._token()}"}
 
+    # -------- HTTP --------
+    def _record(self, op, elapsed, retries, throttled, failed):
+        with self._stats_lock:
+            st_op = self._stats.setdefault(op, {
+                "requests": 0, "retries": 0, "throttled": 0, "errors": 0,
+                "total_time": 0.0, "max_time": 0.0,
+            })
+            st_op["requests"] += 1
+            st_op["retries"] += retries
+            st_op["throttled"] += throttled
+            st_op["errors"] += int(failed)
+            st_op["total_time"] += elapsed
+            st_op["max_time"] = max(st_op["max_time"], elapsed)
+
+    def stats(self) -> dict:
+        """Contadores por operação, com latência média (avg_time) calculada"""
+        with self._stats_lock:
+            out = {op: dict(v) for op, v in self._stats.items()}
+        for v in out.values():
+            v["avg_time"] = v["total_time"] / v["requests"] if v["requests"] else 0.0
+        return out
+
+    def _request(self, op: str, method: str, url: str, **kw):
+        """
+        Executa uma requisição pela sessão compartilhada, com retry para throttling (429/503)
+        e falhas transitórias. Retorna a última resposta (o chamador decide sobre raise_for_status).
+        """
+        inicio = time.perf_counter()
+        retries = throttled = 0
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status = RETRY_STATUS if idempotent else THROTTLE_STATUS
+        try:
+            while True:
+                response = None
+                try:
+                    response = self._http.request(method, url, **kw)
+                except (requests.ConnectionError, requests.Timeout):
+                    if retries >= self.max_retries or not idempotent:
+                        raise
+                else:
+                    if response.status_code not in retry_status or retries >= self.max_retries:
+                        self._record(op, time.perf_counter() - inicio, retries, throttled, response.status_code >= 500)
+                        return response
+                    throttled += int(response.status_code in THROTTLE_STATUS)
+
+                wait = _retry_after_seconds(response)
+                if wait is None:
+                    wait = self.backoff_factor * (2 ** retries) * (1 + random.random() * 0.25)
+                if response is not None:
+                    # Resposta descartada: devolve a conexão ao pool antes de esperar
+                    response.close()
+                time.sleep(min(wait, self.max_backoff))
+                retries += 1
+        except Exception:
+            self._record(op, time.perf_counter() - inicio, retries, throttled, True)
+            raise
+
     # -------- Modo --------
     @property
     def is_onedrive(self) -> bool:
@@ -70,8 +296,8 @@ class SPConnector:
             return None
         if self._site_id_cache:
             return self._site_id_cache
-        url = f"{GRAPH}/sites/{self.hostname}:/{self.site_path}"
-        r = requests.get(url, headers=self._headers(), timeout=30)
+        url = f"{self.graph_url}/sites/{self.hostname}:/{self.site_path}"
+        r = self._request("site_id", "GET", url, headers=self._headers(), timeout=30)
         r.raise_for_status()
         self._site_id_cache = r.json()["id"]
         return self._site_id_cache
@@ -81,8 +307,8 @@ class SPConnector:
             return None
         if self._drive_id_cache:
             return self._drive_id_cache
-        url = f"{GRAPH}/sites/{self._site_id()}/drives"
-        r = requests.get(url, headers=self._headers(), timeout=30)
+        url = f"{self.graph_url}/sites/{self._site_id()}/drives"
+        r = self._request("drive_id", "GET", url, headers=self._headers(), timeout=30)
         r.raise_for_status()
         drives = r.json().get("value", [])
         for d in drives:
@@ -95,6 +321,21 @@ class SPConnector:
                 return self._drive_id_cache
         raise RuntimeError(f"Biblioteca '{self.library_name}' não encontrada em {self.site_path}")
 
+    def _drive_base(self) -> str:
+        """URL base do drive em uso (OneDrive do usuário ou biblioteca do site)"""
+        if self.is_onedrive:
+            if self._delegated_token:
+                return f"{self.graph_url}/me/drive"
+            return f"{self.graph_url}/users/{self.user_upn}/drive"
+        return f"{self.graph_url}/drives/{self._drive_id()}"
+
+    def _item_url(self, path: str) -> str:
+        """URL do driveItem para um caminho (raiz do drive se vazio)"""
+        rel = self.normalize_path(path) if path else ""
+        if not rel:
+            return f"{self._drive_base()}/root"
+        return f"{self._drive_base()}/root:/{quote(rel, safe='/')}:"
+
     # -------- Normalização de caminho --------
     def normalize_path(self, path: str) -> str:
         """
@@ -137,41 +378,225 @@ class SPConnector:
                 return path[len(prefix):]
             return path
 
-    # -------- Download / Upload --------
-    def download(self, path: str) -> bytes:
-        rel = quote(self.normalize_path(path), safe="/")
-        if self.is_onedrive:
-            base = f"{GRAPH}/me/drive" if self._delegated_token else f"{GRAPH}/users/{self.user_upn}/drive"
-            url = f"{base}/root:/{rel}:/content"
-        else:
-            url = f"{GRAPH}/drives/{self._drive_id()}/root:/{rel}:/content"
-        r = requests.get(url, headers=self._headers(), timeout=180)
+    # -------- Metadados --------
+    def _get_item(self, path: str, op: str, if_none_match=None):
+        headers = self._headers()
+        if if_none_match:
+            headers["If-None-Match"] = if_none_match
+        return self._request(op, "GET", self._item_url(path), headers=headers,
+                             params={"$select": STAT_FIELDS}, timeout=30)
+
+    @staticmethod
+    def stat_from_item(item: dict) -> dict:
+        """Extrai de um driveItem (GET do item ou entrada de listagem) os campos de stat()"""
+        return {
+            "id": item.get("id"),
+            "name": item.get("name"),
+            "size": item.get("size"),
+            "eTag": item.get("eTag"),
+            "cTag": item.get("cTag"),
+            "lastModifiedDateTime": item.get("lastModifiedDateTime"),
+            "is_folder": "folder" in item,
+        }
+
+    def _stat_key(self, path: str) -> str:
+        return f"{self._drive_base()}|{self.normalize_path(path)}"
+
+    def remember_stat(self, path: str, item: dict) -> dict:
+        """Guarda metadados já obtidos (ex.: da listagem da pasta) para reuso por stat()/download()"""
+        stat = self.stat_from_item(item)
+        self._stat_cache[self._stat_key(path)] = (time.monotonic(), stat)
+        return stat
+
+    def _cached_stat(self, path: str, max_age: float = STAT_TTL):
+        hit = self._stat_cache.get(self._stat_key(path))
+        if hit and time.monotonic() - hit[0] < max_age:
+            return hit[1]
+        return None
+
+    def stat(self, path: str, max_age: float = STAT_TTL) -> dict:
+        """
+        Metadados do arquivo/pasta sem baixar o conteúdo: id, name, size, eTag, cTag,
+        lastModifiedDateTime e is_folder. Um único GET do item com $select (poucas centenas
+        de bytes); metadados lembrados há menos de max_age segundos são reaproveitados.
+        Levanta FileNotFoundError se o item não existir.
+        """
+        if max_age:
+            cached = self._cached_stat(path, max_age)
+            if cached is not None:
+                return cached
+        r = self._get_item(path, "stat")
         if r.status_code == 404:
             raise FileNotFoundError(path)
         r.raise_for_status()
-        return r.content
+        return self.remember_stat(path, r.json())
+
+    # -------- Download / Upload --------
+    def download(self, path: str) -> bytes:
+        """
+        Baixa o conteúdo do arquivo.
+        Com cache ativo, usa metadados recentes (stat/listagem) ou faz um GET de metadados
+        com If-None-Match (eTag conhecido):
+          - 304: arquivo inalterado, devolve os bytes locais sem transferir o conteúdo
+          - 200: baixa o conteúdo pelo id do item (se ainda não houver blob para id + eTag)
+        """
+        if self._blobs is None:
+            r = self._request("download", "GET", f"{self._item_url(path)}/content", headers=self._headers(), timeout=180)
+            if r.status_code == 404:
+                raise FileNotFoundError(path)
+            r.raise_for_status()
+            return r.content
+
+        cache_key = self._stat_key(path)
+        meta = self._cached_stat(path)
+        if meta is None:
+            entry = self._blobs.lookup(cache_key)
+            r = self._get_item(path, "download_meta", if_none_match=entry["etag"] if entry else None)
+            if r.status_code == 304 and entry:
+                content = self._blobs.read(entry["id"], entry["etag"])
+                if content is not None:
+                    return content
+                # Blob sumiu entre lookup e leitura: revalida sem condicional
+                r = self._get_item(path, "download_meta")
+            if r.status_code == 404:
+                raise FileNotFoundError(path)
+            r.raise_for_status()
+            meta = self.remember_stat(path, r.json())
+
+        item_id, etag = meta["id"], meta.get("eTag") or meta.get("cTag")
+        content = self._blobs.read(item_id, etag) if etag else None
+        if content is None:
+            r = self._request("download", "GET", f"{self._drive_base()}/items/{item_id}/content",
+                              headers=self._headers(), timeout=180)
+            if r.status_code == 404:
+                raise FileNotFoundError(path)
+            r.raise_for_status()
+            content = r.content
+            if etag:
+                self._blobs.store(cache_key, item_id, etag, content)
+        elif etag:
+            self._blobs.remember(cache_key, item_id, etag)
+        return content
 
     def upload_small(self, path: str, content: bytes, overwrite: bool = True):
-        rel = quote(self.normalize_path(path), safe="/")
         params = {"@microsoft.graph.conflictBehavior": "replace" if overwrite else "fail"}
-        if self.is_onedrive:
-            base = f"{GRAPH}/me/drive" if self._delegated_token else f"{GRAPH}/users/{self.user_upn}/drive"
-            url = f"{base}/root:/{rel}:/content"
-        else:
-            url = f"{GRAPH}/drives/{self._drive_id()}/root:/{rel}:/content"
-        r = requests.put(url, headers=self._headers(), params=params, data=content, timeout=300)
+        url = f"{self._item_url(path)}/content"
+        r = self._request("upload_small", "PUT", url, headers=self._headers(), params=params, data=content, timeout=300)
         r.raise_for_status()
-        return r.json()
+        result = r.json()
+        self.remember_stat(path, result)
+        return result
+
+    @staticmethod
+    def _as_seekable(source, chunk_size: int):
+        """
+        Converte a fonte do upload em (arquivo seekable, tamanho total).
+        Aceita bytes, arquivo binário ou iterável de bytes; fontes sem tamanho conhecido
+        são copiadas para um SpooledTemporaryFile (memória limitada a ~2 chunks).
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return io.BytesIO(source), len(source)
+        if hasattr(source, "read") and getattr(source, "seekable", lambda: False)():
+            start = source.tell()
+            size = source.seek(0, io.SEEK_END) - start
+            source.seek(start)
+            if start:
+                # Upload sempre parte do offset 0 do arquivo entregue ao Graph
+                spooled = tempfile.SpooledTemporaryFile(max_size=2 * chunk_size)
+                while True:
+                    block = source.read(chunk_size)
+                    if not block:
+                        break
+                    spooled.write(block)
+                spooled.seek(0)
+                return spooled, size
+            return source, size
+        chunks = iter(lambda: source.read(chunk_size), b"") if hasattr(source, "read") else source
+        spooled = tempfile.SpooledTemporaryFile(max_size=2 * chunk_size)
+        for block in chunks:
+            spooled.write(block)
+        size = spooled.tell()
+        spooled.seek(0)
+        return spooled, size
+
+    @staticmethod
+    def _next_offset(payload: dict, default: int) -> int:
+        ranges = (payload or {}).get("nextExpectedRanges") or []
+        if not ranges:
+            return default
+        return int(str(ranges[0]).split("-")[0])
+
+    def upload_large(self, path: str, source, overwrite: bool = True,
+                     chunk_size: int = UPLOAD_CHUNK_SIZE, progress=None):
+        """
+        Upload via sessão (createUploadSession + PUTs de intervalos de bytes).
+
+        Args:
+            source: bytes, arquivo binário ou gerador/iterável de bytes (lido em chunks)
+            chunk_size: tamanho de cada PUT (múltiplo de 320 KiB)
+            progress: callback opcional progress(bytes_enviados, total)
+
+        Falhas num chunk (após os retries de _request) retomam a partir do
+        nextExpectedRanges informado pela sessão, até UPLOAD_MAX_RESUMES vezes.
+        """
+        fh, total = self._as_seekable(source, chunk_size)
+        if total == 0:
+            # Sessão de upload não aceita arquivo vazio
+            return self.upload_small(path, b"", overwrite=overwrite)
+
+        body = {"item": {"@microsoft.graph.conflictBehavior": "replace" if overwrite else "fail"}}
+        r = self._request("upload_session", "POST", f"{self._item_url(path)}/createUploadSession",
+                          headers=self._headers(), json=body, timeout=60)
+        r.raise_for_status()
+        upload_url = r.json()["uploadUrl"]
+
+        offset = 0
+        resumes = 0
+        while True:
+            fh.seek(offset)
+            chunk = fh.read(min(chunk_size, total - offset))
+            end = offset + len(chunk) - 1
+            # uploadUrl é pré-autenticada: NÃO enviar Authorization
+            headers = {"Content-Length": str(len(chunk)), "Content-Range": f"bytes {offset}-{end}/{total}"}
+            try:
+                r = self._request("upload_chunk", "PUT", upload_url, headers=headers, data=chunk, timeout=300)
+                if r.status_code in (200, 201):
+                    if progress:
+                        progress(total, total)
+                    result = r.json()
+                    self.remember_stat(path, result)
+                    return result
+                r.raise_for_status()
+                offset = self._next_offset(r.json(), end + 1)
+                if progress:
+                    progress(offset, total)
+            except (requests.RequestException, ValueError):
+                # Retomar: perguntar à sessão qual intervalo ela espera
+                resumes += 1
+                if resumes > UPLOAD_MAX_RESUMES:
+                    self._request("upload_cancel", "DELETE", upload_url, timeout=30)
+                    raise
+                status = self._request("upload_status", "GET", upload_url, timeout=30)
+                if status.status_code == 404:
+                    raise RuntimeError(f"Sessão de upload expirada para '{path}'")
+                status.raise_for_status()
+                offset = self._next_offset(status.json(), offset)
+
+    def upload_auto(self, path: str, source, overwrite: bool = True, progress=None):
+        """PUT simples até SIMPLE_UPLOAD_LIMIT; acima disso, sessão de upload em chunks"""
+        fh, total = self._as_seekable(source, UPLOAD_CHUNK_SIZE)
+        if total <= SIMPLE_UPLOAD_LIMIT:
+            result = self.upload_small(path, fh.read(), overwrite=overwrite)
+            if progress:
+                progress(total, total)
+            return result
+        return self.upload_large(path, fh, overwrite=overwrite, progress=progress)
 
     def delete_file(self, path: str) -> bool:
         """Exclui um arquivo ou pasta (envia para a lixeira do OneDrive/SharePoint)."""
-        rel = quote(self.normalize_path(path), safe="/")
-        if self.is_onedrive:
-            base = f"{GRAPH}/me/drive" if self._delegated_token else f"{GRAPH}/users/{self.user_upn}/drive"
-            url = f"{base}/root:/{rel}"
-        else:
-            url = f"{GRAPH}/drives/{self._drive_id()}/root:/{rel}"
-        r = requests.delete(url, headers=self._headers(), timeout=60)
+        url = self._item_url(path)
+        self._stat_cache.pop(self._stat_key(path), None)
+        r = self._request("delete_file", "DELETE", url, headers=self._headers(), timeout=60)
         if r.status_code in (200, 204):
             return True
         if r.status_code == 404:
@@ -186,56 +611,169 @@ class SPConnector:
     def read_csv(self, path: str, **kw) -> pd.DataFrame:
         return pd.read_csv(io.BytesIO(self.download(path)), **kw)
 
-    def write_excel(self, df: pd.DataFrame, path: str, overwrite: bool = True):
-        bio = io.BytesIO()
-        df.to_excel(bio, index=False)
-        return self.upload_small(path, bio.getvalue(), overwrite=overwrite)
+    def write_excel(self, df: pd.DataFrame, path: str, overwrite: bool = True, progress=None):
+        # Arquivo temporário em disco acima de ~2 chunks (exports grandes não ficam inteiros em memória)
+        with tempfile.SpooledTemporaryFile(max_size=2 * UPLOAD_CHUNK_SIZE) as fh:
+            df.to_excel(fh, index=False)
+            fh.seek(0)
+            return self.upload_auto(path, fh, overwrite=overwrite, progress=progress)
 
-    def write_csv(self, df: pd.DataFrame, path: str, overwrite: bool = True):
-        bio = io.StringIO()
-        df.to_csv(bio, index=False, encoding='utf-8-sig')
-        return self.upload_small(path, bio.getvalue().encode('utf-8'), overwrite=overwrite)
+    def write_csv(self, df: pd.DataFrame, path: str, overwrite: bool = True, progress=None):
+        # CSV em blocos de linhas (mesmo gerador dos downloads do app)
+        return self.upload_auto(path, csv_chunks(df), overwrite=overwrite, progress=progress)
 
     # -------- Métodos específicos para nosso projeto --------
     def upload_file(self, path: str, content: bytes, overwrite: bool = True):
-        """Upload de arquivo genérico"""
-        return self.upload_small(path, content, overwrite)
+        """Upload de arquivo genérico (usa sessão de upload acima de SIMPLE_UPLOAD_LIMIT)"""
+        return self.upload_auto(path, content, overwrite)
 
     def file_exists(self, path: str) -> bool:
-        """Verifica se um arquivo existe"""
+        """Verifica se um arquivo existe (apenas metadados, sem baixar o conteúdo)"""
         try:
-            self.download(path)
+            self.stat(path)
             return True
         except FileNotFoundError:
             return False
         except Exception:
             return False
 
+    def _iter_pages(self, op: str, url: str, params=None):
+        """Percorre as páginas de uma coleção do Graph; produz (itens, payload) por página"""
+        while url:
+            r = self._request(op, "GET", url, headers=self._headers(), params=params, timeout=30)
+            if r.status_code == 404:
+                raise FileNotFoundError(url)
+            r.raise_for_status()
+            payload = r.json()
+            yield payload.get("value", []), payload
+            # nextLink já carrega os parâmetros da consulta
+            url, params = payload.get("@odata.nextLink"), None
+
+    def _iter_children(self, folder_path: str, select: str, orderby: str, top: int, info: dict):
+        url = f"{self._item_url(folder_path)}/children"
+        params = {"$top": top}
+        if select:
+            params["$select"] = select
+        if orderby:
+            params["$orderby"] = orderby
+        info["ordered"] = bool(orderby)
+        primeira_pagina = True
+        try:
+            for items, _ in self._iter_pages("list_files", url, params):
+                primeira_pagina = False
+                yield from items
+        except requests.HTTPError as e:
+            # Só a primeira página recusada indica $orderby sem suporte; erro numa página
+            # seguinte (itens já entregues, talvez já usados como ordenados) sobe como está
+            if not orderby or not primeira_pagina or e.response is None or e.response.status_code != 400:
+                raise
+            # Drive sem suporte ao $orderby pedido: repete sem ordenação
+            params.pop("$orderby")
+            info["ordered"] = False
+            for items, _ in self._iter_pages("list_files", url, params):
+                yield from items
+
+    def iter_files(self, folder_path: str = "", select: str = LIST_FIELDS,
+                   orderby: str = None, top: int = LIST_PAGE_SIZE):
+        """
+        Gera os itens de uma pasta percorrendo todas as páginas (@odata.nextLink) sob demanda.
+        Se o drive não aceitar o $orderby pedido (400 na primeira página), a listagem é
+        repetida sem ordenação; falhas em páginas seguintes são propagadas.
+        """
+        return self._iter_children(folder_path, select, orderby, top, {})
+
     def list_files(self, folder_path: str = ""):
-        """Lista arquivos em uma pasta"""
-        rel = self.normalize_path(folder_path) if folder_path else ""
-        
-        if self.is_onedrive:
-            base = f"{GRAPH}/me/drive" if self._delegated_token else f"{GRAPH}/users/{self.user_upn}/drive"
-            if rel:
-                # Pasta específica
-                url = f"{base}/root:/{quote(rel, safe='/')}:/children"
-            else:
-                # Raiz do drive
-                url = f"{base}/root/children"
-        else:
-            if rel:
-                url = f"{GRAPH}/drives/{self._drive_id()}/root:/{quote(rel, safe='/')}:/children"
-            else:
-                url = f"{GRAPH}/drives/{self._drive_id()}/root/children"
-        
-        r = requests.get(url, headers=self._headers(), timeout=30)
-        r.raise_for_status()
-        return r.json().get("value", [])
+        """Lista arquivos em uma pasta (todas as páginas)"""
+        # Pasta específica ou raiz do drive
+        return list(self.iter_files(folder_path))
+
+    @staticmethod
+    def is_file_with_ext(item: dict, extension: str) -> bool:
+        """True se o driveItem é um arquivo (não pasta nem removido) com a extensão pedida"""
+        is_file = "file" in item and "folder" not in item and "deleted" not in item
+        return is_file and item.get("name", "").lower().endswith(extension.lower())
+
+    def latest_file(self, folder_path: str, extension: str = ".xlsx", use_delta: bool = None):
+        """
+        Retorna o driveItem mais recente (lastModifiedDateTime) com a extensão pedida, ou None.
+        Sem delta: listagem ordenada desc, parando no primeiro arquivo que casar.
+        Com delta: estado local atualizado só com as mudanças desde a última consulta.
+        """
+        use_delta = self.use_delta if use_delta is None else use_delta
+        if use_delta:
+            items = self.delta_files(folder_path).values()
+            candidatos = [f for f in items if self.is_file_with_ext(f, extension)]
+            return max(candidatos, key=lambda f: f.get("lastModifiedDateTime", ""), default=None)
+
+        latest = None
+        info = {}
+        for item in self._iter_children(folder_path, LIST_FIELDS, "lastModifiedDateTime desc", LIST_PAGE_SIZE, info):
+            if not self.is_file_with_ext(item, extension):
+                continue
+            if info["ordered"]:
+                return item
+            if latest is None or item.get("lastModifiedDateTime", "") > latest.get("lastModifiedDateTime", ""):
+                latest = item
+        return latest
+
+    # -------- Delta query --------
+    def _delta_state_path(self, folder_path: str) -> Path:
+        key = hashlib.sha1(self._stat_key(folder_path).encode("utf-8")).hexdigest()[:20]
+        return self._delta_dir / f"{key}.json"
+
+    def delta_files(self, folder_path: str = "") -> dict:
+        """
+        Itens (id -> driveItem) filhos diretos da pasta, mantidos por delta query.
+
+        OneDrive for Business/SharePoint só aceitam delta na raiz do drive e não devolvem
+        parentReference.path; por isso a consulta é feita na raiz e os itens são filtrados
+        pelo id da pasta. O deltaLink e os itens conhecidos ficam em delta_dir, de modo que
+        cada chamada baixa apenas o que mudou desde a anterior. Token expirado (410) força
+        uma nova sincronização completa.
+        """
+        folder_id = self.stat(folder_path)["id"]
+        state_path = self._delta_state_path(folder_path)
+        with self._delta_lock:
+            try:
+                state = json.loads(state_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                state = {}
+            if state.get("folder_id") != folder_id:
+                state = {"folder_id": folder_id, "delta_link": None, "items": {}}
+
+            try:
+                self._delta_sync(state)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 410 or not state["delta_link"]:
+                    raise
+                # Token inválido: ressincroniza do zero
+                state = {"folder_id": folder_id, "delta_link": None, "items": {}}
+                self._delta_sync(state)
+
+            self._delta_dir.mkdir(parents=True, exist_ok=True)
+            tmp = state_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(state), encoding="utf-8")
+            os.replace(tmp, state_path)
+            return dict(state["items"])
+
+    def _delta_sync(self, state: dict):
+        """Aplica ao estado as mudanças desde state['delta_link'] (ou sincronização inicial)"""
+        folder_id = state["folder_id"]
+        items = state["items"]
+        url = state["delta_link"] or f"{self._drive_base()}/root/delta"
+        params = None if state["delta_link"] else {"$select": LIST_FIELDS + ",deleted"}
+        for page, payload in self._iter_pages("delta", url, params):
+            for item in page:
+                parent_id = (item.get("parentReference") or {}).get("id")
+                if "deleted" in item or parent_id != folder_id:
+                    items.pop(item.get("id"), None)
+                else:
+                    items[item["id"]] = item
+            if payload.get("@odata.deltaLink"):
+                state["delta_link"] = payload["@odata.deltaLink"]
 
     def create_folder(self, folder_path: str):
         """Cria uma pasta"""
-        rel = quote(self.normalize_path(folder_path), safe="/")
         folder_data = {
             "name": folder_path.split("/")[-1],
             "folder": {},
@@ -243,14 +781,8 @@ class SPConnector:
         }
         
         parent_path = "/".join(folder_path.split("/")[:-1]) if "/" in folder_path else ""
-        parent_rel = quote(self.normalize_path(parent_path), safe="/") if parent_path else ""
-        if self.is_onedrive:
-            base = f"{GRAPH}/me/drive" if self._delegated_token else f"{GRAPH}/users/{self.user_upn}/drive"
-            url = f"{base}/root:/{parent_rel}:/children" if parent_rel else f"{base}/root/children"
-        else:
-            url = f"{GRAPH}/drives/{self._drive_id()}/root:/{parent_rel}:/children" if parent_rel else f"{GRAPH}/drives/{self._drive_id()}/root/children"
-        
-        r = requests.post(url, headers=self._headers(), json=folder_data, timeout=30)
+        url = f"{self._item_url(parent_path)}/children"
+        r = self._request("create_folder", "POST", url, headers=self._headers(), json=folder_data, timeout=30)
         r.raise_for_status()
         return r.json()
 
@@ -266,6 +798,8 @@ def get_sp_connector():
         hostname = graph_cfg.get("hostname")
         site_path = graph_cfg.get("site_path")
         library_name = graph_cfg.get("library_name", "Documents")
+        # Ajustes opcionais do cliente HTTP (pool keep-alive, retry e listagem por delta)
+        http_opts = {k: graph_cfg[k] for k in ("pool_size", "max_retries", "backoff_factor", "use_delta") if k in graph_cfg}
         user_upn_secret = st.secrets.get("onedrive", {}).get("user_upn")
         # Se o usuário estiver autenticado, preferir token delegado
         access_token = st.session_state.get("access_token")
@@ -282,7 +816,8 @@ def get_sp_connector():
                 client_id=client_id,
                 client_secret=client_secret,
                 user_upn=user_upn_session,
-                access_token=access_token
+                access_token=access_token,
+                **http_opts
             )
 
         # 2) Verificar se site_path é um OneDrive pessoal (começa com "personal/")
@@ -309,7 +844,8 @@ def get_sp_connector():
                         tenant_id=tenant_id,
                         client_id=client_id,
                         client_secret=client_secret,
-                        user_upn=user_upn_secret
+                        user_upn=user_upn_secret,
+                        **http_opts
                     )
                 else:
                     # Tentar extrair UPN do site_path (formato: personal/username_company_com_)
@@ -323,7 +859,8 @@ def get_sp_connector():
                             tenant_id=tenant_id,
                             client_id=client_id,
                             client_secret=client_secret,
-                            user_upn=upn_email
+                            user_upn=upn_email,
+                            **http_opts
                         )
             
             # Caso contrário, é um SharePoint Site real
@@ -333,7 +870,8 @@ def get_sp_connector():
                 client_secret=client_secret,
                 hostname=hostname,
                 site_path=site_path_clean,
-                library_name=library_name
+                library_name=library_name,
+                **http_opts
             )
 
         # Fallback para OneDrive do usuário
@@ -342,7 +880,8 @@ def get_sp_connector():
                 tenant_id=tenant_id,
                 client_id=client_id,
                 client_secret=client_secret,
-                user_upn=user_upn_secret
+                user_upn=user_upn_secret,
+                **http_opts
             )
 
         # Se nada disponível
@@ -0,0 +1,179 @@
+# spatial_index.py
+"""
+Proximidade Empresa -> PCL pelas coordenadas dos municípios (centroides IBGE).
+
+A tabela de centroides é um CSV local (CENTROIDS_PATH) no formato da base de
+municípios do IBGE: codigo_ibge, nome, latitude, longitude e a UF como sigla
+('uf') ou código IBGE ('codigo_uf'). Sem o arquivo, a análise por raio fica
+indisponível e o resto do app segue igual.
+
+Como PCLs e Empresas são localizados pelo centroide do município, o cálculo é
+feito entre municípios distintos (no máximo ~5.570 de cada lado) com haversine
+vetorizado em blocos, e depois espalhado para as linhas pela chave de cidade.
+Assim o custo não cresce com o número de empresas, só com o de municípios.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from city_index import CITY_KEY
+from city_normalization import MISSING_CITY_KEY, city_keys
+
+CENTROIDS_PATH = Path("data") / "municipios_ibge.csv"
+
+# Raio padrão das regras por distância (km)
+RAIO_PADRAO_KM = 30
+
+RAIO_TERRA_KM = 6371.0088
+
+# Linhas de municípios de empresas por bloco da matriz de distâncias
+BLOCO_MUNICIPIOS = 512
+
+# Código IBGE da UF -> sigla
+UF_POR_CODIGO = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO',
+    21: 'MA', 22: 'PI', 23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA',
+    31: 'MG', 32: 'ES', 33: 'RJ', 35: 'SP',
+    41: 'PR', 42: 'SC', 43: 'RS',
+    50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF',
+}
+
+# Colunas acrescentadas por empresa (nearest_pcls)
+PROXIMITY_COLUMNS = (
+    'pcl_proximo_cnpj', 'pcl_proximo_nome', 'pcl_proximo_cidade', 'pcl_proximo_uf',
+    'distancia_pcl_km', 'pcls_no_raio', 'pcls_ativos_no_raio',
+)
+
+
+def load_centroids(path=CENTROIDS_PATH):
+    """
+    Lê a tabela de centroides e devolve DataFrame indexado por CITY_KEY com
+    latitude/longitude. Retorna None se o arquivo não existir ou for inválido.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    try:
+        df = pd.read_csv(path, dtype={'nome': str})
+    except Exception as e:
+        print(f"Tabela de municípios inválida '{path}': {e}")
+        return None
+
+    df.columns = [c.strip().lower() for c in df.columns]
+    if 'uf' not in df.columns and 'codigo_uf' in df.columns:
+        df['uf'] = pd.to_numeric(df['codigo_uf'], errors='coerce').map(UF_POR_CODIGO)
+    if not {'nome', 'uf', 'latitude', 'longitude'} <= set(df.columns):
+        print(f"Tabela de municípios '{path}' sem colunas nome/uf/latitude/longitude")
+        return None
+
+    centroids = pd.DataFrame({
+        CITY_KEY: city_keys(df['nome'], df['uf']),
+        'latitude': pd.to_numeric(df['latitude'], errors='coerce'),
+        'longitude': pd.to_numeric(df['longitude'], errors='coerce'),
+    }).dropna()
+    centroids = centroids[centroids[CITY_KEY] != MISSING_CITY_KEY]
+    return centroids.drop_duplicates(CITY_KEY).set_index(CITY_KEY)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distância em km (arrays numpy com broadcasting, coordenadas em graus)"""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _pcl_municipios(df_labs, centroids):
+    """PCLs agrupados por município com coordenadas: contagens e um PCL ativo de referência"""
+    keys = df_labs[CITY_KEY].to_numpy()
+    ativo = (df_labs['status'] == 'Ativo').to_numpy() if 'status' in df_labs.columns else np.zeros(len(df_labs), dtype=bool)
+    com_coord = np.isin(keys, centroids.index.to_numpy())
+
+    codes, municipios = pd.factorize(keys[com_coord])
+    total = np.bincount(codes, minlength=len(municipios))
+    ativos = np.bincount(codes, weights=ativo[com_coord], minlength=len(municipios)).astype(np.int64)
+
+    # Primeiro PCL ativo de cada município (posição em df_labs)
+    posicoes = np.flatnonzero(com_coord)
+    referencia = np.full(len(municipios), -1, dtype=np.int64)
+    ativos_codes = codes[ativo[com_coord]]
+    municipios_ativos, primeiro = np.unique(ativos_codes, return_index=True)
+    referencia[municipios_ativos] = posicoes[ativo[com_coord]][primeiro]
+
+    coords = centroids.loc[municipios, ['latitude', 'longitude']].to_numpy()
+    return municipios, coords, total, ativos, referencia
+
+
+def nearest_pcls(df_empresas, df_labs, centroids, raio_km=RAIO_PADRAO_KM) -> pd.DataFrame:
+    """
+    Para cada empresa: PCL ativo mais próximo (cnpj, nome, cidade, UF), distância
+    em km entre os centroides dos municípios e quantidade de PCLs (total e ativos)
+    a até raio_km. Empresas em municípios sem coordenada ficam com distância NaN
+    e contagens -1.
+
+    Returns:
+        DataFrame com PROXIMITY_COLUMNS, alinhado ao índice de df_empresas
+    """
+    n = len(df_empresas)
+    out = pd.DataFrame({
+        'pcl_proximo_cnpj': pd.Series([None] * n, dtype=object),
+        'pcl_proximo_nome': pd.Series([None] * n, dtype=object),
+        'pcl_proximo_cidade': pd.Series([None] * n, dtype=object),
+        'pcl_proximo_uf': pd.Series([None] * n, dtype=object),
+        'distancia_pcl_km': np.full(n, np.nan),
+        'pcls_no_raio': np.full(n, -1, dtype=np.int64),
+        'pcls_ativos_no_raio': np.full(n, -1, dtype=np.int64),
+    })
+    out.index = df_empresas.index
+    if (centroids is None or centroids.empty or n == 0 or CITY_KEY not in df_empresas.columns
+            or df_labs is None or df_labs.empty or CITY_KEY not in df_labs.columns):
+        return out
+
+    # Municípios distintos das empresas com coordenada
+    codes_emp, municipios_emp = pd.factorize(df_empresas[CITY_KEY].to_numpy())
+    tem_coord = np.isin(municipios_emp, centroids.index.to_numpy())
+    emp_coords = centroids.reindex(municipios_emp)[['latitude', 'longitude']].to_numpy()
+
+    _, pcl_coords, pcl_total, pcl_ativos, pcl_ref = _pcl_municipios(df_labs, centroids)
+    ativos_cols = np.flatnonzero(pcl_ativos > 0)
+
+    m = len(municipios_emp)
+    distancia = np.full(m, np.nan)
+    ref = np.full(m, -1, dtype=np.int64)
+    no_raio = np.full(m, -1, dtype=np.int64)
+    ativos_no_raio = np.full(m, -1, dtype=np.int64)
+
+    linhas = np.flatnonzero(tem_coord)
+    for inicio in range(0, len(linhas), BLOCO_MUNICIPIOS):
+        bloco = linhas[inicio:inicio + BLOCO_MUNICIPIOS]
+        if len(pcl_coords) == 0:
+            no_raio[bloco] = 0
+            ativos_no_raio[bloco] = 0
+            continue
+        dist = haversine_km(emp_coords[bloco, 0:1], emp_coords[bloco, 1:2],
+                            pcl_coords[None, :, 0], pcl_coords[None, :, 1])
+        dentro = dist <= raio_km
+        no_raio[bloco] = dentro @ pcl_total
+        ativos_no_raio[bloco] = dentro @ pcl_ativos
+        if len(ativos_cols):
+            d_ativos = dist[:, ativos_cols]
+            mais_proximo = d_ativos.argmin(axis=1)
+            distancia[bloco] = d_ativos[np.arange(len(bloco)), mais_proximo]
+            ref[bloco] = pcl_ref[ativos_cols[mais_proximo]]
+
+    # Espalhar dos municípios para as linhas (código -1 = sem cidade)
+    validos = codes_emp >= 0
+    c = codes_emp[validos]
+    out.loc[validos, 'distancia_pcl_km'] = np.round(distancia[c], 1)
+    out.loc[validos, 'pcls_no_raio'] = no_raio[c]
+    out.loc[validos, 'pcls_ativos_no_raio'] = ativos_no_raio[c]
+
+    pos_pcl = np.full(n, -1, dtype=np.int64)
+    pos_pcl[validos] = ref[c]
+    tem_pcl = pos_pcl >= 0
+    for destino, origem in (('pcl_proximo_cnpj', 'cnpj'), ('pcl_proximo_nome', 'razao_social'),
+                            ('pcl_proximo_cidade', 'cidade'), ('pcl_proximo_uf', 'uf')):
+        if origem in df_labs.columns:
+            out.loc[tem_pcl, destino] = df_labs[origem].astype(object).to_numpy()[pos_pcl[tem_pcl]]
+    return out
@@ -0,0 +1,105 @@
+"""
+Testes da resolução de cabeçalhos (mapeamento direto, heurísticas e memoização)
+e das máscaras de status de data_processing.
+
+Rodar com: python -m pytest test_data_processing.py -q
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing import (
+    COLUMN_HEURISTICS, COLUMN_MAPPING, STATUS_DTYPE, column_mapping_report,
+    normalize_column_names, resolve_column_mapping, status_from_mask, truthy_mask,
+)
+
+
+def test_mapeamento_direto_normaliza_caixa_e_espacos():
+    resolucao = resolve_column_mapping(('  CNPJ da Empresa ', 'Razão Social', 'Estado', 'Acumulado de Coletas'))
+    assert resolucao.names == ('cnpj', 'razao_social', 'uf', 'acumulado_coletas')
+    assert [regra for _, _, regra in resolucao.report] == ['direto'] * 4
+
+
+def test_todo_o_mapeamento_direto_e_resolvido():
+    resolucao = resolve_column_mapping(tuple(COLUMN_MAPPING))
+    assert resolucao.names == tuple(COLUMN_MAPPING.values())
+
+
+# Um cabeçalho por regra de COLUMN_HEURISTICS (acentos corrompidos por encoding)
+HEURISTICAS = [
+    ('RazÃ£o Social', 'razao_social'),
+    ('Nome Fantasia (loja)', 'nome_fantasia'),
+    ('Data da Ãšltima Coleta', 'data_ultima_coleta'),
+    ('Ãšltima Coleta (Voucher)', 'ultima_coleta_voucher'),
+    ('Ãšltima Coleta (NÃ£o-Voucher)', 'ultima_coleta_nao_voucher'),
+    ('Dias sem coleta [Voucher]', 'dias_sem_coleta_voucher'),
+    ('Dias sem coleta (NÃ£o-Voucher)', 'dias_sem_coleta_nao_voucher'),
+]
+
+
+def test_ha_um_caso_por_heuristica():
+    assert sorted(alvo for _, alvo in HEURISTICAS) == sorted(alvo for alvo, _ in COLUMN_HEURISTICS)
+
+
+@pytest.mark.parametrize('original, canonica', HEURISTICAS)
+def test_heuristica_por_substring(original, canonica):
+    resolucao = resolve_column_mapping(('cnpj', original))
+    assert resolucao.names == ('cnpj', canonica)
+    assert resolucao.report[1] == (original, canonica, f'heuristica:{canonica}')
+
+
+def test_heuristica_nao_sobrescreve_coluna_canonica_existente():
+    resolucao = resolve_column_mapping(('Razão Social', 'RazÃ£o Social (antiga)'))
+    assert resolucao.names == ('razao_social', 'razã£o social (antiga)')
+    assert [regra for _, _, regra in resolucao.report] == ['direto', None]
+
+
+def test_colunas_sem_regra_e_nao_texto_sao_mantidas():
+    resolucao = resolve_column_mapping(('Observação', 3))
+    assert resolucao.names == ('observação', 3)
+    assert resolucao.report == (('Observação', 'observação', None), (3, 3, None))
+
+
+def test_relatorio_por_coluna():
+    df = pd.DataFrame(columns=['CNPJ', 'RazÃ£o Social', 'Extra'])
+    relatorio = column_mapping_report(df)
+    assert list(relatorio.columns) == ['original', 'canonica', 'regra']
+    assert relatorio['original'].tolist() == ['CNPJ', 'RazÃ£o Social', 'Extra']
+    assert relatorio['canonica'].tolist() == ['cnpj', 'razao_social', 'extra']
+    assert relatorio['regra'].tolist()[:2] == ['direto', 'heuristica:razao_social']
+    assert pd.isna(relatorio['regra'].iloc[2])
+
+
+def test_memoizado_por_assinatura_do_cabecalho():
+    cabecalho = ('CNPJ', 'Cidade', 'UF', 'Coluna de memoizacao')
+    primeira = resolve_column_mapping(cabecalho)
+    hits = resolve_column_mapping.cache_info().hits
+    assert resolve_column_mapping(cabecalho) is primeira
+    assert resolve_column_mapping.cache_info().hits == hits + 1
+    assert resolve_column_mapping(cabecalho[::-1]) is not primeira
+
+
+def test_normalize_column_names_nao_altera_o_original():
+    df = pd.DataFrame({'CNPJ': ['1'], 'Cidade': ['Campinas']})
+    normalizado = normalize_column_names(df)
+    assert list(normalizado.columns) == ['cnpj', 'cidade']
+    assert list(df.columns) == ['CNPJ', 'Cidade']
+
+
+def test_status_from_mask():
+    status = status_from_mask(np.array([True, False, True]))
+    assert status.dtype == STATUS_DTYPE
+    assert list(status) == ['Ativo', 'Inativo', 'Ativo']
+    assert list(status_from_mask(pd.Series([1, 0]))) == ['Ativo', 'Inativo']
+
+
+def test_truthy_mask_regra_original():
+    valores = pd.Series([True, 'TRUE', 'true', 'True ', 'false', False, 1, 0, None, np.nan, 'sim'], dtype=object)
+    esperado = np.array([x == True or str(x).lower() == 'true' for x in valores], dtype=bool)
+    assert truthy_mask(valores).tolist() == esperado.tolist()
+
+
+def test_truthy_mask_booleanos_e_vazio():
+    assert truthy_mask(pd.Series([True, None, False], dtype='boolean')).tolist() == [True, False, False]
+    assert truthy_mask(pd.Series([], dtype=object)).tolist() == []
+    assert truthy_mask(pd.Series([None, None], dtype=object)).tolist() == [False, False]
@@ -0,0 +1,202 @@
+"""
+Testes do cache de conteúdo e da listagem paginada do SPConnector contra um stub HTTP do Graph.
+
+Rodar com: python -m unittest test_sp_blob_cache -v
+"""
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+
+from sp_connector import SPConnector, _BlobCache
+
+ITEM_PATH = "Relatorios/base.xlsx"
+
+
+class _GraphStub:
+    """Um único arquivo (id fixo) com conteúdo e eTag alteráveis pelo teste"""
+
+    def __init__(self):
+        self.item_id = "ITEM1"
+        self.etag = '"{v1},1"'
+        self.content = b"versao 1"
+        self.meta_gets = 0
+        self.not_modified = 0
+        self.content_gets = 0
+        # Listagem da pasta: itens, tamanho de página e página (1-based) que recusa $orderby
+        self.children = [{"id": f"F{i}", "name": f"f{i}.xlsx", "file": {}} for i in range(5)]
+        self.page_size = 2
+        self.orderby_fails_on_page = None
+        # Respostas 429 (Retry-After: 0) antes de atender o GET de metadados
+        self.throttle = 0
+        self.lock = threading.Lock()
+
+    def update(self, etag, content):
+        with self.lock:
+            self.etag, self.content = etag, content
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b"", content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            partes = urlsplit(self.path)
+            path, query = unquote(partes.path), parse_qs(partes.query)
+            with stub.lock:
+                if path == "/me/drive/root:/Pasta:/children":
+                    pagina = int(query.get("page", ["1"])[0])
+                    if "$orderby" in query and pagina == stub.orderby_fails_on_page:
+                        return self._send(400, b'{"error": {"code": "invalidRequest"}}')
+                    inicio = (pagina - 1) * stub.page_size
+                    payload = {"value": stub.children[inicio:inicio + stub.page_size]}
+                    if inicio + stub.page_size < len(stub.children):
+                        seguinte = dict(query, page=[str(pagina + 1)])
+                        qs = "&".join(f"{k}={v[0]}" for k, v in seguinte.items())
+                        payload["@odata.nextLink"] = f"http://{self.headers['Host']}{partes.path}?{qs}"
+                    return self._send(200, json.dumps(payload).encode("utf-8"))
+                if path == f"/me/drive/root:/{ITEM_PATH}:":
+                    if stub.throttle:
+                        stub.throttle -= 1
+                        self.send_response(429)
+                        self.send_header("Retry-After", "0")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    stub.meta_gets += 1
+                    if self.headers.get("If-None-Match") == stub.etag:
+                        stub.not_modified += 1
+                        return self._send(304)
+                    item = {"id": stub.item_id, "name": "base.xlsx", "size": len(stub.content),
+                            "eTag": stub.etag, "cTag": stub.etag,
+                            "lastModifiedDateTime": "2026-01-01T00:00:00Z", "file": {}}
+                    return self._send(200, json.dumps(item).encode("utf-8"))
+                if path == f"/me/drive/items/{stub.item_id}/content":
+                    stub.content_gets += 1
+                    return self._send(200, stub.content, "application/octet-stream")
+            return self._send(404, b'{"error": {"code": "itemNotFound"}}')
+
+    return Handler
+
+
+class _StubGraphTest(unittest.TestCase):
+    """Sobe o stub do Graph numa porta livre e cria conectores apontando para ele"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stub = _GraphStub()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self.stub))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def connector(self):
+        """Conector novo (sem stat em memória), com o cache em disco compartilhado"""
+        root = Path(self.tmp.name)
+        return SPConnector("t", "c", "s", user_upn="u@x", access_token="tok",
+                           cache_dir=root / "blobs", delta_dir=root / "delta",
+                           graph_url=f"http://127.0.0.1:{self.server.server_address[1]}")
+
+
+class BlobCacheDownloadTest(_StubGraphTest):
+    def test_200_grava_blob(self):
+        self.assertEqual(self.connector().download(ITEM_PATH), b"versao 1")
+        self.assertEqual(self.stub.content_gets, 1)
+        blobs = list((Path(self.tmp.name) / "blobs").glob("*.bin"))
+        self.assertEqual(len(blobs), 1)
+        self.assertEqual(blobs[0].read_bytes(), b"versao 1")
+
+    def test_304_devolve_bytes_locais(self):
+        self.connector().download(ITEM_PATH)
+        self.assertEqual(self.connector().download(ITEM_PATH), b"versao 1")
+        self.assertEqual(self.stub.not_modified, 1)
+        self.assertEqual(self.stub.content_gets, 1)
+
+    def test_etag_novo_baixa_de_novo(self):
+        self.connector().download(ITEM_PATH)
+        self.stub.update('"{v2},2"', b"versao 2")
+        self.assertEqual(self.connector().download(ITEM_PATH), b"versao 2")
+        self.assertEqual(self.stub.content_gets, 2)
+        # Só a versão atual do item fica no disco
+        blobs = list((Path(self.tmp.name) / "blobs").glob("*.bin"))
+        self.assertEqual([b.read_bytes() for b in blobs], [b"versao 2"])
+
+
+class RetryTest(_StubGraphTest):
+    def test_respostas_429_descartadas_sao_fechadas(self):
+        self.stub.throttle = 2
+        conn = self.connector()
+        fechadas = []
+        request = conn._http.request
+
+        def registra(*args, **kwargs):
+            response = request(*args, **kwargs)
+            close = response.close
+            response.close = lambda: (fechadas.append(response.status_code), close())
+            return response
+
+        conn._http.request = registra
+        try:
+            self.assertEqual(conn.download(ITEM_PATH), b"versao 1")
+        finally:
+            del conn._http.request
+        self.assertEqual(fechadas, [429, 429])
+        self.assertEqual(conn.stats()["download_meta"]["throttled"], 2)
+
+
+class ListingFallbackTest(_StubGraphTest):
+    def names(self, **kwargs):
+        return [item["name"] for item in self.connector().iter_files("Pasta", **kwargs)]
+
+    def test_orderby_recusado_na_primeira_pagina_repete_sem_ordem(self):
+        self.stub.orderby_fails_on_page = 1
+        self.assertEqual(self.names(orderby="name"), [f"f{i}.xlsx" for i in range(5)])
+
+    def test_falha_em_pagina_seguinte_nao_duplica_itens(self):
+        self.stub.orderby_fails_on_page = 2
+        vistos = []
+        with self.assertRaises(requests.HTTPError):
+            for item in self.connector().iter_files("Pasta", orderby="name"):
+                vistos.append(item["name"])
+        self.assertEqual(vistos, ["f0.xlsx", "f1.xlsx"])
+
+
+class BlobCacheIndexTest(unittest.TestCase):
+    def test_instancias_no_mesmo_diretorio_nao_perdem_entradas(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            caches = [_BlobCache(tmp) for _ in range(4)]
+
+            def grava(i):
+                for j in range(25):
+                    caches[i].store(f"k{i}-{j}", f"id{i}-{j}", "e1", b"x")
+
+            threads = [threading.Thread(target=grava, args=(i,)) for i in range(len(caches))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            index = json.loads((Path(tmp) / "index.json").read_text(encoding="utf-8"))
+            self.assertEqual(len(index), 100)
+            for cache in caches:
+                self.assertIsNotNone(cache.lookup("k3-24"))
+
+
+if __name__ == "__main__":
+    unittest.main()
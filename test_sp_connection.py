@@ -171,5 +171,18 @@ except Exception as e:
     st.error(f"❌ Erro ao testar função: {e}")
     st.code(str(e))
 
+# Estatísticas das chamadas ao Graph feitas neste teste
+st.subheader("7. Latência das Chamadas ao Graph")
+stats = sp_connector.stats()
+if stats:
+    st.dataframe(
+        [{"Operação": op, **{k: round(v, 3) if isinstance(v, float) else v for k, v in valores.items()}}
+         for op, valores in stats.items()],
+        use_container_width=True,
+        hide_index=True
+    )
+else:
+    st.info("Nenhuma chamada registrada.")
+
 st.markdown("---")
 st.caption("Teste concluído. Verifique os resultados acima para identificar problemas na conexão ou caminhos.")
@@ -0,0 +1,110 @@
+# uf_cube.py
+"""
+Cubo agregado UF × status × base (PCLs/Empresas), montado uma vez por snapshot.
+
+Cada linha do cubo é um grupo (base, uf, status) com o número de linhas,
+cidades distintas e, por coluna de valor (coletas, vouchers), soma, contagem
+de não nulos, máximo, mediana e linhas com valor > 0. Os totais por UF, por
+status e gerais entram como linhas de rollup com TODOS na chave, porque
+cidades distintas e medianas não se somam a partir dos grupos.
+
+Os cards, listas de top UFs e gráficos por estado da Visão Geral e da Análise
+de Coletas leem o cubo (dezenas de linhas) em vez de refazer filtros e
+groupby sobre as bases a cada rerun.
+"""
+import numpy as np
+import pandas as pd
+
+# Valor da chave nas linhas de rollup (todas as UFs / todos os status)
+TODOS = '*'
+
+# Colunas de valor agregadas por base
+VALUE_COLUMNS = {
+    'labs': ('acumulado_coletas',),
+    'empresas': ('acumulado_vouchers',),
+}
+
+# Agrupamentos materializados: (por UF, por status)
+_ROLLUPS = ((True, True), (True, False), (False, True), (False, False))
+
+
+def _key(df, column, usar):
+    if usar and column in df.columns:
+        return df[column].astype(object).to_numpy()
+    return np.full(len(df), TODOS, dtype=object)
+
+
+def _entity_cube(df, entity, value_columns) -> pd.DataFrame:
+    """Linhas do cubo de uma base (grupos e rollups)"""
+    base = pd.DataFrame({'cidade': df['cidade'] if 'cidade' in df.columns else np.nan}, index=df.index)
+    agregacoes = {'linhas': ('cidade', 'size'), 'cidades': ('cidade', 'nunique')}
+    for col in value_columns:
+        if col not in df.columns:
+            continue
+        valores = pd.to_numeric(df[col], errors='coerce')
+        base[col] = valores
+        base[f'_pos_{col}'] = (valores.fillna(0) > 0).astype(np.int64)
+        agregacoes.update({
+            f'soma_{col}': (col, 'sum'),
+            f'n_{col}': (col, 'count'),
+            f'max_{col}': (col, 'max'),
+            f'mediana_{col}': (col, 'median'),
+            f'positivos_{col}': (f'_pos_{col}', 'sum'),
+        })
+
+    partes = []
+    for por_uf, por_status in _ROLLUPS:
+        if (por_uf and 'uf' not in df.columns) or (por_status and 'status' not in df.columns):
+            continue
+        chaves = [pd.Series(_key(df, 'uf', por_uf), index=df.index, name='uf'),
+                  pd.Series(_key(df, 'status', por_status), index=df.index, name='status')]
+        partes.append(base.groupby(chaves, dropna=True, sort=True).agg(**agregacoes).reset_index())
+
+    cubo = pd.concat(partes, ignore_index=True)
+    cubo.insert(0, 'base', entity)
+    return cubo
+
+
+def build_uf_cube(frames, value_columns=VALUE_COLUMNS) -> pd.DataFrame:
+    """
+    Cubo de todas as bases.
+
+    Args:
+        frames: {base: DataFrame} (ex.: {'labs': df_labs, 'empresas': df_empresas})
+        value_columns: {base: colunas numéricas a agregar}
+
+    Returns:
+        DataFrame com base, uf, status, linhas, cidades e as métricas das colunas de valor
+    """
+    partes = [_entity_cube(df, entity, value_columns.get(entity, ()))
+              for entity, df in frames.items() if df is not None and not df.empty]
+    if not partes:
+        return pd.DataFrame(columns=['base', 'uf', 'status', 'linhas', 'cidades'])
+    return pd.concat(partes, ignore_index=True)
+
+
+def cube_totals(cube, entity, uf=TODOS, status=TODOS) -> pd.Series:
+    """Métricas de um grupo do cubo (zeros quando a base/grupo não existe)"""
+    linha = cube[(cube['base'] == entity) & (cube['uf'] == uf) & (cube['status'] == status)]
+    if linha.empty:
+        return pd.Series(0, index=cube.columns.drop(['base', 'uf', 'status']), dtype=float)
+    return linha.iloc[0].drop(['base', 'uf', 'status'])
+
+
+def cube_by_uf(cube, entity, status=TODOS) -> pd.DataFrame:
+    """Métricas por UF de uma base (um status ou todos), índice = UF"""
+    linhas = cube[(cube['base'] == entity) & (cube['uf'] != TODOS) & (cube['status'] == status)]
+    return linhas.drop(columns=['base', 'status']).set_index('uf')
+
+
+def cube_status_by_uf(cube, entity, statuses=('Ativo', 'Inativo')) -> pd.DataFrame:
+    """Tabela UF × status com o número de linhas (entrada de chart_builder.grouped_bar_figure)"""
+    linhas = cube[(cube['base'] == entity) & (cube['uf'] != TODOS) & (cube['status'] != TODOS)]
+    tabela = linhas.pivot(index='uf', columns='status', values='linhas').fillna(0).astype(np.int64)
+    return tabela[[s for s in statuses if s in tabela.columns]]
+
+
+def mean_of(metricas, column, denominador='n') -> float:
+    """Média da coluna: soma / não nulos ('n') ou soma / linhas ('linhas')"""
+    total = metricas.get(f'n_{column}' if denominador == 'n' else 'linhas', 0)
+    return float(metricas.get(f'soma_{column}', 0)) / total if total else 0.0